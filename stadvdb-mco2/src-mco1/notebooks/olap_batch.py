@@ -0,0 +1,316 @@
+import inspect
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from olap_queries import OLAP, StreamedResult
+
+TELEVISION = ('tvEpisode', 'tvMiniSeries', 'tvMovie', 'tvPilot', 'tvSeries', 'tvShort', 'tvSpecial')
+FILM = ('movie', 'short', 'video')
+BROAD_TYPES = {**{t: 'Television' for t in TELEVISION}, **{t: 'Film' for t in FILM}}
+
+# Column of the shared scan -> its expression over fact_title_ratings ftr,
+# dim_title dt, dim_date dd (the rating's date) and dim_date dy (the title's
+# start year, as t_test_2 joins it).
+SCAN_COLUMNS = {
+    "average_rating": "ftr.average_rating",
+    "num_votes": "ftr.num_votes",
+    "primary_title": "dt.primary_title",
+    "title_type": "dt.title_type",
+    "start_year": "dt.start_year",
+    "is_adult": "dt.is_adult",
+    "genre_1": "dt.genre_1",
+    "has_parent": "dt.parent_tconst IS NOT NULL",
+    "decade": "dd.decade",
+    "start_century": "dy.century",
+}
+
+
+def flags(condition):
+    """Boolean array of a comparison on nullable columns; NULL counts as
+    false, as in a WHERE clause.
+    """
+    return pd.Series(condition).to_numpy(dtype=bool, na_value=False)
+
+
+class Moments(object):
+    """Count, mean and sum of squared deviations of a column, merged batch by
+    batch (Chan et al.) so the variance stays exact on large values.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values):
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        delta = mean - self.mean
+        total = self.n + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+
+    @property
+    def variance(self):
+        """Sample variance, NaN below two values like VAR_SAMP's NULL."""
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+
+class RowsConsumer(object):
+    def __init__(self, mask, columns, order_by, descending=False, reads=(), title_types=None):
+        """Collects the matching rows of the scan, like a query without
+        GROUP BY
+        Arguments:
+            mask {function} -- frame -> boolean array of the rows to keep.
+            columns {dict} -- Scan column -> output column name.
+            order_by {string} -- Output column the result is sorted on.
+            reads {tuple} -- Scan columns mask reads.
+            title_types {set} -- Title types the rows can have, None for any.
+        """
+        self.mask = mask
+        self.columns = columns
+        self.order_by = order_by
+        self.descending = descending
+        self.reads = set(reads) | set(columns)
+        self.title_types = title_types
+        self.parts = []
+
+    def consume(self, frame):
+        rows = frame.loc[self.mask(frame), list(self.columns)]
+        if len(rows):
+            self.parts.append(rows)
+
+    def result(self):
+        if self.parts:
+            frame = pd.concat(self.parts, ignore_index=True)
+        else:
+            frame = pd.DataFrame(columns=list(self.columns))
+        frame = frame.rename(columns=self.columns)
+        return frame.sort_values(self.order_by, ascending=not self.descending, kind="stable", ignore_index=True)
+
+
+class GroupConsumer(object):
+    def __init__(self, mask, key, value, finish, reads=(), title_types=None):
+        """Accumulates Moments of one column per group, like a query with
+        GROUP BY
+        Arguments:
+            mask {function} -- frame -> boolean array of the rows to keep.
+            key {function} -- frame -> group label of every row.
+            value {string} -- Scan column the moments are taken of; NULLs
+            are skipped as by COUNT/AVG/VAR_SAMP.
+            finish {function} -- {label: Moments} -> result DataFrame.
+            reads {tuple} -- Scan columns mask and key read.
+            title_types {set} -- Title types the rows can have, None for any.
+        """
+        self.mask = mask
+        self.key = key
+        self.value = value
+        self.finish = finish
+        self.reads = set(reads) | {value}
+        self.title_types = title_types
+        self.groups = {}
+
+    def consume(self, frame):
+        keep = self.mask(frame)
+        if not keep.any():
+            return
+        values = frame[self.value].to_numpy(dtype=float, na_value=np.nan)
+        keep = keep & ~np.isnan(values)
+        labels = np.asarray(self.key(frame), dtype=object)[keep]
+        values = values[keep]
+        for label in pd.unique(labels):
+            self.groups.setdefault(label, Moments()).add(values[labels == label])
+
+    def result(self):
+        return self.finish(self.groups)
+
+
+def t_test_frame(first, second, t_column, n_columns):
+    """Builds a t_test_* result from the Moments of its two groups: one row,
+    or none when a group is empty, as the SQL cross join returns.
+    """
+    def finish(groups):
+        a, b = groups.get(first), groups.get(second)
+        if a is None or b is None:
+            return pd.DataFrame(columns=[t_column, *n_columns])
+        t = (a.mean - b.mean) / np.sqrt(a.variance / a.n + b.variance / b.n)
+        return pd.DataFrame([[t, a.n, b.n]], columns=[t_column, *n_columns])
+    return finish
+
+
+def scan_query_1(minVotes, startYear, titleType):
+    return RowsConsumer(
+        lambda f: flags(f["decade"].notna() & (f["num_votes"] > minVotes)
+                        & (f["start_year"] == startYear) & (f["title_type"] == titleType)),
+        {"primary_title": "primary_title", "average_rating": "average_rating", "num_votes": "num_votes"},
+        "average_rating", descending=True,
+        reads=("decade", "start_year", "title_type"), title_types={titleType},
+    )
+
+def scan_query_3(minVotes):
+    def finish(groups):
+        # ROUND(AVG(...), 2) rounds the exact numeric mean half up. Ratings
+        # have one decimal, so the sum of tenths is recovered exactly from
+        # the float mean and rounded as Decimal, as olap_numpy does.
+        rows = []
+        for label, m in groups.items():
+            average = Decimal(round(m.mean * m.n * 10)) / (10 * m.n)
+            rows.append([label, m.n, float(average.quantize(Decimal("0.01"), ROUND_HALF_UP))])
+        frame = pd.DataFrame(rows, columns=["broad_type", "number_of_titles", "overall_average_rating"])
+        return frame.sort_values("overall_average_rating", ascending=False, kind="stable", ignore_index=True)
+    return GroupConsumer(
+        lambda f: flags(f["title_type"].isin(BROAD_TYPES) & (f["num_votes"] > minVotes)),
+        lambda f: f["title_type"].map(BROAD_TYPES),
+        "average_rating", finish,
+        reads=("title_type", "num_votes"), title_types=set(BROAD_TYPES),
+    )
+
+def scan_query_5(minVotes, minRating, maxRating):
+    def finish(groups):
+        rows = sorted([int(label), m.n] for label, m in groups.items())
+        return pd.DataFrame(rows, columns=["decade", "number_of_films"])
+    return GroupConsumer(
+        lambda f: flags((f["title_type"] == "movie") & f["decade"].notna() & (f["num_votes"] > minVotes)
+                        & (f["average_rating"] > minRating) & (f["average_rating"] < maxRating)),
+        lambda f: f["decade"],
+        "average_rating", finish,
+        reads=("title_type", "decade", "num_votes"), title_types={"movie"},
+    )
+
+def scan_query_7(minVotes):
+    return RowsConsumer(
+        lambda f: flags((f["title_type"] == "movie") & (f["num_votes"] > minVotes) & f["genre_1"].notna()),
+        {"genre_1": "genre", "average_rating": "rating", "num_votes": "votes"},
+        "genre",
+        reads=("title_type",), title_types={"movie"},
+    )
+
+def scan_t_test_1():
+    return GroupConsumer(
+        lambda f: flags((f["title_type"] == "movie") & f["is_adult"].notna()),
+        lambda f: f["is_adult"],
+        "average_rating",
+        t_test_frame(False, True, "t_statistic_adult_vs_non_adult_rating", ("n_non_adult", "n_adult")),
+        reads=("title_type", "is_adult"), title_types={"movie"},
+    )
+
+def scan_t_test_2():
+    return GroupConsumer(
+        lambda f: flags((f["title_type"] == "movie") & f["start_century"].isin([1800, 1900])),
+        lambda f: f["start_century"],
+        "average_rating",
+        t_test_frame(1800, 1900, "t_statistic_century_rating_comparison", ("n_19th", "n_20th")),
+        reads=("title_type", "start_century"), title_types={"movie"},
+    )
+
+def scan_t_test_3():
+    return GroupConsumer(
+        lambda f: flags((f["title_type"] == "movie") & f["genre_1"].isin(["Action", "Comedy"])),
+        lambda f: f["genre_1"],
+        "num_votes",
+        t_test_frame("Action", "Comedy", "t_statistic_action_vs_comedy_votes", ("n_action", "n_comedy")),
+        reads=("title_type", "genre_1"), title_types={"movie"},
+    )
+
+def scan_t_test_5():
+    return GroupConsumer(
+        lambda f: np.ones(len(f), dtype=bool),
+        lambda f: f["has_parent"],
+        "num_votes",
+        t_test_frame(True, False, "t_statistic_franchise_vs_standalone_votes", ("n_franchise", "n_standalone")),
+        reads=("has_parent",),
+    )
+
+# OLAP method -> consumer answering it from the shared scan. Takes the
+# method's arguments, defaults filled in from its signature.
+SCANS = {
+    "query_1": scan_query_1,
+    "query_3": scan_query_3,
+    "query_5": scan_query_5,
+    "query_7": scan_query_7,
+    "t_test_1": scan_t_test_1,
+    "t_test_2": scan_t_test_2,
+    "t_test_3": scan_t_test_3,
+    "t_test_5": scan_t_test_5,
+}
+
+
+def scan_query(consumers):
+    """Builds the single query over fact_title_ratings ⋈ dim_title feeding
+    every consumer: only the columns they read, and a title type filter when
+    all of them restrict the title type.
+    """
+    reads = set().union(*(c.reads for c in consumers))
+    columns = [f"{expression} AS {name}" for name, expression in SCAN_COLUMNS.items() if name in reads]
+    joins = []
+    if "decade" in reads:
+        joins.append("LEFT JOIN dw_schema.dim_date AS dd ON ftr.date_key = dd.date_key")
+    if "start_century" in reads:
+        joins.append("LEFT JOIN dw_schema.dim_date AS dy ON dt.start_year = dy.year")
+    where, params = "", {}
+    if all(c.title_types is not None for c in consumers):
+        where = "WHERE dt.title_type = ANY(:types)"
+        params["types"] = sorted(set().union(*(c.title_types for c in consumers)))
+    query = f"""
+        SELECT {", ".join(columns)}
+        FROM dw_schema.fact_title_ratings AS ftr
+        JOIN dw_schema.dim_title AS dt
+            ON ftr.title_key = dt.title_key
+        {" ".join(joins)}
+        {where}
+    """
+    return text(query), params
+
+
+def result_frame(result):
+    return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+class BatchOLAP(object):
+    def __init__(self, engine, batch_size: int = 200_000):
+        """Class constructor for BatchOLAP, which answers a batch of OLAP
+        calls with a single pass over fact_title_ratings
+        Arguments:
+            engine {Engine} - An Engine instance
+            batch_size {integer} -- Rows of the shared scan fetched from the
+            server per batch.
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.olap = OLAP(engine)
+
+    def run(self, calls):
+        """Runs a batch of OLAP method calls. Those in SCANS are fused into
+        one streamed scan and aggregated client-side; the others (query_2,
+        query_4_*, query_6, t_test_4) run as usual.
+        Arguments:
+            calls {list} -- (method name, params dict or None) pairs, as for
+            AsyncOLAP.run_many.
+        Returns:
+            list -- One DataFrame per call, in the order of calls
+        """
+        results = [None] * len(calls)
+        consumers = {}
+        for i, (method, params) in enumerate(calls):
+            if method in SCANS:
+                bound = inspect.signature(getattr(OLAP, method)).bind(self.olap, **(params or {}))
+                bound.apply_defaults()
+                arguments = dict(bound.arguments)
+                arguments.pop("self")
+                consumers[i] = SCANS[method](**arguments)
+            else:
+                results[i] = result_frame(getattr(self.olap, method)(**(params or {})))
+
+        if consumers:
+            query, params = scan_query(consumers.values())
+            for frame in StreamedResult(self.engine, query, params, self.batch_size).batches():
+                for consumer in consumers.values():
+                    consumer.consume(frame)
+            for i, consumer in consumers.items():
+                results[i] = consumer.result()
+        return results
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from olap_queries import OLAP
+
+# NULL (nothing is cached) while an in-place load is still committing stages
+GENERATION_QUERY = text("SELECT CASE WHEN NOT loading THEN generation END FROM dw_schema.etl_load_generation;")
+
+
+class CachedOLAP(OLAP):
+    def __init__(self, engine, max_bytes: int = 256 << 20, cache_dir: str = None,
+                 max_disk_bytes: int = 4 << 30, generation_ttl: float = 0.0, **kwargs):
+        """Class constructor for CachedOLAP, an OLAP whose results are cached
+        per method and parameters for as long as the warehouse is unchanged
+        Arguments:
+            engine {Engine} - An Engine instance
+            max_bytes {integer} -- Memory budget; least recently used
+            results are evicted beyond it.
+            cache_dir {string} -- Optional directory for a second, on-disk
+            tier that outlives the process.
+            max_disk_bytes {integer} -- Size budget of the on-disk tier.
+            generation_ttl {float} -- Seconds a read of the warehouse's load
+            generation is trusted. 0 checks it before every call, so a
+            cached result is never served after a load.
+            kwargs -- Passed on to OLAP (use_aggregates, backend).
+        """
+        super().__init__(engine, **kwargs)
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.generation_ttl = generation_ttl
+        self.hits = self.disk_hits = self.misses = 0
+        self._entries = OrderedDict() # key -> (size, frozen result)
+        self._bytes = 0
+        self._generation = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def load_generation(self):
+        """Returns the warehouse's load generation (stamped by ETL.py), or
+        None when the warehouse has no stamp or is being loaded, in which
+        case nothing is cached.
+        """
+        now = time.monotonic()
+        if self._generation is not None and now - self._checked_at < self.generation_ttl:
+            return self._generation
+        try:
+            with self.engine.connect() as connection:
+                generation = connection.execute(GENERATION_QUERY).scalar()
+        except DBAPIError:
+            generation = None
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._bytes = 0
+                self._generation = generation
+                self._aggregates = None # A new load may have added or dropped aggregates
+                self._prune_disk(generation)
+            self._checked_at = now
+        return generation
+
+    @staticmethod
+    def cache_key(name, params):
+        payload = json.dumps([name, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _execute(self, name, query, params=None):
+        generation = self.load_generation()
+        if generation is None:
+            return super()._execute(name, query, params)
+
+        key = self.cache_key(name, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]()
+
+        blob = self._read_disk(generation, key)
+        if blob is not None:
+            frozen = pickle.loads(blob)
+            self.disk_hits += 1
+        else:
+            query = self._route(name, query, params)
+            with self.engine.connect() as connection:
+                frozen = connection.execute(query, params or {}).freeze()
+            blob = pickle.dumps(frozen, protocol=pickle.HIGHEST_PROTOCOL)
+            self.misses += 1
+            self._write_disk(generation, key, blob)
+        self._remember(generation, key, len(blob), frozen)
+        return frozen()
+
+    def _remember(self, generation, key, size, frozen):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation or key in self._entries:
+                return
+            self._entries[key] = (size, frozen)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _disk_path(self, generation, key):
+        return os.path.join(self.cache_dir, f"{generation}-{key}.pkl")
+
+    def _read_disk(self, generation, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(generation, key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return None
+        os.utime(path) # Recency for the disk tier's LRU eviction
+        return blob
+
+    def _write_disk(self, generation, key, blob):
+        if not self.cache_dir or len(blob) > self.max_disk_bytes:
+            return
+        path = self._disk_path(generation, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, old_path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            if old_path != path:
+                self._remove(old_path)
+                total -= size
+
+    def _prune_disk(self, generation):
+        """Deletes on-disk entries stamped with another load generation."""
+        if not self.cache_dir:
+            return
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pkl") and not entry.name.startswith(f"{generation}-"):
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def cache_info(self):
+        with self._lock:
+            return {
+                "generation": self._generation,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self.cache_dir:
+                self._prune_disk(None)
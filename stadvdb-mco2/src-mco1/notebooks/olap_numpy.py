@@ -0,0 +1,335 @@
+import json
+import os
+import shutil
+import uuid
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from olap_queries import StreamedResult
+from olap_batch import BROAD_TYPES, Moments, t_test_frame
+from olap_cache import GENERATION_QUERY
+
+NULL_INT = np.iinfo(np.int32).min   # NULL in integer columns
+NULL_CODE = -1                      # NULL in boolean and categorical columns
+
+# Snapshot tables: name -> (query, {column: kind}). "ratings" is the fact
+# table joined to the title and date attributes the queries read, "titles"
+# is every title (query_2 and t_test_4 do not need a rating).
+SNAPSHOT_TABLES = {
+    "ratings": ("""
+        SELECT
+            (ftr.average_rating * 10)::int AS rating_tenths,
+            ftr.num_votes,
+            dt.title_type,
+            dt.genre_1,
+            dt.is_adult,
+            dt.parent_tconst IS NOT NULL AS has_parent,
+            dt.start_year,
+            dd.decade AS date_decade,
+            dy.century AS start_century,
+            dt.primary_title
+        FROM dw_schema.fact_title_ratings AS ftr
+        JOIN dw_schema.dim_title AS dt
+            ON ftr.title_key = dt.title_key
+        LEFT JOIN dw_schema.dim_date AS dd
+            ON ftr.date_key = dd.date_key
+        LEFT JOIN dw_schema.dim_date AS dy
+            ON dt.start_year = dy.year
+    """, {
+        "rating_tenths": "int", "num_votes": "int", "title_type": "category", "genre_1": "category",
+        "is_adult": "bool", "has_parent": "bool", "start_year": "int", "date_decade": "int",
+        "start_century": "int", "primary_title": "string",
+    }),
+    "titles": ("""
+        SELECT dt.title_type, dt.start_year, dt.end_year, dy.decade AS start_decade
+        FROM dw_schema.dim_title AS dt
+        LEFT JOIN dw_schema.dim_date AS dy
+            ON dt.start_year = dy.year
+    """, {
+        "title_type": "category", "start_year": "int", "end_year": "int", "start_decade": "int",
+    }),
+}
+
+
+def encode(values, kind):
+    """Converts one batch column to its stored representation (categories
+    and strings stay objects until the whole column is known).
+    """
+    if kind == "int":
+        return pd.array(values, dtype="Int64").to_numpy(dtype=np.int64, na_value=NULL_INT).astype(np.int32)
+    if kind == "bool":
+        return pd.array(values, dtype="boolean").to_numpy(dtype=np.int8, na_value=NULL_CODE)
+    return pd.array(values, dtype="string").to_numpy(dtype=object, na_value=None)
+
+
+def write_column(path, table, column, kind, parts):
+    """Writes one column as .npy files. Categories become int16 codes into
+    a sorted vocabulary (returned), strings a UTF-8 blob with offsets.
+    """
+    values = np.concatenate(parts) if parts else np.empty(0, dtype=object if kind in ("category", "string") else np.int32)
+    prefix = os.path.join(path, f"{table}.{column}")
+    if kind == "category":
+        codes, vocabulary = pd.factorize(values, sort=True, use_na_sentinel=True)
+        np.save(f"{prefix}.npy", codes.astype(np.int16))
+        return [str(v) for v in vocabulary]
+    if kind == "string":
+        encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(f"{prefix}.offsets.npy", offsets)
+        np.save(f"{prefix}.blob.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(f"{prefix}.null.npy", np.fromiter((v is None for v in values), dtype=bool, count=len(values)))
+        return None
+    np.save(f"{prefix}.npy", values)
+    return None
+
+
+def load_generation(engine):
+    try:
+        with engine.connect() as connection:
+            return connection.execute(GENERATION_QUERY).scalar()
+    except DBAPIError:
+        return None
+
+
+def snapshot(engine, path, batch_size: int = 200_000):
+    """Copies the star schema into a column store at path: one .npy file per
+    column plus manifest.json, stamped with the warehouse's load generation.
+    Tables are read through server-side cursors; the store is written to a
+    temporary directory and renamed into place.
+    """
+    generation = load_generation(engine)
+    tmp_path = f"{path.rstrip(os.sep)}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_path)
+    try:
+        manifest = {"generation": generation, "tables": {}}
+        for table, (query, columns) in SNAPSHOT_TABLES.items():
+            parts = {column: [] for column in columns}
+            rows = 0
+            for frame in StreamedResult(engine, text(query), batch_size=batch_size).batches():
+                rows += len(frame)
+                for column, kind in columns.items():
+                    parts[column].append(encode(frame[column], kind))
+            vocabularies = {}
+            for column, kind in columns.items():
+                vocabulary = write_column(tmp_path, table, column, kind, parts.pop(column))
+                if vocabulary is not None:
+                    vocabularies[column] = vocabulary
+            manifest["tables"][table] = {"rows": rows, "columns": columns, "vocabularies": vocabularies}
+        with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return ColumnStore(path)
+
+
+class ColumnStore(object):
+    def __init__(self, path):
+        """Opens a snapshot written by snapshot(); every column is memory
+        mapped, so opening is instant and pages are read on first use.
+        """
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.generation = self.manifest["generation"]
+        self.tables = {}
+        for table, info in self.manifest["tables"].items():
+            columns = {}
+            for column, kind in info["columns"].items():
+                prefix = os.path.join(path, f"{table}.{column}")
+                if kind == "string":
+                    columns[column] = tuple(np.load(f"{prefix}.{part}.npy", mmap_mode="r") for part in ("offsets", "blob", "null"))
+                else:
+                    columns[column] = np.load(f"{prefix}.npy", mmap_mode="r")
+            self.tables[table] = columns
+
+    def vocabulary(self, table, column):
+        return self.manifest["tables"][table]["vocabularies"][column]
+
+    def code(self, table, column, value):
+        """Code of a category value; -2 (matching no row) if absent."""
+        vocabulary = self.vocabulary(table, column)
+        try:
+            return vocabulary.index(value)
+        except ValueError:
+            return -2
+
+    def strings(self, table, column, rows):
+        offsets, blob, null = self.tables[table][column]
+        return [None if null[i] else bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in rows]
+
+    def labels(self, table, column, codes):
+        vocabulary = self.vocabulary(table, column)
+        return [None if c == NULL_CODE else vocabulary[c] for c in codes]
+
+
+def notnull(column):
+    return column != NULL_INT
+
+def moments(labels, values):
+    """{label: Moments} of values for each distinct label."""
+    result = {}
+    for label in np.unique(labels):
+        result[label.item()] = m = Moments()
+        m.add(values[labels == label])
+    return result
+
+
+class NumPyBackend(object):
+    def __init__(self, store):
+        """Answers OLAP methods from a ColumnStore with vectorized NumPy
+        instead of SQL; pass it as OLAP(engine, backend=...). Methods
+        take the same arguments and return DataFrames with the columns of
+        the SQL results.
+        Arguments:
+            store {ColumnStore} -- The snapshot to query.
+        """
+        self.store = store
+        self.ratings = store.tables["ratings"]
+        self.titles = store.tables["titles"]
+
+    @classmethod
+    def from_engine(cls, engine, path, refresh: bool = False):
+        """Opens the snapshot at path, (re)taking it first when it is missing,
+        refresh is set, or the warehouse has been loaded since it was taken.
+        """
+        if not refresh and os.path.exists(os.path.join(path, "manifest.json")):
+            store = ColumnStore(path)
+            if store.generation is not None and store.generation == load_generation(engine):
+                return cls(store)
+        return cls(snapshot(engine, path))
+
+    def _type_is(self, table, value):
+        return self.store.tables[table]["title_type"] == self.store.code(table, "title_type", value)
+
+    def _ratings(self):
+        tenths = self.ratings["rating_tenths"]
+        return np.where(notnull(tenths), tenths / 10, np.nan)
+
+    def query_1(self, minVotes, startYear, titleType):
+        r = self.ratings
+        mask = (notnull(r["date_decade"]) & (r["num_votes"] > minVotes)
+                & (r["start_year"] == startYear) & self._type_is("ratings", titleType))
+        rows = np.flatnonzero(mask)
+        # Negated in int64 so no rating can overflow; NULL ratings are masked to
+        # the smallest key and sort first, as ORDER BY ... DESC does in Postgres.
+        tenths = r["rating_tenths"][rows]
+        key = np.where(notnull(tenths), -tenths.astype(np.int64), np.iinfo(np.int64).min)
+        rows = rows[np.argsort(key, kind="stable")]
+        return pd.DataFrame({
+            "primary_title": self.store.strings("ratings", "primary_title", rows),
+            "average_rating": self._ratings()[rows],
+            "num_votes": np.asarray(r["num_votes"][rows]),
+        })
+
+    def query_2(self):
+        vocabulary = self.store.vocabulary("titles", "title_type")
+        counts = np.bincount(np.asarray(self.titles["title_type"]) + 1, minlength=len(vocabulary) + 1)
+        detail = {}
+        for code, count in enumerate(counts):
+            if count:
+                title_type = None if code == 0 else vocabulary[code - 1]
+                detail[(BROAD_TYPES.get(title_type, "Other"), title_type)] = int(count)
+        rows = [[broad, title_type, count] for (broad, title_type), count in detail.items()]
+        for broad in {broad for broad, _ in detail}:
+            rows.append([broad, None, sum(c for (b, _), c in detail.items() if b == broad)])
+        rows.append([None, None, int(counts.sum())])
+        # ORDER BY broad_type, title_type; NULLs sort last as in Postgres
+        rows.sort(key=lambda row: (row[0] is None, row[0] or "", row[1] is None, row[1] or ""))
+        return pd.DataFrame(rows, columns=["broad_type", "title_type", "number_of_titles"])
+
+    def query_3(self, minVotes):
+        r = self.ratings
+        vocabulary = self.store.vocabulary("ratings", "title_type")
+        broad = np.array([BROAD_TYPES.get(t, "Other") for t in vocabulary] + ["Other"], dtype=object)
+        broad_of_row = broad[np.asarray(r["title_type"])]   # NULL_CODE picks the trailing "Other"
+        mask = (broad_of_row != "Other") & (r["num_votes"] > minVotes)
+        rows = []
+        for label in ("Television", "Film"):
+            # COUNT(*) counts every title, AVG skips NULL ratings
+            tenths = r["rating_tenths"][mask & (broad_of_row == label)]
+            rated = tenths[notnull(tenths)]
+            if len(tenths):
+                average = None
+                if len(rated):
+                    average = Decimal(int(rated.sum(dtype=np.int64))) / (10 * len(rated))
+                    average = float(average.quantize(Decimal("0.01"), ROUND_HALF_UP))
+                rows.append([label, len(tenths), average])
+        frame = pd.DataFrame(rows, columns=["broad_type", "number_of_titles", "overall_average_rating"])
+        return frame.sort_values("overall_average_rating", ascending=False, kind="stable", ignore_index=True)
+
+    def query_5(self, minVotes, minRating, maxRating):
+        r = self.ratings
+        ratings = self._ratings()
+        mask = (self._type_is("ratings", "movie") & notnull(r["date_decade"])
+                & (r["num_votes"] > minVotes) & (ratings > minRating) & (ratings < maxRating))
+        decades, counts = np.unique(r["date_decade"][mask], return_counts=True)
+        return pd.DataFrame({"decade": decades, "number_of_films": counts})
+
+    def query_7(self, minVotes):
+        r = self.ratings
+        genres = np.asarray(r["genre_1"])
+        mask = self._type_is("ratings", "movie") & (r["num_votes"] > minVotes) & (genres != NULL_CODE)
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(genres[rows], kind="stable")]   # the vocabulary is sorted
+        return pd.DataFrame({
+            "genre": self.store.labels("ratings", "genre_1", genres[rows]),
+            "rating": self._ratings()[rows],
+            "votes": np.asarray(r["num_votes"][rows]),
+        })
+
+    def _t_test(self, mask, labels, values, finish):
+        keep = mask & ~np.isnan(values)
+        return finish(moments(np.asarray(labels)[keep], values[keep]))
+
+    def t_test_1(self):
+        r = self.ratings
+        adult = np.asarray(r["is_adult"])
+        return self._t_test(
+            self._type_is("ratings", "movie") & (adult != NULL_CODE), adult == 1, self._ratings(),
+            t_test_frame(False, True, "t_statistic_adult_vs_non_adult_rating", ("n_non_adult", "n_adult")),
+        )
+
+    def t_test_2(self):
+        r = self.ratings
+        century = np.asarray(r["start_century"])
+        return self._t_test(
+            self._type_is("ratings", "movie") & np.isin(century, [1800, 1900]), century, self._ratings(),
+            t_test_frame(1800, 1900, "t_statistic_century_rating_comparison", ("n_19th", "n_20th")),
+        )
+
+    def t_test_3(self):
+        r = self.ratings
+        action = self.store.code("ratings", "genre_1", "Action")
+        comedy = self.store.code("ratings", "genre_1", "Comedy")
+        genres = np.asarray(r["genre_1"])
+        votes = np.where(notnull(r["num_votes"]), r["num_votes"], np.nan)
+        return self._t_test(
+            self._type_is("ratings", "movie") & np.isin(genres, [action, comedy]), genres, votes,
+            t_test_frame(action, comedy, "t_statistic_action_vs_comedy_votes", ("n_action", "n_comedy")),
+        )
+
+    def t_test_4(self):
+        t = self.titles
+        start, end, decade = (np.asarray(t[c]) for c in ("start_year", "end_year", "start_decade"))
+        mask = (self._type_is("titles", "tvSeries") & notnull(start) & notnull(end)
+                & (end >= start) & np.isin(decade, [1990, 2010]))
+        return self._t_test(
+            mask, decade, (end - start).astype(float),
+            t_test_frame(1990, 2010, "t_statistic_tv_series_lifespan", ("n_1990s", "n_2010s")),
+        )
+
+    def t_test_5(self):
+        r = self.ratings
+        votes = np.where(notnull(r["num_votes"]), r["num_votes"], np.nan)
+        has_parent = np.asarray(r["has_parent"])
+        return self._t_test(
+            has_parent != NULL_CODE, has_parent == 1, votes,
+            t_test_frame(True, False, "t_statistic_franchise_vs_standalone_votes", ("n_franchise", "n_standalone")),
+        )
@@ -0,0 +1,155 @@
+import argparse
+import json
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from olap_queries import OLAP
+from olap_cache import CachedOLAP
+from olap_numpy import load_generation
+
+HISTORY_PATH = "olap_history.jsonl"
+
+
+def plan_scans(plan):
+    """Lists the scan nodes of an EXPLAIN (FORMAT JSON) plan, e.g.
+    "Seq Scan on fact_title_principals" or "Index Scan on dim_person
+    using dim_person_pkey", in plan order.
+    """
+    scans = []
+    def walk(node):
+        if node.get("Relation Name"):
+            scan = f"{node['Node Type']} on {node['Relation Name']}"
+            if node.get("Index Name"):
+                scan += f" using {node['Index Name']}"
+            scans.append(scan)
+        for child in node.get("Plans", ()):
+            walk(child)
+    walk(plan["Plan"])
+    return scans
+
+
+def row_bytes(rows):
+    """Size of the rows in text form, about what the text protocol sent."""
+    return sum(len(str(value)) for row in rows for value in row if value is not None)
+
+
+class ProfiledOLAP(OLAP):
+    def __init__(self, engine, history_path: str = HISTORY_PATH, explain: bool = False, **kwargs):
+        """Class constructor for ProfiledOLAP, an OLAP that records every
+        call to a JSONL history
+        Arguments:
+            engine {Engine} - An Engine instance
+            history_path {string} -- File the call records are appended to.
+            explain {boolean} -- Also capture EXPLAIN (ANALYZE, BUFFERS,
+            FORMAT JSON) of the bound statement. This runs the query a
+            second time.
+        """
+        super().__init__(engine, **kwargs)
+        self.history_path = history_path
+        self.explain = explain
+        self.build = load_generation(engine)
+
+    def _execute(self, name, query, params=None):
+        routed = self._route(name, query, params)
+        with self.engine.connect() as connection:
+            started = time.perf_counter()
+            frozen = connection.execute(routed, params or {}).freeze()
+            wall = time.perf_counter() - started
+            rows = frozen().fetchall()
+            compiled = routed.compile(dialect=connection.dialect)
+            # Read per call, outside the timing: an instance kept open across
+            # an ETL reload must tag the new build's calls with the new build.
+            self.build = load_generation(self.engine)
+            record = {
+                "build": self.build,
+                "method": name,
+                "params": params or {},
+                "key": CachedOLAP.cache_key(name, params),
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+                "wall_s": round(wall, 6),
+                "rows": len(rows),
+                "bytes": row_bytes(rows),
+                "routed": routed is not query,
+                "statement": str(compiled),
+            }
+            if self.explain:
+                explained = connection.exec_driver_sql(
+                    "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + str(compiled), compiled.construct_params(params or {})
+                ).scalar()
+                plan = (json.loads(explained) if isinstance(explained, str) else explained)[0]
+                record["plan"] = plan
+                record["scans"] = plan_scans(plan)
+                record["execution_ms"] = plan.get("Execution Time")
+                record["shared_hit_blocks"] = plan["Plan"].get("Shared Hit Blocks")
+                record["shared_read_blocks"] = plan["Plan"].get("Shared Read Blocks")
+        with open(self.history_path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+        return frozen()
+
+
+def read_history(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(records, base, new, threshold=1.25, min_delta=0.05):
+    """Compares the calls recorded for two builds. A call regresses when its
+    median wall time grows by more than threshold times and min_delta
+    seconds; its plan changed when the scans of its latest EXPLAIN differ.
+    Returns:
+        list -- (method, params, kind, detail) findings
+    """
+    calls = defaultdict(lambda: {base: [], new: []})
+    for record in records:
+        if record["build"] in (base, new):
+            calls[(record["method"], record["key"])][record["build"]].append(record)
+
+    findings = []
+    for (method, _), builds in sorted(calls.items()):
+        before, after = builds[base], builds[new]
+        if not before or not after:
+            continue
+        params = after[-1]["params"]
+        old_wall = statistics.median(r["wall_s"] for r in before)
+        new_wall = statistics.median(r["wall_s"] for r in after)
+        if new_wall > old_wall * threshold and new_wall - old_wall > min_delta:
+            findings.append((method, params, "latency", f"{old_wall:.3f}s -> {new_wall:.3f}s ({new_wall / max(old_wall, 1e-9):.1f}x)"))
+        old_plans = [r["scans"] for r in before if "scans" in r]
+        new_plans = [r["scans"] for r in after if "scans" in r]
+        if old_plans and new_plans and old_plans[-1] != new_plans[-1]:
+            removed = [s for s in old_plans[-1] if s not in new_plans[-1]]
+            added = [s for s in new_plans[-1] if s not in old_plans[-1]]
+            findings.append((method, params, "plan", f"{', '.join(removed) or '-'} -> {', '.join(added) or '-'}"))
+    return findings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report OLAP plan changes and latency regressions between two warehouse builds.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    parser_compare = subcommands.add_parser("compare", help="compare two builds recorded in the history")
+    parser_compare.add_argument("history", nargs="?", default=HISTORY_PATH)
+    parser_compare.add_argument("--base", type=int, help="load generation to compare against (default: the previous one)")
+    parser_compare.add_argument("--new", type=int, help="load generation to check (default: the latest)")
+    parser_compare.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio flagged as a regression")
+    parser_compare.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args(argv)
+
+    records = read_history(args.history)
+    builds = sorted({r["build"] for r in records if r["build"] is not None})
+    new = args.new if args.new is not None else (builds[-1] if builds else None)
+    base = args.base
+    if base is None and new is not None:
+        base = max((b for b in builds if b < new), default=None)
+    if base is None or new is None:
+        print("Need calls recorded on two builds to compare.")
+        raise SystemExit(2)
+
+    findings = compare(records, base, new, args.threshold, args.min_delta)
+    print(f"Build {base} -> {new}: {len(findings)} finding(s)")
+    for method, params, kind, detail in findings:
+        print(f"  [{kind}] {method}({', '.join(f'{k}={v!r}' for k, v in params.items())}): {detail}")
+    raise SystemExit(1 if findings else 0)
+
+if __name__ == "__main__":
+    main()
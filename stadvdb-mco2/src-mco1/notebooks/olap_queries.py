@@ -1,18 +1,334 @@
 import pandas as pd
+import numpy as np
 from sqlalchemy import text
+from sqlalchemy.engine import IteratorResult
+from sqlalchemy.engine.result import SimpleResultMetaData
 from scipy import stats
+import asyncio
+import functools
+import inspect
 import math
 
+AGGREGATES_QUERY = text("""
+    SELECT table_name
+    FROM information_schema.tables
+    WHERE table_schema = 'dw_schema' AND table_name LIKE 'agg\\_%';
+""")
+VOTE_BUCKETS_QUERY = text("SELECT boundary FROM dw_schema.agg_vote_buckets;")
+
+def read_aggregates(connection):
+    """Returns the aggregate tables built by the ETL's aggregates stage and
+    the vote bucket boundaries agg_ratings_cube was built with.
+    """
+    tables = set(connection.execute(AGGREGATES_QUERY).scalars())
+    buckets = set()
+    if "agg_vote_buckets" in tables:
+        buckets = set(connection.execute(VOTE_BUCKETS_QUERY).scalars())
+    return tables, buckets
+
+
+def always(params, buckets):
+    return True
+
+def votes_on_boundary(params, buckets):
+    # agg_ratings_cube and agg_person_role only know num_votes up to its
+    # bucket, which answers "num_votes > :votes" exactly when :votes is a
+    # bucket boundary
+    return params.get("votes") in buckets
+
+# Columns of agg_moments a t_test group can be filtered on, and its metrics
+MOMENT_DIMENSIONS = ("title_type", "is_adult", "genre_1", "decade", "century", "has_parent")
+MOMENT_METRICS = ("rating", "votes")
+
+def moments_t_test(group_a, group_b, metric, t_column="t_statistic", n_columns=("n_a", "n_b"), dof=True):
+    """Builds a Welch t-test of metric between two groups of agg_moments
+    segments. A group is a dict of dimension -> value, list of values or
+    None (IS NULL); an empty dict is every rated title.
+    Returns:
+        (TextClause, dict) -- the query and its parameters
+    """
+    if metric not in MOMENT_METRICS:
+        raise ValueError(f"metric must be one of {MOMENT_METRICS}")
+    params = {}
+    
+    def condition(prefix, group):
+        terms = []
+        for column, value in group.items():
+            if column not in MOMENT_DIMENSIONS:
+                raise ValueError(f"cannot filter on {column!r}; use one of {MOMENT_DIMENSIONS}")
+            name = f"{prefix}_{column}"
+            if value is None:
+                terms.append(f"{column} IS NOT DISTINCT FROM :{name}")
+                params[name] = None
+            elif isinstance(value, (list, tuple, set)):
+                terms.append(f"{column} = ANY(:{name})")
+                params[name] = list(value)
+            else:
+                terms.append(f"{column} = :{name}")
+                params[name] = value
+        return " AND ".join(terms) or "TRUE"
+    
+    a, b = condition("a", group_a), condition("b", group_b)
+    dof_column = """,
+            POWER(var_a / n_a + var_b / n_b, 2)
+                / NULLIF(POWER(var_a / n_a, 2) / (n_a - 1) + POWER(var_b / n_b, 2) / (n_b - 1), 0) AS dof""" if dof else ""
+    query = text(f"""
+        WITH sums AS (
+            SELECT
+                SUM({metric}_n) FILTER (WHERE {a}) AS n_a,
+                SUM({metric}_sum) FILTER (WHERE {a}) AS sum_a,
+                SUM({metric}_sq_sum) FILTER (WHERE {a}) AS sq_sum_a,
+                SUM({metric}_n) FILTER (WHERE {b}) AS n_b,
+                SUM({metric}_sum) FILTER (WHERE {b}) AS sum_b,
+                SUM({metric}_sq_sum) FILTER (WHERE {b}) AS sq_sum_b
+            FROM dw_schema.agg_moments
+        ), group_stats AS (
+            SELECT
+                n_a,
+                sum_a / n_a AS mean_a,
+                (sq_sum_a - sum_a * sum_a / n_a) / NULLIF(n_a - 1, 0) AS var_a,
+                n_b,
+                sum_b / n_b AS mean_b,
+                (sq_sum_b - sum_b * sum_b / n_b) / NULLIF(n_b - 1, 0) AS var_b
+            FROM sums
+            WHERE n_a > 0 AND n_b > 0
+        )
+        SELECT
+            (mean_a - mean_b) / NULLIF(SQRT(var_a / n_a + var_b / n_b), 0) AS {t_column},
+            n_a::bigint AS {n_columns[0]},
+            n_b::bigint AS {n_columns[1]}{dof_column}
+        FROM group_stats;
+    """)
+    return query, params
+
+def moments_route(group_a, group_b, metric, t_column, n_columns):
+    """The query on agg_moments answering one of the t_test_* methods."""
+    query, params = moments_t_test(group_a, group_b, metric, t_column, n_columns, dof=False)
+    return query.bindparams(**params)
+
+# Method -> (aggregate table, whether it answers the call's params, query on
+# it), smallest table first. The aggregate queries take the same parameters
+# and return the same columns as the methods' queries on the base tables.
+AGGREGATE_ROUTES = {
+    "query_2": [
+        ("agg_title_type", always, text("""
+            SELECT broad_type,
+                title_type,
+                SUM(number_of_titles)::bigint AS number_of_titles
+            FROM dw_schema.agg_title_type
+            GROUP BY ROLLUP (broad_type, title_type)
+            ORDER BY broad_type, title_type;
+        """)),
+    ],
+    "query_3": [
+        ("agg_ratings_cube", votes_on_boundary, text("""
+            SELECT broad_type,
+                SUM(title_count)::bigint AS number_of_titles,
+                ROUND(SUM(rating_sum) / SUM(title_count), 2) AS overall_average_rating
+            FROM dw_schema.agg_ratings_cube
+            WHERE broad_type IN ('Television', 'Film')
+                AND votes_above >= :votes
+            GROUP BY broad_type
+            ORDER BY overall_average_rating DESC;
+        """)),
+    ],
+    "query_4_1": [
+        ("agg_person_role", votes_on_boundary, text("""
+            SELECT dp.primary_name,
+                SUM(apr.title_count)::bigint AS number_of_titles,
+                ROUND(SUM(apr.rating_sum) / NULLIF(SUM(apr.rating_n), 0), 2) AS average_ratings_of_titles
+            FROM dw_schema.agg_person_role AS apr
+            JOIN dw_schema.dim_person AS dp
+                ON apr.person_key = dp.person_key
+            WHERE apr.all_roles
+                AND apr.votes_above >= :votes
+            GROUP BY dp.person_key, dp.primary_name
+            HAVING SUM(apr.title_count) >= :titles
+            ORDER BY number_of_titles DESC,
+                average_ratings_of_titles DESC;
+        """)),
+    ],
+    "query_4_2": [
+        ("agg_person_role", votes_on_boundary, text("""
+            SELECT dp.primary_name,
+                SUM(apr.title_count)::bigint AS number_of_titles,
+                ROUND(SUM(apr.rating_sum) / NULLIF(SUM(apr.rating_n), 0), 2) AS average_ratings_of_titles
+            FROM dw_schema.agg_person_role AS apr
+            JOIN dw_schema.dim_person AS dp
+                ON apr.person_key = dp.person_key
+            WHERE NOT apr.all_roles
+                AND apr.category = :job
+                AND apr.votes_above >= :votes
+            GROUP BY dp.person_key, dp.primary_name
+            HAVING SUM(apr.title_count) >= :titles
+            ORDER BY number_of_titles DESC,
+                average_ratings_of_titles DESC;
+        """)),
+    ],
+    "query_4_3": [
+        ("agg_person_title_bridge", always, text("""
+            SELECT dt.primary_title,
+                b.average_rating,
+                b.num_votes
+            FROM dw_schema.dim_person AS dp
+            JOIN dw_schema.agg_person_title_bridge AS b
+                ON b.person_key = dp.person_key
+            JOIN dw_schema.dim_title AS dt
+                ON b.title_key = dt.title_key
+            WHERE b.category = :job
+                AND dp.primary_name = :name
+            ORDER BY b.average_rating DESC;
+        """)),
+    ],
+    "query_5": [
+        ("agg_ratings_cube", votes_on_boundary, text("""
+            SELECT decade,
+                SUM(title_count)::bigint AS number_of_films
+            FROM dw_schema.agg_ratings_cube
+            WHERE title_type = 'movie'
+                AND decade IS NOT NULL
+                AND votes_above >= :votes
+                AND average_rating > :min
+                AND average_rating < :max
+            GROUP BY decade
+            ORDER BY decade;
+        """)),
+    ],
+    "query_6": [
+        ("agg_series_rollup", always, text("""
+            SELECT
+                asr.season_number,
+                SUM(asr.rated_episodes)::bigint AS number_of_episodes,
+                ROUND(SUM(asr.rating_sum) / NULLIF(SUM(asr.rating_n), 0), 2) AS season_rating
+            FROM dw_schema.dim_title AS sea
+            JOIN dw_schema.agg_series_rollup AS asr
+                ON asr.series_key = sea.title_key
+            WHERE sea.primary_title = :series
+                AND NOT asr.all_seasons
+                AND asr.season_number IS NOT NULL
+            GROUP BY asr.season_number
+            HAVING SUM(asr.rated_episodes) > 0
+            ORDER BY asr.season_number;
+        """)),
+    ],
+    "t_test_1": [
+        ("agg_moments", always, moments_route(
+            {"title_type": "movie", "is_adult": False}, {"title_type": "movie", "is_adult": True}, "rating",
+            "t_statistic_adult_vs_non_adult_rating", ("n_non_adult", "n_adult"))),
+    ],
+    "t_test_2": [
+        ("agg_moments", always, moments_route(
+            {"title_type": "movie", "century": 1800}, {"title_type": "movie", "century": 1900}, "rating",
+            "t_statistic_century_rating_comparison", ("n_19th", "n_20th"))),
+    ],
+    "t_test_3": [
+        ("agg_moments", always, moments_route(
+            {"title_type": "movie", "genre_1": "Action"}, {"title_type": "movie", "genre_1": "Comedy"}, "votes",
+            "t_statistic_action_vs_comedy_votes", ("n_action", "n_comedy"))),
+    ],
+    "t_test_5": [
+        ("agg_moments", always, moments_route(
+            {"has_parent": True}, {"has_parent": False}, "votes",
+            "t_statistic_franchise_vs_standalone_votes", ("n_franchise", "n_standalone"))),
+    ],
+}
+
+def frame_rows(frame):
+    """The rows of a DataFrame as tuples of Python values, NULLs as None."""
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+def frame_result(frame):
+    """Wraps a DataFrame in a SQLAlchemy Result, so it supports fetchall(),
+    mappings(), one(), scalar() and pd.DataFrame(result) like a query's.
+    """
+    return IteratorResult(SimpleResultMetaData(list(frame.columns)), iter(frame_rows(frame)))
+
+def dispatch(method):
+    """Lets the OLAP instance's backend answer the method when it implements
+    it; the backend method gets every argument by name, defaults filled in,
+    and its DataFrame is returned as the instance's _local_result.
+    """
+    signature = inspect.signature(method)
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        local = getattr(self.backend, method.__name__, None) if self.backend is not None else None
+        if local is None:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop("self")
+        return self._local_result(local(**arguments))
+    return wrapper
+
 class OLAP(object):
-    def __init__(self, engine):
+    def __init__(self, engine, use_aggregates: bool = True, backend=None):
         """Class constructor for OLAP
         Arguments:
             engine {Engine} - An Engine instance for providing functionality
             for connections to a particular database.
+            use_aggregates {boolean} -- Answer queries from the warehouse's
+            aggregate tables when one gives the exact same result.
+            backend {object} -- Optional local backend (e.g. olap_numpy's
+            NumPyBackend) answering the methods it implements without a
+            database round trip. Its DataFrames are returned as the same
+            kind of result the SQL path returns: a SQLAlchemy Result here,
+            a StreamedResult from StreamingOLAP.
         """
         self.engine = engine
+        self.use_aggregates = use_aggregates
+        self.backend = backend
+        self._aggregates = None
+    
+    def _execute(self, name, query, params=None):
+        """Runs one of the queries below and returns its result. name is the
+        calling method, so subclasses can route, time or cache per query.
+        """
+        query = self._route(name, query, params)
+        with self.engine.connect() as connection:
+            result = connection.execute(query, params or {})
+            
+        return result
+    
+    def _local_result(self, frame):
+        """Returns a backend's DataFrame as _execute returns a query's result."""
+        return frame_result(frame)
     
+    def aggregates(self):
+        """Returns (aggregate tables, vote bucket boundaries), read from the
+        warehouse on first use. Call refresh_aggregates after the aggregate
+        tables are first built or dropped.
+        """
+        if self._aggregates is None:
+            with self.engine.connect() as connection:
+                self._aggregates = read_aggregates(connection)
+        return self._aggregates
+    
+    def refresh_aggregates(self):
+        self._aggregates = None
+    
+    def _route(self, name, query, params=None):
+        """Returns the query on the smallest aggregate table that answers
+        this call exactly, or query itself when none does.
+        """
+        routes = AGGREGATE_ROUTES.get(name)
+        if not routes or not self.use_aggregates:
+            return query
+        tables, buckets = self.aggregates()
+        for table, answers, aggregate_query in routes:
+            if table in tables and answers(params or {}, buckets):
+                return aggregate_query
+        return query
+    
+    def streaming(self, batch_size: int = 50_000):
+        """Returns a StreamingOLAP on the same engine and settings, whose
+        query methods return StreamedResults instead of fully buffered
+        results.
+        """
+        return StreamingOLAP(self.engine, batch_size, use_aggregates=self.use_aggregates, backend=self.backend)
     
+    @dispatch
     def query_1(self, minVotes: int = 5000, startYear: int = 2019, titleType: str = 'movie'):
         """Returns a table detailing the highest rated titles given the title 
         type in a given year.
@@ -24,473 +340,420 @@ class OLAP(object):
         Returns:
             int -- support for itemset in data
         """
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT dt.primary_title, 
-                ftr.average_rating,
-                ftr.num_votes
-                FROM dw_schema.fact_title_ratings AS ftr
-                JOIN dw_schema.dim_title AS dt 
-                ON ftr.title_key = dt.title_key
-                JOIN dw_schema.dim_date AS dd 
-                ON ftr.date_key = dd.date_key
-                WHERE ftr.num_votes > :votes --@minVotes
-                    AND dt.start_year = :year --@startYear
-                    AND dt.title_type = :type --@titleType
-                ORDER BY ftr.average_rating DESC;
-            """)
-            
-            result = connection.execute(
-                query, 
-                {"votes": minVotes, "year": startYear, "type": titleType}
-            )
-            
-        return result
+        query = text("""
+            SELECT dt.primary_title, 
+            ftr.average_rating,
+            ftr.num_votes
+            FROM dw_schema.fact_title_ratings AS ftr
+            JOIN dw_schema.dim_title AS dt 
+            ON ftr.title_key = dt.title_key
+            JOIN dw_schema.dim_date AS dd 
+            ON ftr.date_key = dd.date_key
+            WHERE ftr.num_votes > :votes --@minVotes
+                AND dt.start_year = :year --@startYear
+                AND dt.title_type = :type --@titleType
+            ORDER BY ftr.average_rating DESC;
+        """)
+
+        return self._execute("query_1", query, {"votes": minVotes, "year": startYear, "type": titleType})
     
+    @dispatch
     def query_2(self):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH RollUpHierarchy AS (
-                    SELECT
-                        title_key,
-                        title_type,
-                        CASE
-                            WHEN title_type IN ('tvEpisode', 'tvMiniSeries', 'tvMovie', 'tvPilot', 'tvSeries', 'tvShort', 'tvSpecial') THEN 'Television'
-                            WHEN title_type IN ('movie', 'short', 'video') THEN 'Film'
-                            ELSE 'Other'
-                        END AS broad_type
-                    FROM dw_schema.dim_title
-                )
-                SELECT broad_type, 
-                    title_type, 
-                    COUNT(*) AS number_of_titles
-                FROM RollUpHierarchy
-                GROUP BY ROLLUP (broad_type, title_type)
-                ORDER BY broad_type, title_type;
-            """)
-            
-            result = connection.execute(query)
-            
-        return result
+        query = text("""
+            WITH RollUpHierarchy AS (
+                SELECT
+                    title_key,
+                    title_type,
+                    CASE
+                        WHEN title_type IN ('tvEpisode', 'tvMiniSeries', 'tvMovie', 'tvPilot', 'tvSeries', 'tvShort', 'tvSpecial') THEN 'Television'
+                        WHEN title_type IN ('movie', 'short', 'video') THEN 'Film'
+                        ELSE 'Other'
+                    END AS broad_type
+                FROM dw_schema.dim_title
+            )
+            SELECT broad_type, 
+                title_type, 
+                COUNT(*) AS number_of_titles
+            FROM RollUpHierarchy
+            GROUP BY ROLLUP (broad_type, title_type)
+            ORDER BY broad_type, title_type;
+        """)
+
+        return self._execute("query_2", query)
     
+    @dispatch
     def query_3(self, minVotes: int = 5000):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH RollUpHierarchy AS (
-                    SELECT
-                        title_key,
-                        title_type,
-                        CASE
-                            WHEN title_type IN ('tvEpisode', 'tvMiniSeries', 'tvMovie', 'tvPilot', 'tvSeries', 'tvShort', 'tvSpecial') THEN 'Television'
-                            WHEN title_type IN ('movie', 'short', 'video') THEN 'Film'
-                            ELSE 'Other'
-                        END AS broad_type
-                    FROM dw_schema.dim_title
-                )
-                SELECT ruh.broad_type, 
-                    COUNT(*) AS number_of_titles,
-                    ROUND(AVG(ftr.average_rating), 2) AS overall_average_rating 
-                FROM dw_schema.fact_title_ratings AS ftr
-                JOIN RollUpHierarchy AS ruh 
-                    ON ruh.title_key = ftr.title_key
-                WHERE ruh.broad_type IN ('Television', 'Film')
-                    AND ftr.num_votes > :votes --@minVotes
-                GROUP BY ruh.broad_type
-                ORDER BY overall_average_rating DESC;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"votes": minVotes}
+        query = text("""
+            WITH RollUpHierarchy AS (
+                SELECT
+                    title_key,
+                    title_type,
+                    CASE
+                        WHEN title_type IN ('tvEpisode', 'tvMiniSeries', 'tvMovie', 'tvPilot', 'tvSeries', 'tvShort', 'tvSpecial') THEN 'Television'
+                        WHEN title_type IN ('movie', 'short', 'video') THEN 'Film'
+                        ELSE 'Other'
+                    END AS broad_type
+                FROM dw_schema.dim_title
             )
-            
-        return result
+            SELECT ruh.broad_type, 
+                COUNT(*) AS number_of_titles,
+                ROUND(AVG(ftr.average_rating), 2) AS overall_average_rating 
+            FROM dw_schema.fact_title_ratings AS ftr
+            JOIN RollUpHierarchy AS ruh 
+                ON ruh.title_key = ftr.title_key
+            WHERE ruh.broad_type IN ('Television', 'Film')
+                AND ftr.num_votes > :votes --@minVotes
+            GROUP BY ruh.broad_type
+            ORDER BY overall_average_rating DESC;
+        """)
+
+        return self._execute("query_3", query, {"votes": minVotes})
     
     def query_4_1(self, minVotes: int = 5000, minTitles: int = 5):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT dp.primary_name, 
-                    COUNT(DISTINCT(dt.title_key)) AS number_of_titles,
-                    ROUND(AVG(ftr.average_rating),2) AS average_ratings_of_titles
-                FROM dw_schema.fact_title_principals AS ftp
-                JOIN dw_schema.dim_person AS dp 
-                    ON ftp.person_key = dp.person_key
-                JOIN dw_schema.dim_title AS dt
-                    ON ftp.title_key = dt.title_key
-                JOIN dw_schema.fact_title_ratings AS ftr
-                    ON ftp.title_key = ftr.title_key
-                WHERE ftr.num_votes > :votes -- @minVotes
-                GROUP BY dp.primary_name
-                HAVING COUNT(DISTINCT(dt.title_key)) >= :titles -- @minTitles
-                ORDER BY number_of_titles DESC,
-                    average_ratings_of_titles DESC;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"votes": minVotes, "titles": minTitles}
-            )
-            
-        return result
+        query = text("""
+            SELECT dp.primary_name, 
+                COUNT(DISTINCT(dt.title_key)) AS number_of_titles,
+                ROUND(AVG(ftr.average_rating),2) AS average_ratings_of_titles
+            FROM dw_schema.fact_title_principals AS ftp
+            JOIN dw_schema.dim_person AS dp 
+                ON ftp.person_key = dp.person_key
+            JOIN dw_schema.dim_title AS dt
+                ON ftp.title_key = dt.title_key
+            JOIN dw_schema.fact_title_ratings AS ftr
+                ON ftp.title_key = ftr.title_key
+            WHERE ftr.num_votes > :votes -- @minVotes
+            GROUP BY dp.person_key, dp.primary_name
+            HAVING COUNT(DISTINCT(dt.title_key)) >= :titles -- @minTitles
+            ORDER BY number_of_titles DESC,
+                average_ratings_of_titles DESC;
+        """)
+
+        return self._execute("query_4_1", query, {"votes": minVotes, "titles": minTitles})
     
     def query_4_2(self, minVotes: int = 5000, role: str = 'director', minTitles: int = 5):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT dp.primary_name, 
-                    COUNT(DISTINCT(dt.title_key)) AS number_of_titles,
-                    ROUND(AVG(ftr.average_rating),2) AS average_ratings_of_titles
-                FROM dw_schema.fact_title_principals AS ftp
-                JOIN dw_schema.dim_person AS dp 
-                    ON ftp.person_key = dp.person_key
-                JOIN dw_schema.dim_title AS dt
-                    ON ftp.title_key = dt.title_key
-                JOIN dw_schema.fact_title_ratings AS ftr
-                    ON ftp.title_key = ftr.title_key
-                JOIN dw_schema.dim_role AS dr
-                    ON ftp.role_key = dr.role_key
-                WHERE ftr.num_votes > :votes -- @minVotes
-                AND dr.category = :job -- @role/job 
-                GROUP BY dp.primary_name
-                HAVING COUNT(DISTINCT(dt.title_key)) >= :titles -- @minTitles
-                ORDER BY number_of_titles DESC,
-                    average_ratings_of_titles DESC;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"votes": minVotes, "job": role, "titles": minTitles}
-            )
-            
-        return result
+        query = text("""
+            SELECT dp.primary_name, 
+                COUNT(DISTINCT(dt.title_key)) AS number_of_titles,
+                ROUND(AVG(ftr.average_rating),2) AS average_ratings_of_titles
+            FROM dw_schema.fact_title_principals AS ftp
+            JOIN dw_schema.dim_person AS dp 
+                ON ftp.person_key = dp.person_key
+            JOIN dw_schema.dim_title AS dt
+                ON ftp.title_key = dt.title_key
+            JOIN dw_schema.fact_title_ratings AS ftr
+                ON ftp.title_key = ftr.title_key
+            JOIN dw_schema.dim_role AS dr
+                ON ftp.role_key = dr.role_key
+            WHERE ftr.num_votes > :votes -- @minVotes
+            AND dr.category = :job -- @role/job 
+            GROUP BY dp.person_key, dp.primary_name
+            HAVING COUNT(DISTINCT(dt.title_key)) >= :titles -- @minTitles
+            ORDER BY number_of_titles DESC,
+                average_ratings_of_titles DESC;
+        """)
+
+        return self._execute("query_4_2", query, {"votes": minVotes, "job": role, "titles": minTitles})
     
     def query_4_3(self, role: str = 'director', empName: str = 'Hayao Miyazaki'):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT dt.primary_title,
-                    ftr.average_rating,
-                    ftr.num_votes
-                FROM dw_schema.fact_title_principals AS ftp
-                JOIN dw_schema.dim_person AS dp 
-                    ON ftp.person_key = dp.person_key
-                JOIN dw_schema.dim_title AS dt
-                    ON ftp.title_key = dt.title_key
-                JOIN dw_schema.fact_title_ratings AS ftr
-                    ON ftp.title_key = ftr.title_key
-                JOIN dw_schema.dim_role AS dr
-                    ON ftp.role_key = dr.role_key
-                WHERE dr.category = :job -- @role/job
-                    AND dp.primary_name = :name -- @empName
-                ORDER BY ftr.average_rating DESC;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"job": role, "name": empName}
-            )
-            
-        return result
+        query = text("""
+            SELECT dt.primary_title,
+                ftr.average_rating,
+                ftr.num_votes
+            FROM dw_schema.fact_title_principals AS ftp
+            JOIN dw_schema.dim_person AS dp 
+                ON ftp.person_key = dp.person_key
+            JOIN dw_schema.dim_title AS dt
+                ON ftp.title_key = dt.title_key
+            JOIN dw_schema.fact_title_ratings AS ftr
+                ON ftp.title_key = ftr.title_key
+            JOIN dw_schema.dim_role AS dr
+                ON ftp.role_key = dr.role_key
+            WHERE dr.category = :job -- @role/job
+                AND dp.primary_name = :name -- @empName
+            ORDER BY ftr.average_rating DESC;
+        """)
+
+        return self._execute("query_4_3", query, {"job": role, "name": empName})
     
+    @dispatch
     def query_5(self, minVotes: int = 5000, minRating: float = 6.0, maxRating: float = 10.0):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT dd.decade,
-                    COUNT(ftr.title_key) number_of_films
-                FROM dw_schema.fact_title_ratings AS ftr
-                JOIN dw_schema.dim_title AS dt
-                    ON ftr.title_key = dt.title_key
-                JOIN dw_schema.dim_date AS dd
-                    ON ftr.date_key = dd.date_key
-                WHERE dt.title_type = 'movie'
-                    AND ftr.num_votes > :votes -- @minVotes
-                    AND ftr.average_rating > :min -- @minRating
-                    AND ftr.average_rating < :max -- @maxRating
-                GROUP BY dd.decade
-                ORDER BY dd.decade;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"votes": minVotes, "min": minRating, "max": maxRating}
-            )
-            
-        return result
+        query = text("""
+            SELECT dd.decade,
+                COUNT(ftr.title_key) number_of_films
+            FROM dw_schema.fact_title_ratings AS ftr
+            JOIN dw_schema.dim_title AS dt
+                ON ftr.title_key = dt.title_key
+            JOIN dw_schema.dim_date AS dd
+                ON ftr.date_key = dd.date_key
+            WHERE dt.title_type = 'movie'
+                AND ftr.num_votes > :votes -- @minVotes
+                AND ftr.average_rating > :min -- @minRating
+                AND ftr.average_rating < :max -- @maxRating
+            GROUP BY dd.decade
+            ORDER BY dd.decade;
+        """)
+
+        return self._execute("query_5", query, {"votes": minVotes, "min": minRating, "max": maxRating})
     
     def query_6(self, seriesName: str = 'Steins;Gate'):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT 
-                    ep.season_number,
-                    COUNT(*) as number_of_episodes,
-                    ROUND(AVG(ftr.average_rating),2) AS season_rating
-                FROM dw_schema.fact_title_ratings AS ftr
-                JOIN dw_schema.dim_title AS ep
-                    ON ftr.title_key = ep.title_key
-                JOIN dw_schema.dim_title AS sea
-                    ON ep.parent_tconst = sea.tconstid
-                WHERE 
-                    sea.primary_title = :series -- @seriesName
-                    AND ep.season_number IS NOT NULL
-                GROUP BY ep.season_number
-                ORDER BY ep.season_number;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"series": seriesName}
-            )
-            
-        return result
+        query = text("""
+            SELECT 
+                ep.season_number,
+                COUNT(*) as number_of_episodes,
+                ROUND(AVG(ftr.average_rating),2) AS season_rating
+            FROM dw_schema.fact_title_ratings AS ftr
+            JOIN dw_schema.dim_title AS ep
+                ON ftr.title_key = ep.title_key
+            JOIN dw_schema.dim_title AS sea
+                ON ep.parent_title_key = sea.title_key
+            WHERE 
+                sea.primary_title = :series -- @seriesName
+                AND ep.season_number IS NOT NULL
+            GROUP BY ep.season_number
+            ORDER BY ep.season_number;
+        """)
+
+        return self._execute("query_6", query, {"series": seriesName})
     
+    @dispatch
     def query_7(self, minVotes: int = 5000):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                SELECT 
-                    dt.genre_1 AS genre,
-                    ftr.average_rating AS rating,
-                    ftr.num_votes AS votes
-                FROM dw_schema.fact_title_ratings AS ftr
-                JOIN dw_schema.dim_title AS dt ON ftr.title_key = dt.title_key
-                WHERE 
-                    dt.title_type = 'movie'
-                    AND ftr.num_votes > :votes -- @minVotes
-                    AND dt.genre_1 IS NOT NULL
-                ORDER BY dt.genre_1;
-            """)
-            
-            result = connection.execute(
-                query,
-                {"votes": minVotes}
-            )
-            
-        return result
+        query = text("""
+            SELECT 
+                dt.genre_1 AS genre,
+                ftr.average_rating AS rating,
+                ftr.num_votes AS votes
+            FROM dw_schema.fact_title_ratings AS ftr
+            JOIN dw_schema.dim_title AS dt ON ftr.title_key = dt.title_key
+            WHERE 
+                dt.title_type = 'movie'
+                AND ftr.num_votes > :votes -- @minVotes
+                AND dt.genre_1 IS NOT NULL
+            ORDER BY dt.genre_1;
+        """)
+
+        return self._execute("query_7", query, {"votes": minVotes})
     
+    @dispatch
     def t_test_1(self):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH group_stats AS (
-                    SELECT
-                        t.is_adult,
+        query = text("""
+            WITH group_stats AS (
+                SELECT
+                    t.is_adult,
+                    COUNT(r.average_rating) AS n,
+                    AVG(r.average_rating) AS mean,
+                    VAR_SAMP(r.average_rating) AS variance
+                FROM dw_schema.fact_title_ratings AS r
+                JOIN dw_schema.dim_title AS t
+                    ON r.title_key = t.title_key
+                WHERE t.title_type = 'movie'
+                GROUP BY t.is_adult
+            ), 
+            adult_stats AS (
+                SELECT
+                     n,
+                     mean,
+                     variance
+                FROM group_stats
+                WHERE is_adult = TRUE
+            ), 
+            non_adult_stats AS (
+                SELECT
+                     n,
+                     mean,
+                     variance
+                FROM group_stats
+                WHERE is_adult = FALSE
+            )
+            SELECT
+                (non_adult_stats.mean - adult_stats.mean) / SQRT((non_adult_stats.variance / non_adult_stats.n) + (adult_stats.variance / adult_stats.n)) AS t_statistic_adult_vs_non_adult_rating,
+                non_adult_stats.n AS n_non_adult,
+                adult_stats.n AS n_adult
+            FROM adult_stats, non_adult_stats;
+        """)
+
+        return self._execute("t_test_1", query)
+    
+    @dispatch
+    def t_test_2(self):
+        query = text("""
+            WITH group_stats AS (
+                SELECT
+                        d.century,
                         COUNT(r.average_rating) AS n,
                         AVG(r.average_rating) AS mean,
                         VAR_SAMP(r.average_rating) AS variance
-                    FROM dw_schema.fact_title_ratings AS r
-                    JOIN dw_schema.dim_title AS t
-                        ON r.title_key = t.title_key
-                    WHERE t.title_type = 'movie'
-                    GROUP BY t.is_adult
-                ), 
-                adult_stats AS (
-                    SELECT
-                         n,
-                         mean,
-                         variance
-                    FROM group_stats
-                    WHERE is_adult = TRUE
-                ), 
-                non_adult_stats AS (
-                    SELECT
-                         n,
-                         mean,
-                         variance
-                    FROM group_stats
-                    WHERE is_adult = FALSE
-                )
+                FROM dw_schema.fact_title_ratings AS r
+                JOIN dw_schema.dim_title AS t
+                    ON r.title_key = t.title_key
+                JOIN dw_schema.dim_date AS d
+                    ON t.start_year = d.year
+                WHERE t.title_type = 'movie' AND d.century IN (1800, 1900)
+                GROUP BY d.century
+            ), century_19_stats AS (
                 SELECT
-                    (non_adult_stats.mean - adult_stats.mean) / SQRT((non_adult_stats.variance / non_adult_stats.n) + (adult_stats.variance / adult_stats.n)) AS t_statistic_adult_vs_non_adult_rating,
-                    non_adult_stats.n AS n_non_adult,
-                    adult_stats.n AS n_adult
-                FROM adult_stats, non_adult_stats;
-            """)
-            
-            result = connection.execute(query)
-            
-        return result
-    
-    def t_test_2(self):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH group_stats AS (
-                    SELECT
-                            d.century,
-                            COUNT(r.average_rating) AS n,
-                            AVG(r.average_rating) AS mean,
-                            VAR_SAMP(r.average_rating) AS variance
-                    FROM dw_schema.fact_title_ratings AS r
-                    JOIN dw_schema.dim_title AS t
-                        ON r.title_key = t.title_key
-                    JOIN dw_schema.dim_date AS d
-                        ON t.start_year = d.year
-                    WHERE t.title_type = 'movie' AND d.century IN (1800, 1900)
-                    GROUP BY d.century
-                ), century_19_stats AS (
-                    SELECT
-                            n,
-                            mean,
-                            variance
-                    FROM group_stats
-                    WHERE century = 1800
-                ), century_20_stats AS (
-                    SELECT
-                            n,
-                            mean,
-                            variance
-                    FROM group_stats
-                    WHERE century = 1900
-                )
+                        n,
+                        mean,
+                        variance
+                FROM group_stats
+                WHERE century = 1800
+            ), century_20_stats AS (
                 SELECT
-                    (century_19_stats.mean - century_20_stats.mean) / SQRT((century_19_stats.variance / century_19_stats.n) + (century_20_stats.variance / century_20_stats.n)) AS t_statistic_century_rating_comparison,
-                    century_19_stats.n AS n_19th,
-                    century_20_stats.n AS n_20th
-                FROM century_19_stats, century_20_stats;
-            """)
-            
-            result = connection.execute(query)
-            
-        return result
+                        n,
+                        mean,
+                        variance
+                FROM group_stats
+                WHERE century = 1900
+            )
+            SELECT
+                (century_19_stats.mean - century_20_stats.mean) / SQRT((century_19_stats.variance / century_19_stats.n) + (century_20_stats.variance / century_20_stats.n)) AS t_statistic_century_rating_comparison,
+                century_19_stats.n AS n_19th,
+                century_20_stats.n AS n_20th
+            FROM century_19_stats, century_20_stats;
+        """)
+
+        return self._execute("t_test_2", query)
     
+    @dispatch
     def t_test_3(self):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH group_stats AS (
-                    SELECT
-                            t.genre_1,
-                            COUNT(r.num_votes) AS n,
-                            AVG(r.num_votes) AS mean,
-                            VAR_SAMP(r.num_votes) AS variance
-                    FROM dw_schema.fact_title_ratings AS r
-                    JOIN dw_schema.dim_title AS t
-                        ON r.title_key = t.title_key
-                    WHERE t.genre_1 IN ('Action', 'Comedy') AND t.title_type = 'movie'
-                    GROUP BY t.genre_1
-                ), action_stats AS (
-                    SELECT
-                            n,
-                            mean,
-                            variance
-                    FROM group_stats
-                    WHERE genre_1 = 'Action'
-                ), comedy_stats AS (
-                    SELECT
-                            n,
-                            mean,
-                            variance
-                    FROM group_stats
-                    WHERE genre_1 = 'Comedy'
-                )
+        query = text("""
+            WITH group_stats AS (
                 SELECT
-                    (action_stats.mean - comedy_stats.mean) / SQRT((action_stats.variance / action_stats.n) + (comedy_stats.variance / comedy_stats.n)) AS t_statistic_action_vs_comedy_votes, 
-                    action_stats.n AS n_action, 
-                    comedy_stats.n AS n_comedy
-                FROM action_stats, comedy_stats;
-            """)
-            
-            result = connection.execute(query)
-            
-        return result
-    
-    def t_test_4(self):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH group_stats AS (
-                    SELECT
-                            d.decade,
-                            COUNT(t.end_year - t.start_year) AS n,
-                            AVG(t.end_year - t.start_year) AS mean,
-                            VAR_SAMP(t.end_year - t.start_year) AS variance
-                    FROM dw_schema.dim_title AS t
-                    JOIN dw_schema.dim_date AS d
-                        ON t.start_year = d.year
-                    WHERE t.title_type = 'tvSeries'
-                        AND t.end_year IS NOT NULL
-                        AND t.start_year IS NOT NULL
-                        AND t.end_year >= t.start_year
-                        AND d.decade IN (1990, 2010)
-                    GROUP BY d.decade
-                ), stats_1990s AS (
-                    SELECT
-                            n,
-                            mean,
-                            variance
-                    FROM group_stats
-                    WHERE decade = 1990
-                ), stats_2010s AS (
-                    SELECT
-                            n,
-                            mean,
-                            variance
-                    FROM group_stats
-                    WHERE decade = 2010
-                )
-                SELECT
-                    (stats_1990s.mean - stats_2010s.mean) / SQRT((stats_1990s.variance / stats_1990s.n) + (stats_2010s.variance / stats_2010s.n)) AS t_statistic_tv_series_lifespan,
-                    stats_1990s.n AS n_1990s,
-                    stats_2010s.n AS n_2010s
-                FROM stats_1990s, stats_2010s;
-            """)
-            
-            result = connection.execute(query)
-            
-        return result
-    
-    def t_test_5(self):
-        with self.engine.connect() as connection:
-            
-            query = text("""
-                WITH group_stats AS (
-                    SELECT
-                        CASE
-                            WHEN t.parent_tconst IS NOT NULL
-                            THEN 'Franchise'
-                            ELSE 'Standalone'
-                        END AS film_type,
+                        t.genre_1,
                         COUNT(r.num_votes) AS n,
                         AVG(r.num_votes) AS mean,
                         VAR_SAMP(r.num_votes) AS variance
-                    FROM dw_schema.fact_title_ratings as r
-                    JOIN dw_schema.dim_title as t
+                FROM dw_schema.fact_title_ratings AS r
+                JOIN dw_schema.dim_title AS t
                     ON r.title_key = t.title_key
-                    GROUP BY film_type
-                ), franchise_stats AS (
-                    SELECT
+                WHERE t.genre_1 IN ('Action', 'Comedy') AND t.title_type = 'movie'
+                GROUP BY t.genre_1
+            ), action_stats AS (
+                SELECT
                         n,
                         mean,
                         variance
-                    FROM group_stats
-                    WHERE film_type = 'Franchise'
-                ), standalone_stats AS (
-                    SELECT
+                FROM group_stats
+                WHERE genre_1 = 'Action'
+            ), comedy_stats AS (
+                SELECT
                         n,
                         mean,
                         variance
-                    FROM group_stats
-                    WHERE film_type = 'Standalone'
-                )
+                FROM group_stats
+                WHERE genre_1 = 'Comedy'
+            )
+            SELECT
+                (action_stats.mean - comedy_stats.mean) / SQRT((action_stats.variance / action_stats.n) + (comedy_stats.variance / comedy_stats.n)) AS t_statistic_action_vs_comedy_votes, 
+                action_stats.n AS n_action, 
+                comedy_stats.n AS n_comedy
+            FROM action_stats, comedy_stats;
+        """)
+
+        return self._execute("t_test_3", query)
+    
+    @dispatch
+    def t_test_4(self):
+        query = text("""
+            WITH group_stats AS (
                 SELECT
-                    (franchise_stats.mean - standalone_stats.mean) / SQRT((franchise_stats.variance / franchise_stats.n) + (standalone_stats.variance / standalone_stats.n)) AS t_statistic_franchise_vs_standalone_votes,
-                    franchise_stats.n AS n_franchise,
-                    standalone_stats.n AS n_standalone
-                FROM franchise_stats, standalone_stats;
-            """)
-            
-            result = connection.execute(query)
-            
-        return result
+                        d.decade,
+                        COUNT(t.end_year - t.start_year) AS n,
+                        AVG(t.end_year - t.start_year) AS mean,
+                        VAR_SAMP(t.end_year - t.start_year) AS variance
+                FROM dw_schema.dim_title AS t
+                JOIN dw_schema.dim_date AS d
+                    ON t.start_year = d.year
+                WHERE t.title_type = 'tvSeries'
+                    AND t.end_year IS NOT NULL
+                    AND t.start_year IS NOT NULL
+                    AND t.end_year >= t.start_year
+                    AND d.decade IN (1990, 2010)
+                GROUP BY d.decade
+            ), stats_1990s AS (
+                SELECT
+                        n,
+                        mean,
+                        variance
+                FROM group_stats
+                WHERE decade = 1990
+            ), stats_2010s AS (
+                SELECT
+                        n,
+                        mean,
+                        variance
+                FROM group_stats
+                WHERE decade = 2010
+            )
+            SELECT
+                (stats_1990s.mean - stats_2010s.mean) / SQRT((stats_1990s.variance / stats_1990s.n) + (stats_2010s.variance / stats_2010s.n)) AS t_statistic_tv_series_lifespan,
+                stats_1990s.n AS n_1990s,
+                stats_2010s.n AS n_2010s
+            FROM stats_1990s, stats_2010s;
+        """)
+
+        return self._execute("t_test_4", query)
     
-    def print_p_value_report(self, t_stat, n1, n2, s1, s2, alpha=0.05, tail='two-tailed'):
-        df = min(n1 - 1, n2 - 1)
+    @dispatch
+    def t_test_5(self):
+        query = text("""
+            WITH group_stats AS (
+                SELECT
+                    CASE
+                        WHEN t.parent_tconst IS NOT NULL
+                        THEN 'Franchise'
+                        ELSE 'Standalone'
+                    END AS film_type,
+                    COUNT(r.num_votes) AS n,
+                    AVG(r.num_votes) AS mean,
+                    VAR_SAMP(r.num_votes) AS variance
+                FROM dw_schema.fact_title_ratings as r
+                JOIN dw_schema.dim_title as t
+                ON r.title_key = t.title_key
+                GROUP BY film_type
+            ), franchise_stats AS (
+                SELECT
+                    n,
+                    mean,
+                    variance
+                FROM group_stats
+                WHERE film_type = 'Franchise'
+            ), standalone_stats AS (
+                SELECT
+                    n,
+                    mean,
+                    variance
+                FROM group_stats
+                WHERE film_type = 'Standalone'
+            )
+            SELECT
+                (franchise_stats.mean - standalone_stats.mean) / SQRT((franchise_stats.variance / franchise_stats.n) + (standalone_stats.variance / standalone_stats.n)) AS t_statistic_franchise_vs_standalone_votes,
+                franchise_stats.n AS n_franchise,
+                standalone_stats.n AS n_standalone
+            FROM franchise_stats, standalone_stats;
+        """)
+
+        return self._execute("t_test_5", query)
+    
+    def t_test(self, group_a: dict, group_b: dict, metric: str = 'rating'):
+        """Returns a Welch t-test of a metric between two groups of rated
+        titles, computed from the agg_moments segments (built by the ETL's
+        aggregates stage) instead of a scan of the fact table.
+        Arguments:
+            group_a {dict} -- Filter of the first group, e.g.
+            {"title_type": "movie", "genre_1": ["Action", "Adventure"]}; keys
+            are title_type, is_adult, genre_1, decade, century, has_parent.
+            group_b {dict} -- Filter of the second group.
+            metric {string} -- 'rating' or 'votes'.
+        Returns:
+            Result -- t_statistic, n_a, n_b and the Welch-Satterthwaite
+            degrees of freedom dof (for print_p_value_report); no row when
+            a group is empty
+        """
+        query, params = moments_t_test(group_a, group_b, metric)
+        return self._execute(f"t_test_{metric}", query, params)
+    
+    def print_p_value_report(self, t_stat, n1, n2, s1, s2, alpha=0.05, tail='two-tailed', dof=None):
+        df = min(n1 - 1, n2 - 1) if dof is None else float(dof)
 
         if tail == 'two-tailed':
             p_value = 2 * (1 - stats.t.cdf(abs(t_stat), df))
@@ -512,4 +775,162 @@ class OLAP(object):
             print("\nConclusion: The result is statistically significant (There is a significant difference between the two samples).")
         else:
             print("\nConclusion: The result is not statistically significant (There is NO significant difference between the two samples).")
-    
\ No newline at end of file
+
+
+class AsyncOLAP(OLAP):
+    def __init__(self, engine, concurrency: int = 8):
+        """Class constructor for AsyncOLAP, whose query methods are coroutines
+        Arguments:
+            engine {AsyncEngine} - An AsyncEngine (e.g. postgresql+asyncpg)
+            whose pool should hold at least concurrency connections.
+            concurrency {integer} -- Maximum number of queries run_many keeps
+            in flight.
+        """
+        super().__init__(engine)
+        self.concurrency = concurrency
+    
+    async def _execute(self, name, query, params=None):
+        async with self.engine.connect() as connection:
+            if name in AGGREGATE_ROUTES and self.use_aggregates and self._aggregates is None:
+                self._aggregates = await connection.run_sync(read_aggregates)
+            query = self._route(name, query, params)
+            result = await connection.execute(query, params or {})
+            
+        return result
+    
+    async def run_many(self, calls, concurrency: int = None):
+        """Runs several queries at once, each on its own pooled connection.
+        Arguments:
+            calls {list} -- (method name, params dict or None) pairs, e.g.
+            [("query_1", {"startYear": 2020}), ("t_test_1", None)]
+            concurrency {integer} -- Overrides the instance's concurrency.
+        Yields:
+            ((method, params), result) -- in the order the queries finish
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        
+        async def run(call):
+            method, params = call
+            async with semaphore:
+                return call, await getattr(self, method)(**(params or {}))
+        
+        tasks = [asyncio.ensure_future(run(call)) for call in calls]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+# PostgreSQL type OIDs -> how StreamedResult builds the column
+INT_TYPES = {20, 21, 23}           # int8, int2, int4
+FLOAT_TYPES = {700, 701, 1700}     # float4, float8, numeric
+BOOL_TYPES = {16}
+TEXT_TYPES = {25, 1042, 1043}      # text, bpchar, varchar
+
+def typed_column(values, type_code):
+    """Builds one typed column from a batch's values."""
+    if type_code in INT_TYPES:
+        return pd.array(values, dtype="Int64")
+    if type_code in FLOAT_TYPES:
+        return np.fromiter((np.nan if v is None else float(v) for v in values), dtype=float, count=len(values))
+    if type_code in BOOL_TYPES:
+        return pd.array(values, dtype="boolean")
+    if type_code in TEXT_TYPES:
+        return pd.array(values, dtype="string")
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+class StreamedResult(object):
+    def __init__(self, engine, query, params=None, batch_size: int = 50_000):
+        """Lazy result of an OLAP query, read through a server-side cursor
+        in batches of batch_size rows. The query runs each time the result
+        is iterated.
+        """
+        self.engine = engine
+        self.query = query
+        self.params = params or {}
+        self.batch_size = batch_size
+    
+    def _partitions(self):
+        """Yields (column names, column type codes, rows) per batch."""
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=self.batch_size).execute(
+                self.query, self.params
+            )
+            names = list(result.keys())
+            types = [column[1] for column in result.cursor.description]
+            empty = True
+            for rows in result.partitions(self.batch_size):
+                empty = False
+                yield names, types, rows
+            if empty:
+                yield names, types, []
+    
+    def __iter__(self):
+        """Yields rows, so pd.DataFrame(result) works as with OLAP."""
+        for _, _, rows in self._partitions():
+            yield from rows
+    
+    def batches(self):
+        """Yields one DataFrame per batch, built column by column with
+        nullable typed columns (Int64, float64, boolean, string).
+        """
+        for names, types, rows in self._partitions():
+            columns = zip(*rows) if rows else [()] * len(names)
+            yield pd.DataFrame({
+                name: typed_column(values, type_code)
+                for name, type_code, values in zip(names, types, columns)
+            })
+    
+    def record_batches(self):
+        """Yields one Arrow RecordBatch per batch."""
+        import pyarrow as pa
+        for frame in self.batches():
+            yield pa.RecordBatch.from_pandas(frame, preserve_index=False)
+    
+    def to_frame(self):
+        """Returns the whole result as a single typed DataFrame."""
+        frames = list(self.batches())
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+class FrameStreamedResult(StreamedResult):
+    def __init__(self, frame, batch_size: int = 50_000):
+        """StreamedResult over a backend's DataFrame, for StreamingOLAP
+        methods answered by a backend.
+        """
+        self.frame = frame
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        return iter(frame_rows(self.frame))
+
+    def batches(self):
+        for start in range(0, max(len(self.frame), 1), self.batch_size):
+            yield self.frame.iloc[start:start + self.batch_size].reset_index(drop=True)
+
+
+class StreamingOLAP(OLAP):
+    def __init__(self, engine, batch_size: int = 50_000, use_aggregates: bool = True, backend=None):
+        """Class constructor for StreamingOLAP, whose query methods return a
+        StreamedResult
+        Arguments:
+            engine {Engine} - An Engine instance
+            batch_size {integer} -- Rows fetched from the server per batch.
+            use_aggregates {boolean} -- As for OLAP.
+            backend {object} -- As for OLAP.
+        """
+        super().__init__(engine, use_aggregates=use_aggregates, backend=backend)
+        self.batch_size = batch_size
+    
+    def _execute(self, name, query, params=None):
+        return StreamedResult(self.engine, self._route(name, query, params), params, self.batch_size)
+    
+    def _local_result(self, frame):
+        return FrameStreamedResult(frame, self.batch_size)
@@ -1,33 +1,41 @@
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
-from io import StringIO
+import argparse
+import functools
+import numpy as np
 import sys, os
 from dotenv import load_dotenv
+from datetime import datetime, timezone
+from utils import metrics
+from utils.conn import db_config, checkout, release, pooled, close_pools
+from utils.copy_stream import copy_frames
+from utils.extract_cache import cached_query
+from utils.keymap import KeyMap, RoleEncoder
+from utils.scheduler import select_stages, run_dag, run_partitions
+from indexes import drop_load_constraints, build_indexes, set_logged
+from aggregates import build_aggregates
 
 load_dotenv()
 
-SOURCE_DB_CONFIG = {
-    "host": os.getenv("SOURCE_HOST"),
-    "port": os.getenv("SOURCE_PORT"),
-    "database": os.getenv("SOURCE_DB"),
-    "user": os.getenv("SOURCE_USER"),
-    "password": os.getenv("SOURCE_PASS"),
-    "schema": os.getenv("SOURCE_SCHEMA"),
-}
+SOURCE_DB_CONFIG = db_config("SOURCE")
+DWH_DB_CONFIG = db_config("DW")
 
-DWH_DB_CONFIG = {
-    "host": os.getenv("DW_HOST"),
-    "port": os.getenv("DW_PORT"),
-    "database": os.getenv("DW_DB"),
-    "user": os.getenv("DW_USER"),
-    "password": os.getenv("DW_PASS"),
-    "schema": os.getenv("DW_SCHEMA"),
-}
+# Rows fetched per round trip from the source's server-side cursors and
+# COPY'd per batch into the warehouse.
+CHUNK_SIZE = int(os.getenv("ETL_CHUNK_SIZE", 500_000))
+
+# The fact stages split the tconst key space into this many ranges, each
+# extracted, transformed and COPY'd by its own worker process.
+FACT_PARTITIONS = int(os.getenv("ETL_FACT_PARTITIONS", os.cpu_count() or 4))
+PARTITION_RETRIES = int(os.getenv("ETL_PARTITION_RETRIES", 2))
 
-def create_dwh_tables(dwh_conn):
+# Full rebuilds load into <DW_SCHEMA>_shadow and swap it in when done.
+SHADOW_SUFFIX = "_shadow"
+RETIRED_SUFFIX = "_old"
+
+def create_dwh_tables(dwh_conn, unlogged=False):
     ddl_script = """
-    DROP TABLE IF EXISTS fact_title_principals, fact_title_ratings, dim_date, dim_title, dim_person, dim_role CASCADE;
+    DROP TABLE IF EXISTS fact_title_principals, fact_title_ratings, dim_date, dim_title, dim_person, dim_role, etl_source_hash, etl_watermark, etl_dirty_titles CASCADE;
 
     CREATE TABLE dim_date (
         date_key INT PRIMARY KEY,
@@ -41,6 +49,7 @@ def create_dwh_tables(dwh_conn):
         tconstid VARCHAR(15) UNIQUE NOT NULL,
         title_type VARCHAR(50),
         parent_tconst VARCHAR(15),
+        parent_title_key INT,
         primary_title TEXT,
         original_title TEXT,
         title_language VARCHAR(50),
@@ -67,53 +76,181 @@ def create_dwh_tables(dwh_conn):
 
     CREATE TABLE dim_role (
         role_key SERIAL PRIMARY KEY,
+        role_hash BIGINT UNIQUE NOT NULL,
         category VARCHAR(100),
         job VARCHAR(255),
-        character_name VARCHAR(512),
-        UNIQUE(category, job, character_name)
+        character_name VARCHAR(512)
     );
 
+    -- Foreign keys and secondary indexes are added after the load (indexes.py)
     CREATE TABLE fact_title_ratings (
-        title_key INT REFERENCES dim_title(title_key),
-        date_key INT REFERENCES dim_date(date_key),
+        title_key INT,
+        date_key INT,
         average_rating DECIMAL(3,1),
         num_votes INT
     );
 
     CREATE TABLE fact_title_principals (
-        title_key INT REFERENCES dim_title(title_key),
-        person_key INT REFERENCES dim_person(person_key),
-        role_key INT REFERENCES dim_role(role_key),
+        title_key INT,
+        person_key INT,
+        role_key INT,
         principal_ordering INT
     );
     """
+    if unlogged:
+        ddl_script = ddl_script.replace("CREATE TABLE", "CREATE UNLOGGED TABLE")
     with dwh_conn.cursor() as cur:
         cur.execute(ddl_script)
     dwh_conn.commit()
     print("Data warehouse tables created successfully.")
 
 
-def load_df_to_postgres(df, table_name, conn):
-    buffer = StringIO()
-    df.to_csv(buffer, index=False, header=False, sep='\t')
-    buffer.seek(0)
-    with conn.cursor() as cur:
-        try:
-            cur.copy_expert(f"COPY {table_name} FROM STDIN WITH CSV DELIMITER E'\\t'", buffer)
+# One-row table stamping every load. OLAP result caches (notebooks/
+# olap_cache.py) compare it with the stamp of their entries, so a cached
+# answer never outlives the warehouse contents it was computed from. While
+# an in-place load runs, loading is set and the caches treat the warehouse
+# as unstamped.
+LOAD_GENERATION_DDL = """
+    CREATE TABLE IF NOT EXISTS {schema}etl_load_generation (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        generation BIGINT NOT NULL,
+        loaded_at TIMESTAMPTZ NOT NULL
+    );
+    ALTER TABLE {schema}etl_load_generation ADD COLUMN IF NOT EXISTS loading BOOLEAN NOT NULL DEFAULT FALSE;
+"""
+
+def bump_load_generation(cur, schema=None, start=1, loading=False):
+    """Advances the load generation of schema (the session's current schema
+    by default) in the caller's transaction; a new table starts at start.
+    loading marks a load that is still committing its stages.
+    """
+    prefix = f"{schema}." if schema else ""
+    cur.execute(LOAD_GENERATION_DDL.format(schema=prefix))
+    cur.execute(f"""
+        INSERT INTO {prefix}etl_load_generation AS g (generation, loaded_at, loading) VALUES (%s, now(), %s)
+        ON CONFLICT (id) DO UPDATE SET generation = g.generation + 1, loaded_at = now(), loading = EXCLUDED.loading
+        RETURNING generation;
+    """, (start, loading))
+    return cur.fetchone()[0]
+
+
+def create_shadow_schema(dwh_conn, shadow):
+    """Recreates the empty schema a full rebuild loads into."""
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {shadow} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {shadow};")
+    dwh_conn.commit()
+    print(f"Created shadow schema {shadow}.")
+
+
+def publish_shadow_schema(dwh_conn, live, shadow):
+    """Swaps the fully loaded shadow schema in for the live one.
+
+    Both renames commit together, so OLAP queries see either the old
+    warehouse or the new one: queries already running finish on the old
+    tables, new ones resolve to the new tables, and neither waits on the
+    other. The old schema is dropped afterwards, once its readers are done.
+    """
+    retired = live + RETIRED_SUFFIX
+    set_logged(dwh_conn, functools.partial(pooled, 'warehouse'))
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {retired} CASCADE;")
+    dwh_conn.commit()
+
+    with dwh_conn.cursor() as cur:
+        # The new warehouse continues the live one's load generation
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (f"{live}.etl_load_generation",))
+        previous = 0
+        if cur.fetchone()[0]:
+            cur.execute(f"SELECT COALESCE(MAX(generation), 0) FROM {live}.etl_load_generation;")
+            previous = cur.fetchone()[0]
+        cur.execute(f"DROP TABLE IF EXISTS {shadow}.etl_load_generation;")
+        generation = bump_load_generation(cur, shadow, start=previous + 1)
+
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_namespace WHERE nspname = %s);", (live,))
+        if cur.fetchone()[0]:
+            cur.execute(f"ALTER SCHEMA {live} RENAME TO {retired};")
+        cur.execute(f"ALTER SCHEMA {shadow} RENAME TO {live};")
+    dwh_conn.commit()
+    print(f"Published {shadow} as {live} (load generation {generation}).")
+
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {retired} CASCADE;")
+    dwh_conn.commit()
+
+
+def stream_query(conn, query, name, chunk_size=CHUNK_SIZE, params=None, cache=True):
+    """Yields the result of query as DataFrames of at most chunk_size rows.
+    The rows are read through a server-side (named) cursor, so only one chunk
+    is ever held in memory regardless of the size of the result.
+
+    With the extract cache on (--extract-cache), results are served from and
+    written to local Arrow files instead; pass cache=False for queries that
+    must always see the live source.
+    """
+    fetch = functools.partial(fetch_query, conn, query, name, chunk_size, params)
+    if not cache:
+        return fetch()
+    return cached_query(conn, query, params, fetch)
+
+
+def fetch_query(conn, query, name, chunk_size=CHUNK_SIZE, params=None):
+    stage_metrics = metrics.current()
+    with conn.cursor(name=name) as cur:
+        cur.itersize = chunk_size
+        with stage_metrics.phase('extract'):
+            cur.execute(query, params)
+        while True:
+            with stage_metrics.phase('extract'):
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                columns = [desc[0] for desc in cur.description]
+                df = pd.DataFrame.from_records(rows, columns=columns)
+            yield df
+
+
+def load_frames_to_postgres(frames, table_name, columns, conn, commit=True):
+    """COPYs an iterable (typically a generator) of DataFrames into table_name
+    through a single streaming COPY, holding one batch in memory at a time.
+    """
+    try:
+        rows = copy_frames(conn, table_name, columns, frames)
+        if commit:
             conn.commit()
-            print(f"Successfully loaded {len(df)} rows into {table_name}.")
-        except Exception as e:
-            conn.rollback()
-            print(f"Error loading data into {table_name}: {e}")
-            sys.exit(1)
+        print(f"Successfully loaded {rows} rows into {table_name}.")
+        return rows
+    except Exception as e:
+        conn.rollback()
+        print(f"Error loading data into {table_name}: {e}")
+        sys.exit(1)
+
+
+def load_df_to_postgres(df, table_name, conn, commit=True):
+    return load_frames_to_postgres([df], table_name, list(df.columns), conn, commit)
+
+
+def truncate_for_reload(dwh_conn, *tables):
+    """Empties the tables a stage loads before it loads them. A stage re-run
+    with --from or --only (e.g. resuming a failed shadow load, whose finished
+    fact partitions stay committed) then starts over instead of appending
+    duplicates. Surrogate key sequences restart too, and CASCADE empties the
+    facts referencing a truncated dimension, which must be reloaded with it
+    (as --from does).
+    """
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE;")
+    dwh_conn.commit()
 
 
 def etl_dim_date(source_conn, dwh_conn):
     print("Starting ETL for DimDate...")
-    df_years = pd.read_sql('SELECT DISTINCT "startYear" FROM title_basics WHERE "startYear" IS NOT NULL;', source_conn)
+    truncate_for_reload(dwh_conn, 'dim_date')
+    with metrics.current().phase('extract'):
+        df_years = pd.read_sql('SELECT DISTINCT start_year FROM title_basics WHERE start_year IS NOT NULL;', source_conn)
 
-    min_year = int(df_years['startYear'].min())
-    max_year = int(df_years['startYear'].max())
+    min_year = int(df_years['start_year'].min())
+    max_year = int(df_years['start_year'].max())
 
     years = range(min_year, max_year + 1)
     dim_date_df = pd.DataFrame(years, columns=['year'])
@@ -125,190 +262,550 @@ def etl_dim_date(source_conn, dwh_conn):
     load_df_to_postgres(dim_date_df, 'dim_date', dwh_conn)
 
 
+DIM_PERSON_COLUMNS = ['nconstid', 'primary_name', 'birth_year', 'death_year', 'profession_1', 'profession_2', 'profession_3']
+
+# The extracts read the final source tables (as ETL.sql does), which both
+# import_imdb.sh + csv_to_array and ingest_tsv.py fill; list columns are
+# text[] there.
+DIM_PERSON_QUERY = """
+    SELECT
+        nconst,
+        primary_name,
+        birth_year,
+        death_year,
+        primary_profession[1] AS profession_1,
+        primary_profession[2] AS profession_2,
+        primary_profession[3] AS profession_3
+    FROM name_basics
+"""
+
+@metrics.timed('transform')
+def transform_dim_person(df):
+    df.rename(columns={'nconst': 'nconstid'}, inplace=True)
+    df['birth_year'] = pd.to_numeric(df['birth_year'], errors='coerce').astype('Int64')
+    df['death_year'] = pd.to_numeric(df['death_year'], errors='coerce').astype('Int64')
+    return df[DIM_PERSON_COLUMNS]
+
+
 def etl_dim_person(source_conn, dwh_conn):
     print("Starting ETL for DimPerson...")
-    df = pd.read_sql('SELECT "nconst", "primaryName", "birthYear", "deathYear", "primaryProfession" FROM name_basics_import', source_conn)
-
-    df.columns = df.columns.str.lower()
-    df.rename(columns={'nconst': 'nconstid', 'primaryname': 'primary_name', 'birthyear': 'birth_year', 'deathyear': 'death_year'}, inplace=True)
-    df['birth_year'] = pd.to_numeric(df['birth_year'], errors='coerce')
-    df['death_year'] = pd.to_numeric(df['death_year'], errors='coerce')
-
-    if 'primaryprofession' in df.columns:
-        professions = df['primaryprofession'].str.split(',', expand=True)
-        df['profession_1'] = professions[0]
-        df['profession_2'] = professions[1] if 1 in professions.columns else None
-        df['profession_3'] = professions[2] if 2 in professions.columns else None
-    else:
-        df['profession_1'] = df['profession_2'] = df['profession_3'] = None
+    truncate_for_reload(dwh_conn, 'dim_person')
+    frames = (transform_dim_person(df) for df in stream_query(source_conn, DIM_PERSON_QUERY, 'dim_person_src'))
+    load_frames_to_postgres(frames, 'dim_person', DIM_PERSON_COLUMNS, dwh_conn)
 
-    df_to_load = df[['nconstid', 'primary_name', 'birth_year', 'death_year', 'profession_1', 'profession_2', 'profession_3']]
-    with dwh_conn.cursor() as cur:
-        execute_values(cur, "INSERT INTO dim_person (nconstid, primary_name, birth_year, death_year, profession_1, profession_2, profession_3) VALUES %s", df_to_load.to_records(index=False).tolist())
-    dwh_conn.commit()
-    print(f"Successfully loaded {len(df_to_load)} rows into dim_person.")
 
+DIM_ROLE_COLUMNS = ['role_key', 'role_hash', 'category', 'job', 'character_name']
 
-def etl_dim_role(source_conn, dwh_conn):
-    print("Starting ETL for DimRole...")
-    query = "SELECT DISTINCT category, job, characters FROM principals;"
-    df = pd.read_sql(query, source_conn)
-    df.rename(columns={'characters': 'character_name'}, inplace=True)
-    df.replace('\\N', None, inplace=True)
 
-    with dwh_conn.cursor() as cur:
-        execute_values(cur, "INSERT INTO dim_role (category, job, character_name) VALUES %s ON CONFLICT (category, job, character_name) DO NOTHING", df.to_records(index=False).tolist())
-    dwh_conn.commit()
-    print(f"Successfully loaded {len(df)} unique roles into dim_role.")
+DIM_TITLE_COLUMNS = [
+    'tconstid', 'title_type', 'parent_tconst', 'primary_title', 'original_title',
+    'title_language', 'is_adult', 'start_year', 'end_year', 'episode_number',
+    'season_number', 'genre_1', 'genre_2', 'genre_3'
+]
 
+@metrics.timed('transform')
+def transform_dim_title(df):
+    df.rename(columns={'tconst': 'tconstid'}, inplace=True)
+    df['is_adult'] = df['is_adult'].eq(True)
+    for col in ['start_year', 'end_year', 'episode_number', 'season_number']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
 
-def etl_dim_title(source_conn, dwh_conn):
-    print("Starting ETL for DimTitle...")
-    query = """
+    return df[DIM_TITLE_COLUMNS]
+
+
+DIM_TITLE_QUERY = """
     SELECT
         b.tconst,
-        b.titletype,
-        e.parentTconst,
-        b.primarytitle,
-        b.originaltitle,
-        b.isadult,
-        b.startyear,
-        b.endyear,
-        b.genres,
-        a.language,
-        e.episodeNumber,
-        e.seasonNumber
+        b.title_type,
+        e.parent_tconst,
+        b.primary_title,
+        b.original_title,
+        a.language AS title_language,
+        b.is_adult,
+        b.start_year,
+        b.end_year,
+        e.episode_number,
+        e.season_number,
+        b.genres[1] AS genre_1,
+        b.genres[2] AS genre_2,
+        b.genres[3] AS genre_3
     FROM title_basics b
     LEFT JOIN episode e ON b.tconst = e.tconst
     LEFT JOIN (
-        SELECT titleId, language
-        FROM akas_import
-        WHERE isOriginalTitle = '1'
-    ) a ON b.tconst = a.titleId;
-    """
-    df = pd.read_sql(query, source_conn)
-
-    df.rename(columns={
-        'tconst': 'tconstid', 'primarytitle': 'primary_title', 'originaltitle': 'original_title',
-        'isadult': 'is_adult', 'startyear': 'start_year', 'endyear': 'end_year', 'language': 'title_language', 'titletype': 'title_type', 'episodeNumber': 'episode_number', 'seasonNumber': 'season_number'
-    }, inplace=True)
-
-    df['genres'] = df['genres'].str.split(',')
-    df['genre_1'] = df['genres'].str[0].replace({'\\N': None})
-    df['genre_2'] = df['genres'].str[1].replace({'\\N': None})
-    df['genre_3'] = df['genres'].str[2].replace({'\\N': None})
-    df['is_adult'] = df['is_adult'].apply(lambda x: True if x == '1' else False)
-    for col in ['start_year', 'end_year', 'episode_number', 'season_number']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        -- A title can have several original-title akas; keep one per title
+        -- so every tconst yields a single row (and a single row hash)
+        SELECT DISTINCT ON (title_id) title_id, language
+        FROM akas
+        WHERE is_original_title
+        ORDER BY title_id, language
+    ) a ON b.tconst = a.title_id
+"""
+
+def etl_dim_title(source_conn, dwh_conn):
+    print("Starting ETL for DimTitle...")
+    truncate_for_reload(dwh_conn, 'dim_title')
+    frames = (transform_dim_title(df) for df in stream_query(source_conn, DIM_TITLE_QUERY, 'dim_title_src'))
+    load_frames_to_postgres(frames, 'dim_title', DIM_TITLE_COLUMNS, dwh_conn)
+    resolve_parent_title_keys(dwh_conn)
 
-    df_to_load = df[[
-        'tconstid', 'title_type', 'parent_tconst', 'primary_title', 'original_title',
-        'title_language', 'is_adult', 'start_year', 'end_year', 'episode_number',
-        'season_number', 'genre_1', 'genre_2', 'genre_3'
-    ]]
 
+def resolve_parent_title_keys(dwh_conn, tconsts=None):
+    """Sets parent_title_key, the surrogate key of each episode's series,
+    once the parents are loaded. With tconsts, only the titles among them
+    and the episodes of those titles are re-resolved (an incremental
+    refresh); otherwise every episode is, with one join.
+    """
     with dwh_conn.cursor() as cur:
-        execute_values(cur, """
-            INSERT INTO dim_title (tconstid, title_type, parent_tconst, primary_title, original_title,
-                                  title_language, is_adult, start_year, end_year, episode_number,
-                                  season_number, genre_1, genre_2, genre_3)
-            VALUES %s
-        """, df_to_load.to_records(index=False).tolist())
+        if tconsts is None:
+            cur.execute("""
+                UPDATE dim_title e
+                SET parent_title_key = p.title_key
+                FROM dim_title p
+                WHERE p.tconstid = e.parent_tconst;
+            """)
+        else:
+            cur.execute("""
+                UPDATE dim_title e
+                SET parent_title_key = (SELECT p.title_key FROM dim_title p WHERE p.tconstid = e.parent_tconst)
+                WHERE e.tconstid = ANY(%(keys)s) OR e.parent_tconst = ANY(%(keys)s);
+            """, {'keys': list(tconsts)})
+        print(f"Resolved parent_title_key for {cur.rowcount} titles.")
     dwh_conn.commit()
-    print(f"Successfully loaded {len(df_to_load)} rows into dim_title.")
 
 
-def etl_fact_title_ratings(source_conn, dwh_conn):
-    print("Starting ETL for FactTitleRatings...")
-    title_map = pd.read_sql("SELECT title_key, tconstid FROM dim_title", dwh_conn).set_index('tconstid')
-    date_map = pd.read_sql("SELECT date_key, year FROM dim_date", dwh_conn).set_index('year')
-    query = """
-    SELECT r.tconst, r.averagerating, r.numvotes, b.startyear
-    FROM ratings r
-    JOIN title_basics b ON r.tconst = b.tconst
+FACT_TITLE_RATINGS_COLUMNS = ['title_key', 'date_key', 'average_rating', 'num_votes']
+
+def etl_key_maps(source_conn, dwh_conn):
+    """Snapshots the title and person surrogate keys into memory-mapped key
+    maps, built once and shared read-only by every fact-loading process.
     """
-    df = pd.read_sql(query, source_conn)
+    print("Building surrogate key maps...")
+    for name, query in [
+        ('dim_title', "SELECT tconstid, title_key FROM dim_title"),
+        ('dim_person', "SELECT nconstid, person_key FROM dim_person"),
+    ]:
+        with metrics.current().phase('extract'):
+            key_map = KeyMap.from_query(dwh_conn, query, name=f'{name}_keymap_src')
+        key_map.save(name)
+        print(f"Saved {len(key_map)} keys for {name}.")
+    dwh_conn.commit()
 
-    df['title_key'] = df['tconst'].map(title_map['title_key'])
-    df['startyear'] = pd.to_numeric(df['startyear'], errors='coerce')
-    df['date_key'] = df['startyear'].map(date_map['date_key'])
 
-    df.rename(columns={'averagerating': 'average_rating', 'numvotes': 'num_votes'}, inplace=True)
+@metrics.timed('transform')
+def transform_fact_title_ratings(df, title_map, date_map):
+    df['title_key'] = title_map.lookup(df['tconst'])
+    df['start_year'] = pd.to_numeric(df['start_year'], errors='coerce')
+    df['date_key'] = df['start_year'].map(date_map['date_key'])
 
-    df_to_load = df[['title_key', 'date_key', 'average_rating', 'num_votes']].dropna()
+    df_to_load = df[FACT_TITLE_RATINGS_COLUMNS].dropna()
     for col in ['title_key', 'date_key', 'num_votes']:
         df_to_load[col] = df_to_load[col].astype(int)
+    return df_to_load
 
-    load_df_to_postgres(df_to_load, 'fact_title_ratings', dwh_conn)
 
+FACT_TITLE_RATINGS_QUERY = """
+    SELECT r.tconst, r.average_rating, r.num_votes, b.start_year
+    FROM ratings r
+    JOIN title_basics b ON r.tconst = b.tconst
+"""
 
-def etl_fact_title_principals(source_conn, dwh_conn):
-    print("Starting ETL for FactTitlePrincipals...")
-    title_map = pd.read_sql("SELECT title_key, tconstid FROM dim_title", dwh_conn).set_index('tconstid')
-    person_map = pd.read_sql("SELECT person_key, nconstid FROM dim_person", dwh_conn).set_index('nconstid')
-    role_map_df = pd.read_sql("SELECT role_key, category, job, character_name FROM dim_role", dwh_conn)
-    role_map_df.replace({None: 'NULL_VAL'}, inplace=True)
-    role_map = role_map_df.set_index(['category', 'job', 'character_name'])
-
-    df = pd.read_sql("SELECT tconst, nconst, ordering, category, job, characters FROM principals", source_conn)
-    df.replace('\\N', None, inplace=True)
+def tconst_partitions(source_conn, table, n):
+    """Splits the tconst key space of table into n contiguous (lo, hi) ranges
+    of roughly equal row counts, with boundaries taken from a 1% sample. The
+    ranges compare tconst as text, so each partition is an index range scan
+    on the table's primary key; None leaves a side open.
+    """
+    if n <= 1:
+        return [(None, None)]
+    with source_conn.cursor() as cur:
+        cur.execute(
+            f"SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY tconst) FROM {table} TABLESAMPLE SYSTEM (1);",
+            ([i / n for i in range(1, n)],)
+        )
+        bounds = sorted(set(b for b in (cur.fetchone()[0] or []) if b is not None))
+    source_conn.commit()
+    edges = [None] + bounds + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def partition_filter(column, lo, hi):
+    clauses, params = [], []
+    if lo is not None:
+        clauses.append(f"{column} >= %s")
+        params.append(lo)
+    if hi is not None:
+        clauses.append(f"{column} < %s")
+        params.append(hi)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), tuple(params)
 
-    df['title_key'] = df['tconst'].map(title_map['title_key'])
-    df['person_key'] = df['nconst'].map(person_map['person_key'])
 
-    df_role_lookup = df[['category', 'job', 'characters']].replace({None: 'NULL_VAL'})
-    df_role_lookup.columns = ['category', 'job', 'character_name'] # Match index names
-    role_keys = role_map.loc[pd.MultiIndex.from_frame(df_role_lookup)].reset_index()['role_key']
-    df['role_key'] = role_keys
+def load_fact_title_ratings_partition(source_conn, dwh_conn, lo, hi, name):
+    title_map = KeyMap.open('dim_title')
+    date_map = pd.read_sql("SELECT date_key, year FROM dim_date", dwh_conn).set_index('year')
+
+    where, params = partition_filter('r.tconst', lo, hi)
+    frames = (
+        transform_fact_title_ratings(df, title_map, date_map)
+        for df in stream_query(source_conn, FACT_TITLE_RATINGS_QUERY + where, name, params=params)
+    )
+    return copy_frames(dwh_conn, 'fact_title_ratings', FACT_TITLE_RATINGS_COLUMNS, frames)
+
+
+FACT_TITLE_PRINCIPALS_COLUMNS = ['title_key', 'person_key', 'role_key', 'principal_ordering']
+FACT_TITLE_PRINCIPALS_QUERY = "SELECT tconst, nconst, ordering, category, job, characters FROM principals"
+
+@metrics.timed('transform')
+def transform_fact_title_principals(df, title_map, person_map, role_encoder, assign_role_keys=None):
+    """Resolves one chunk of principals. Returns the fact rows and the
+    dim_role rows for roles first seen in this chunk.
+    """
+    df.replace('\\N', None, inplace=True)
+
+    df['title_key'] = title_map.lookup(df['tconst'])
+    df['person_key'] = person_map.lookup(df['nconst'])
+    role_keys, new_roles = role_encoder.encode(df, assign_role_keys)
+    df['role_key'] = role_keys # Positional, aligned with df
     df_to_load = df[['title_key', 'person_key', 'role_key', 'ordering']].dropna()
 
-    for col in ['title_key', 'person_key', 'role_key']:
+    for col in ['title_key', 'person_key']:
         df_to_load[col] = df_to_load[col].astype(int)
+    return df_to_load, new_roles
 
-    load_df_to_postgres(df_to_load, 'fact_title_principals', dwh_conn)
 
-def main():
-    try:
-        source_conn = psycopg2.connect(
-            host=SOURCE_DB_CONFIG["host"],
-            port=SOURCE_DB_CONFIG["port"],
-            database=SOURCE_DB_CONFIG["database"],
-            user=SOURCE_DB_CONFIG["user"],
-            password=SOURCE_DB_CONFIG["password"],
-        )
-        with source_conn.cursor() as cur:
-            cur.execute(f"SET search_path TO {SOURCE_DB_CONFIG['schema']};")
-
-        dwh_conn = psycopg2.connect(
-            host=DWH_DB_CONFIG["host"],
-            port=DWH_DB_CONFIG["port"],
-            database=DWH_DB_CONFIG["database"],
-            user=DWH_DB_CONFIG["user"],
-            password=DWH_DB_CONFIG["password"],
-        )
+class SharedRoleKeys(object):
+    """assign_keys callback for RoleEncoder when several partition workers
+    discover roles at the same time. New roles are inserted on a separate
+    autocommit connection with ON CONFLICT (role_hash) DO NOTHING and their
+    keys read back, so every worker agrees on one role_key per role and the
+    roles are visible to the other workers' fact transactions right away.
+    Roles arrive sorted by role_hash, so concurrent inserts of overlapping
+    sets lock in the same order and cannot deadlock.
+    """
 
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.autocommit = True
+        self.inserted = 0
+
+    def __call__(self, new_roles):
+        if new_roles.empty:
+            return np.empty(0, dtype=np.int64)
+        columns = [
+            new_roles[col].astype(object).where(new_roles[col].notna(), None).tolist()
+            for col in ['role_hash', 'category', 'job', 'character_name']
+        ]
+        columns[0] = [int(h) for h in columns[0]]
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO dim_role (role_hash, category, job, character_name)
+                SELECT * FROM unnest(%s::bigint[], %s::text[], %s::text[], %s::text[])
+                ON CONFLICT (role_hash) DO NOTHING;
+            """, columns)
+            self.inserted += cur.rowcount
+            cur.execute("SELECT role_hash, role_key FROM dim_role WHERE role_hash = ANY(%s);", (columns[0],))
+            keys = dict(cur.fetchall())
+        return np.array([keys[h] for h in columns[0]], dtype=np.int64)
+
+
+def load_principals_chunks(chunks, dwh_conn, title_map, person_map, role_encoder, assign_role_keys=None):
+    """COPYs each chunk's facts within the caller's transaction. New roles
+    are COPY'd into dim_role in the same transaction, or registered through
+    assign_role_keys when given. Returns (roles, facts) row counts.
+    """
+    roles = facts = 0
+    for df in chunks:
+        df_to_load, new_roles = transform_fact_title_principals(df, title_map, person_map, role_encoder, assign_role_keys)
+        if assign_role_keys is None:
+            roles += copy_frames(dwh_conn, 'dim_role', DIM_ROLE_COLUMNS, [new_roles])
+        facts += copy_frames(dwh_conn, 'fact_title_principals', FACT_TITLE_PRINCIPALS_COLUMNS, [df_to_load])
+    if assign_role_keys is None:
         with dwh_conn.cursor() as cur:
-            cur.execute(f"SET search_path TO {DWH_DB_CONFIG['schema']};")
-        print("Successfully connected to source and DWH databases.")
+            cur.execute("SELECT setval(pg_get_serial_sequence('dim_role', 'role_key'), GREATEST(MAX(role_key), 1)) FROM dim_role;")
+    else:
+        roles = assign_role_keys.inserted
+    return roles, facts
+
+
+def load_fact_title_principals_partition(source_conn, dwh_conn, lo, hi, name):
+    title_map = KeyMap.open('dim_title')
+    person_map = KeyMap.open('dim_person')
+    role_conn = connect_dwh()
+    try:
+        assign_role_keys = SharedRoleKeys(role_conn)
+        role_encoder = RoleEncoder.from_query(role_conn)
+
+        where, params = partition_filter('tconst', lo, hi)
+        chunks = stream_query(source_conn, FACT_TITLE_PRINCIPALS_QUERY + where, name, params=params)
+        _, facts = load_principals_chunks(chunks, dwh_conn, title_map, person_map, role_encoder, assign_role_keys)
+        return facts
+    finally:
+        release(role_conn)
+
+
+PARTITION_LOADERS = {
+    'fact_title_ratings': load_fact_title_ratings_partition,
+    'fact_title_principals': load_fact_title_principals_partition,
+}
+
+def run_fact_partition(stage, index, lo, hi):
+    """Loads one tconst range of a fact stage on its own connections, in one
+    DWH transaction, so a failed partition can be retried from scratch.
+    Returns the partition's metrics summary.
+    """
+    source_conn = connect_source()
+    try:
+        dwh_conn = connect_dwh()
+        try:
+            with metrics.stage(f'{stage}[p{index}]') as partition_metrics:
+                PARTITION_LOADERS[stage](source_conn, dwh_conn, lo, hi, f'{stage}_p{index}')
+                with partition_metrics.phase('load'):
+                    dwh_conn.commit()
+            return partition_metrics.summary()
+        except BaseException:
+            dwh_conn.rollback()
+            raise
+        finally:
+            release(dwh_conn)
+    finally:
+        release(source_conn)
+
+
+def load_fact_partitions(source_conn, stage, source_table, partitions=FACT_PARTITIONS, retries=PARTITION_RETRIES):
+    ranges = tconst_partitions(source_conn, source_table, partitions)
+    print(f"Loading {stage} in {len(ranges)} partitions...")
+    results = run_partitions(functools.partial(run_fact_partition, stage), ranges, stage,
+                             max_workers=partitions, retries=retries,
+                             describe=lambda s: f"{s['rows']} rows, {s['rows_per_sec']:.0f} rows/s")
+    # Phase times are summed over the partitions, so they measure worker
+    # time and can exceed the stage's wall time.
+    stage_metrics = metrics.current()
+    for summary in results.values():
+        stage_metrics.merge(summary)
+    rows = sum(summary['rows'] for summary in results.values())
+    print(f"Successfully loaded {rows} rows into {stage}.")
+    return rows
+
+
+def etl_fact_title_ratings(source_conn, dwh_conn):
+    print("Starting ETL for FactTitleRatings...")
+    truncate_for_reload(dwh_conn, 'fact_title_ratings')
+    load_fact_partitions(source_conn, 'fact_title_ratings', 'ratings')
+
+
+def etl_fact_title_principals(source_conn, dwh_conn):
+    """Builds dim_role and fact_title_principals in one pass over principals:
+    role triples are factorized into role keys chunk by chunk, so principals
+    is scanned once and no (category, job, characters) lookup is needed.
+    """
+    print("Starting ETL for DimRole and FactTitlePrincipals...")
+    truncate_for_reload(dwh_conn, 'fact_title_principals', 'dim_role')
+    # principals is ~95M rows, so it is never read in full: each partition
+    # streams its range and COPYs every chunk before fetching the next.
+    load_fact_partitions(source_conn, 'fact_title_principals', 'principals')
+
+def etl_indexes(source_conn, dwh_conn):
+    build_indexes(dwh_conn, functools.partial(pooled, 'warehouse'))
+
+def etl_aggregates(source_conn, dwh_conn):
+    print("Building aggregate tables...")
+    build_aggregates(dwh_conn)
+
+
+# Stage name -> (function, stages it depends on). Dimension stages only read
+# the source, so they can run side by side; fact stages need the surrogate
+# keys of the dimensions they reference, which key_maps snapshots for them.
+# dim_role is built by fact_title_principals in the same pass over principals.
+STAGES = {
+    'dim_date': (etl_dim_date, []),
+    'dim_person': (etl_dim_person, []),
+    'dim_title': (etl_dim_title, []),
+    'key_maps': (etl_key_maps, ['dim_title', 'dim_person']),
+    'fact_title_ratings': (etl_fact_title_ratings, ['key_maps', 'dim_date']),
+    'fact_title_principals': (etl_fact_title_principals, ['key_maps']),
+    'indexes': (etl_indexes, ['fact_title_ratings', 'fact_title_principals']),
+    'aggregates': (etl_aggregates, ['fact_title_ratings', 'fact_title_principals']),
+}
+
+STAGE_GROUPS = {
+    'dims': ['dim_date', 'dim_person', 'dim_title'],
+    'facts': ['key_maps', 'fact_title_ratings', 'fact_title_principals'],
+    'finalize': ['indexes', 'aggregates'],
+}
 
-        # create_dwh_tables(dwh_conn)
+STAGE_GRAPH = {name: deps for name, (_, deps) in STAGES.items()}
 
-        # etl_dim_date(source_conn, dwh_conn)
-        etl_dim_person(source_conn, dwh_conn)
-        # etl_dim_role(source_conn, dwh_conn)
-        # etl_dim_title(source_conn, dwh_conn)
 
-        # etl_fact_title_ratings(source_conn, dwh_conn)
-        # etl_fact_title_principals(source_conn, dwh_conn)
+def connect_source():
+    """Checks a source connection out of this process's pool (search_path
+    and session settings already applied); hand it back with release().
+    """
+    return checkout('source')
+
+
+def connect_dwh():
+    return checkout('warehouse')
+
+
+def stage_table(incremental=False):
+    if incremental:
+        from incremental import REFRESH_STAGES
+        return REFRESH_STAGES
+    return STAGES
+
+
+def run_stage(name, incremental=False, profile=None):
+    """Runs one stage on its own source and DWH connections. This is the
+    entry point of every worker process spawned by the scheduler; it returns
+    the stage's metrics summary.
+    """
+    etl_fn, _ = stage_table(incremental)[name]
+    source_conn = connect_source()
+    try:
+        dwh_conn = connect_dwh()
+        try:
+            with metrics.stage(name, profile=profile) as stage_metrics:
+                etl_fn(source_conn, dwh_conn)
+            return stage_metrics.summary()
+        finally:
+            release(dwh_conn)
+    finally:
+        release(source_conn)
+
+
+def report_metrics(stages, results, failed, run_id, path):
+    """Appends one JSON line per stage to path and prints a summary table."""
+    summaries = []
+    for name in stages:
+        if name in results:
+            summaries.append({**results[name], 'status': 'ok'})
+        elif name in failed:
+            error = failed[name]
+            status = 'skipped' if isinstance(error, str) else 'failed'
+            summaries.append({'stage': name, 'status': status, 'error': str(error)})
+    metrics.write_jsonl(summaries, run_id, path)
+    print(metrics.format_table(summaries))
+    print(f"Stage metrics appended to {path}.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load the IMDb source database into the data warehouse.")
+    parser.add_argument('--only', nargs='+', metavar='STAGE',
+                        help=f"stages or groups to run ({', '.join(list(STAGE_GROUPS) + list(STAGES))})")
+    parser.add_argument('--from', dest='start', metavar='STAGE',
+                        help="run this stage and every stage downstream of it")
+    parser.add_argument('--create-tables', action='store_true',
+                        help="rebuild the warehouse in a fresh shadow schema and swap it in when the load succeeds")
+    parser.add_argument('--shadow', action='store_true',
+                        help="load into the existing shadow schema (e.g. to resume a failed rebuild with --from) and swap it in")
+    parser.add_argument('--incremental', action='store_true',
+                        help="apply only the source rows that changed since the last refresh")
+    parser.add_argument('--workers', type=int, default=len(STAGE_GROUPS['dims']),
+                        help="maximum number of stages running at the same time")
+    parser.add_argument('--list', action='store_true', help="print the selected stages and exit")
+    parser.add_argument('--extract-cache', metavar='DIR', default=os.getenv('ETL_EXTRACT_CACHE'),
+                        help="cache source extracts as Arrow files under DIR and reuse them while the source is unchanged")
+    parser.add_argument('--metrics', default=metrics.METRICS_PATH, metavar='PATH',
+                        help="JSON lines file the per-stage metrics are appended to")
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'],
+                        help="profile every stage with cProfile (one .prof per stage) or tracemalloc")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.incremental and (args.create_tables or args.shadow):
+        print("--incremental cannot be combined with --create-tables or --shadow.")
+        sys.exit(2)
+    graph = {name: deps for name, (_, deps) in stage_table(args.incremental).items()}
+    try:
+        stages = select_stages(graph, STAGE_GROUPS, only=args.only, start=args.start)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+
+    if args.list:
+        for name in stages:
+            deps = graph[name]
+            print(f"{name}" + (f" (after {', '.join(deps)})" if deps else ""))
+        return
+
+    if args.extract_cache and not args.incremental:
+        os.environ['ETL_EXTRACT_CACHE'] = os.path.abspath(args.extract_cache)
+    else:
+        os.environ.pop('ETL_EXTRACT_CACHE', None)
+
+    live_schema = DWH_DB_CONFIG['schema']
+    shadow = args.create_tables or args.shadow
+    if shadow:
+        if not live_schema:
+            print("DW_SCHEMA must be set to rebuild the warehouse in a shadow schema.")
+            sys.exit(2)
+        # Every warehouse connection, in this process and in the workers,
+        # now loads into the shadow schema; OLAP keeps reading the live one.
+        shadow_schema = live_schema + SHADOW_SUFFIX
+        os.environ['DW_BUILD_SCHEMA'] = shadow_schema
+
+    try:
+        if args.create_tables:
+            dwh_conn = connect_dwh()
+            print("Successfully connected to DWH database.")
+            create_shadow_schema(dwh_conn, shadow_schema)
+            create_dwh_tables(dwh_conn, unlogged=True)
+            release(dwh_conn)
+        if 'indexes' in stages and not args.incremental:
+            # Loads run without constraints or secondary indexes; the indexes
+            # stage rebuilds them once everything is in.
+            dwh_conn = connect_dwh()
+            drop_load_constraints(dwh_conn)
+            release(dwh_conn)
+        if args.incremental:
+            from incremental import create_state_tables
+            dwh_conn = connect_dwh()
+            create_state_tables(dwh_conn)
+            release(dwh_conn)
+
+        if not shadow:
+            # Stages commit as they finish, so caches stop trusting the
+            # current generation before the first one does
+            dwh_conn = connect_dwh()
+            with dwh_conn.cursor() as cur:
+                bump_load_generation(cur, loading=True)
+            dwh_conn.commit()
+            release(dwh_conn)
+
+        # Forked workers must not share the parent's sockets; they open
+        # pools of their own.
+        close_pools()
+        print(f"Running stages: {', '.join(stages)}")
+        run_id = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        worker = functools.partial(run_stage, incremental=args.incremental, profile=args.profile)
+        results, failed = run_dag(graph, stages, worker, max_workers=args.workers)
+        report_metrics(stages, results, failed, run_id, args.metrics)
+
+        if shadow and not failed:
+            dwh_conn = connect_dwh()
+            publish_shadow_schema(dwh_conn, live_schema, shadow_schema)
+            release(dwh_conn)
+        elif shadow:
+            print(f"{live_schema} was left untouched; resume the load into {shadow_schema} with --shadow --from <stage>.")
+        else:
+            # Loaded in place: even a failed stage may have committed rows
+            dwh_conn = connect_dwh()
+            with dwh_conn.cursor() as cur:
+                generation = bump_load_generation(cur)
+            dwh_conn.commit()
+            release(dwh_conn)
+            print(f"Warehouse load generation is now {generation}.")
 
     except psycopg2.Error as e:
         print(f"Database error: {e}")
+        sys.exit(1)
     finally:
-        if 'source_conn' in locals() and source_conn: # type: ignore
-            source_conn.close()
-        if 'dwh_conn' in locals() and dwh_conn: # type: ignore
-            dwh_conn.close()
         print("ETL process finished. Connections closed.")
 
+    if failed:
+        print(f"Failed stages: {', '.join(failed)}")
+        sys.exit(1)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
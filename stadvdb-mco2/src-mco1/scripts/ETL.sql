@@ -52,17 +52,18 @@ CREATE TABLE dw_schema.dim_title (
     genre_3 VARCHAR(50)
 );
 
+-- Foreign keys are added after the facts are loaded (see the end of this script)
 CREATE TABLE dw_schema.fact_title_ratings (
-    title_key BIGINT REFERENCES dw_schema.dim_title(title_key),
-    date_key INT REFERENCES dw_schema.dim_date(date_key),
+    title_key BIGINT,
+    date_key INT,
     average_rating DECIMAL(3,1),
     num_votes INT
 );
 
 CREATE TABLE dw_schema.fact_title_principals (
-    title_key BIGINT REFERENCES dw_schema.dim_title(title_key),
-    person_key BIGINT REFERENCES dw_schema.dim_person(person_key),
-    role_key BIGINT REFERENCES dw_schema.dim_role(role_key),
+    title_key BIGINT,
+    person_key BIGINT,
+    role_key BIGINT,
     principal_ordering INT
 );
 
@@ -195,4 +196,33 @@ ALTER TABLE IF EXISTS dw_schema.fact_title_principals
 CREATE INDEX principals_person_key_idx ON dw_schema.fact_title_principals (person_key); -- [7s->1s]
 CREATE INDEX ratings_votes_idx ON dw_schema.fact_title_ratings (num_votes);
 CREATE INDEX title_type_idx ON dw_schema.dim_title (title_type);
--- CREATE INDEX ratings_ave_rating_idx ON dw_schema.fact_title_ratings (average_rating);
\ No newline at end of file
+-- CREATE INDEX ratings_ave_rating_idx ON dw_schema.fact_title_ratings (average_rating);
+
+-- OLAP-serving indexes (kept in sync with scripts/indexes.py)
+CREATE INDEX ratings_title_key_idx ON dw_schema.fact_title_ratings (title_key);
+CREATE INDEX principals_title_key_brin ON dw_schema.fact_title_principals USING brin (title_key);
+CREATE INDEX principals_role_key_idx ON dw_schema.fact_title_principals (role_key);
+CREATE INDEX title_type_year_idx ON dw_schema.dim_title (title_type, start_year);
+CREATE INDEX title_start_year_idx ON dw_schema.dim_title (start_year);
+CREATE INDEX title_parent_tconst_idx ON dw_schema.dim_title (parent_tconst);
+CREATE INDEX title_primary_title_idx ON dw_schema.dim_title (primary_title);
+CREATE INDEX person_primary_name_idx ON dw_schema.dim_person (primary_name);
+CREATE INDEX role_category_idx ON dw_schema.dim_role (category);
+
+-- Foreign keys: added NOT VALID (catalog only), then validated
+ALTER TABLE dw_schema.fact_title_ratings
+    ADD CONSTRAINT fact_title_ratings_title_key_fkey FOREIGN KEY (title_key) REFERENCES dw_schema.dim_title(title_key) NOT VALID,
+    ADD CONSTRAINT fact_title_ratings_date_key_fkey FOREIGN KEY (date_key) REFERENCES dw_schema.dim_date(date_key) NOT VALID;
+ALTER TABLE dw_schema.fact_title_principals
+    ADD CONSTRAINT fact_title_principals_title_key_fkey FOREIGN KEY (title_key) REFERENCES dw_schema.dim_title(title_key) NOT VALID,
+    ADD CONSTRAINT fact_title_principals_person_key_fkey FOREIGN KEY (person_key) REFERENCES dw_schema.dim_person(person_key) NOT VALID,
+    ADD CONSTRAINT fact_title_principals_role_key_fkey FOREIGN KEY (role_key) REFERENCES dw_schema.dim_role(role_key) NOT VALID;
+
+ALTER TABLE dw_schema.fact_title_ratings VALIDATE CONSTRAINT fact_title_ratings_title_key_fkey;
+ALTER TABLE dw_schema.fact_title_ratings VALIDATE CONSTRAINT fact_title_ratings_date_key_fkey;
+ALTER TABLE dw_schema.fact_title_principals VALIDATE CONSTRAINT fact_title_principals_title_key_fkey;
+ALTER TABLE dw_schema.fact_title_principals VALIDATE CONSTRAINT fact_title_principals_person_key_fkey;
+ALTER TABLE dw_schema.fact_title_principals VALIDATE CONSTRAINT fact_title_principals_role_key_fkey;
+
+ANALYZE dw_schema.dim_date, dw_schema.dim_title, dw_schema.dim_person, dw_schema.dim_role,
+    dw_schema.fact_title_ratings, dw_schema.fact_title_principals;
\ No newline at end of file
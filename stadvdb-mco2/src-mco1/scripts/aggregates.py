@@ -0,0 +1,198 @@
+# Aggregate tables answering the rollup, decade, person and series queries of
+# notebooks/olap_queries.py without scanning the facts; OLAP routes queries
+# to them when they can give the exact same answer.
+
+# Vote bucket boundaries of agg_ratings_cube. A row's votes_above is the
+# largest boundary strictly below its num_votes (-1 if none), so
+# "num_votes > m" is exactly "votes_above >= m" whenever m is a boundary.
+VOTE_BUCKETS = [0, 10, 50, 100, 500, 1000, 2000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000]
+
+# A vote count's bucket: the largest boundary strictly below it, -1 if none
+VOTES_ABOVE = "COALESCE((%(buckets)s::int[])[width_bucket({col} - 1, %(buckets)s::int[])], -1)"
+
+BROAD_TYPE = """
+    CASE
+        WHEN {col} IN ('tvEpisode', 'tvMiniSeries', 'tvMovie', 'tvPilot', 'tvSeries', 'tvShort', 'tvSpecial') THEN 'Television'
+        WHEN {col} IN ('movie', 'short', 'video') THEN 'Film'
+        ELSE 'Other'
+    END
+"""
+
+# (table, query building it). In the cube, ratings are kept exact (one
+# decimal, at most 91 values) rather than bucketed, so any rating range can
+# be answered; counts, sums and sums of squares give means and variances.
+AGGREGATES = [
+    ('agg_vote_buckets', "SELECT unnest(%(buckets)s::int[]) AS boundary"),
+    ('agg_title_type', f"""
+        SELECT title_type, {BROAD_TYPE.format(col='title_type')} AS broad_type, COUNT(*) AS number_of_titles
+        FROM dim_title
+        GROUP BY 1, 2
+    """),
+    ('agg_ratings_cube', f"""
+        SELECT
+            t.title_type,
+            {BROAD_TYPE.format(col='t.title_type')} AS broad_type,
+            d.decade,
+            {VOTES_ABOVE.format(col='r.num_votes')} AS votes_above,
+            r.average_rating,
+            COUNT(*) AS title_count,
+            SUM(r.average_rating) AS rating_sum,
+            SUM(r.average_rating * r.average_rating) AS rating_sq_sum,
+            SUM(r.num_votes::bigint) AS votes_sum,
+            SUM(r.num_votes::numeric * r.num_votes) AS votes_sq_sum
+        FROM fact_title_ratings r
+        JOIN dim_title t ON t.title_key = r.title_key
+        LEFT JOIN dim_date d ON d.date_key = r.date_key
+        GROUP BY 1, 2, 3, 4, 5
+    """),
+    # Sufficient statistics of rating and votes per segment, as NUMERIC so
+    # segments merge exactly; OLAP.t_test sums them for any two groups. The
+    # decade and century are the title's start year's, as the t-tests join.
+    ('agg_moments', """
+        SELECT
+            t.title_type,
+            t.is_adult,
+            t.genre_1,
+            d.decade,
+            d.century,
+            t.parent_tconst IS NOT NULL AS has_parent,
+            COUNT(r.average_rating) AS rating_n,
+            SUM(r.average_rating) AS rating_sum,
+            SUM(r.average_rating * r.average_rating) AS rating_sq_sum,
+            COUNT(r.num_votes) AS votes_n,
+            SUM(r.num_votes::numeric) AS votes_sum,
+            SUM(r.num_votes::numeric * r.num_votes) AS votes_sq_sum
+        FROM fact_title_ratings r
+        JOIN dim_title t ON t.title_key = r.title_key
+        LEFT JOIN dim_date d ON d.year = t.start_year
+        GROUP BY 1, 2, 3, 4, 5, 6
+    """),
+    # Episodes per series and season, plus one all_seasons row per series
+    # (season_number itself can be NULL). Every episode is counted; the
+    # rating columns cover the rated ones.
+    ('agg_series_rollup', """
+        SELECT
+            e.parent_title_key AS series_key,
+            GROUPING(e.season_number) = 1 AS all_seasons,
+            e.season_number,
+            COUNT(*) AS episode_count,
+            COUNT(r.title_key) AS rated_episodes,
+            COUNT(r.average_rating) AS rating_n,
+            SUM(r.average_rating) AS rating_sum,
+            SUM(r.num_votes::bigint) AS votes_sum
+        FROM dim_title e
+        LEFT JOIN fact_title_ratings r ON r.title_key = e.title_key
+        WHERE e.parent_title_key IS NOT NULL
+        GROUP BY GROUPING SETS ((e.parent_title_key, e.season_number), (e.parent_title_key))
+    """),
+]
+
+# Aggregates of the query_4_* family, kept per person so an incremental
+# refresh can recompute just the people credited on changed titles: {persons}
+# is their filter on fact_title_principals p. agg_person_role has each
+# person's titles per vote bucket and role category, plus the all-roles rows
+# (all_roles, as category itself can be NULL). Counts are of distinct titles
+# and the rating sums are over the principal rows, as the base queries
+# count and average them; a title is in a single bucket, so its counts add
+# up across buckets. agg_person_title_bridge has one row per credit of a
+# rated title, stored in person order.
+PERSON_AGGREGATES = [
+    ('agg_person_role', f"""
+        SELECT
+            p.person_key,
+            GROUPING(ro.category) = 1 AS all_roles,
+            ro.category,
+            {VOTES_ABOVE.format(col='r.num_votes')} AS votes_above,
+            COUNT(DISTINCT p.title_key) AS title_count,
+            SUM(r.average_rating) AS rating_sum,
+            COUNT(r.average_rating) AS rating_n
+        FROM fact_title_principals p
+        JOIN fact_title_ratings r ON r.title_key = p.title_key
+        JOIN dim_role ro ON ro.role_key = p.role_key
+        WHERE {{persons}}
+        GROUP BY GROUPING SETS (
+            (p.person_key, {VOTES_ABOVE.format(col='r.num_votes')}, ro.category),
+            (p.person_key, {VOTES_ABOVE.format(col='r.num_votes')})
+        )
+    """),
+    ('agg_person_title_bridge', """
+        SELECT p.person_key, ro.category, p.title_key, r.average_rating, r.num_votes
+        FROM fact_title_principals p
+        JOIN fact_title_ratings r ON r.title_key = p.title_key
+        JOIN dim_role ro ON ro.role_key = p.role_key
+        WHERE {persons}
+        ORDER BY p.person_key, ro.category, r.average_rating DESC
+    """),
+]
+
+# The person aggregates over everyone, and every aggregate table as the full
+# ETL builds it
+FULL_PERSON_AGGREGATES = [(table, query.format(persons='p.person_key IS NOT NULL')) for table, query in PERSON_AGGREGATES]
+ALL_AGGREGATES = AGGREGATES + FULL_PERSON_AGGREGATES
+
+# Aggregate table -> (index name, definition) built with it
+AGGREGATE_INDEXES = {
+    'agg_series_rollup': [
+        ('agg_series_rollup_series_idx', 'btree (series_key, all_seasons, season_number)'),
+    ],
+    'agg_person_role': [
+        ('agg_person_role_person_idx', 'btree (person_key)'),
+        ('agg_person_role_category_idx', 'btree (all_roles, category, votes_above)'),
+    ],
+    'agg_person_title_bridge': [
+        ('agg_person_title_bridge_person_idx', 'btree (person_key, category)'),
+        ('agg_person_title_bridge_title_idx', 'btree (title_key)'),
+    ],
+}
+
+
+def build_aggregates(dwh_conn, aggregates=ALL_AGGREGATES):
+    """(Re)builds the aggregate tables. Each one is built under a temporary
+    name and swapped in with a quick drop and rename, so readers keep using
+    the previous version while the new one is computed.
+    """
+    for table, query in aggregates:
+        indexes = AGGREGATE_INDEXES.get(table, [])
+        with dwh_conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {table}_new;")
+            cur.execute(f"CREATE TABLE {table}_new AS {query};", {'buckets': VOTE_BUCKETS})
+            rows = cur.rowcount
+            for name, definition in indexes:
+                cur.execute(f"CREATE INDEX {name}_new ON {table}_new USING {definition};")
+        dwh_conn.commit()
+
+        with dwh_conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {table};")
+            cur.execute(f"ALTER TABLE {table}_new RENAME TO {table};")
+            for name, _ in indexes:
+                cur.execute(f"ALTER INDEX {name}_new RENAME TO {name};")
+        dwh_conn.commit()
+
+        with dwh_conn.cursor() as cur:
+            cur.execute(f"ANALYZE {table};")
+        dwh_conn.commit()
+        print(f"Built {table} ({rows} rows).")
+
+
+def affected_persons(dwh_conn, title_keys):
+    """People whose person aggregates change with the facts of title_keys:
+    those credited on them before the change (per the bridge) and after.
+    """
+    with dwh_conn.cursor() as cur:
+        cur.execute("""
+            SELECT person_key FROM agg_person_title_bridge WHERE title_key = ANY(%(titles)s)
+            UNION
+            SELECT person_key FROM fact_title_principals WHERE title_key = ANY(%(titles)s) AND person_key IS NOT NULL;
+        """, {'titles': list(title_keys)})
+        return [row[0] for row in cur.fetchall()]
+
+
+def refresh_person_aggregates(dwh_conn, persons):
+    """Recomputes the PERSON_AGGREGATES rows of persons from the current
+    facts, in the caller's transaction.
+    """
+    params = {'buckets': VOTE_BUCKETS, 'persons': list(persons)}
+    with dwh_conn.cursor() as cur:
+        for table, query in PERSON_AGGREGATES:
+            cur.execute(f"DELETE FROM {table} WHERE person_key = ANY(%(persons)s);", params)
+            cur.execute(f"INSERT INTO {table} {query.format(persons='p.person_key = ANY(%(persons)s)')};", params)
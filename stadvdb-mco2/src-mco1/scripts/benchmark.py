@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import synthetic
+import ingest_tsv
+from sqlalchemy import text
+from utils.conn import olap_engine
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SCRIPTS_DIR, "..", "notebooks"))
+from olap_queries import OLAP  # noqa: E402
+
+BENCHMARK_PATH = "benchmark.jsonl"
+
+# Every OLAP method with the parameters it is timed with (the defaults)
+OLAP_METHODS = [
+    "query_1", "query_2", "query_3", "query_4_1", "query_4_2", "query_4_3", "query_5", "query_6", "query_7",
+    "t_test_1", "t_test_2", "t_test_3", "t_test_4", "t_test_5",
+]
+
+# Method -> (parameter, query picking a value that exists in the loaded data).
+# The defaults of query_4_3 and query_6 name real IMDb entries, which the
+# synthetic data ("Title N", "Person N") does not have; these pick the
+# director and the series with the most rated titles instead.
+DATA_PARAMS = {
+    "query_4_3": ("empName", text("""
+        SELECT dp.primary_name
+        FROM dw_schema.fact_title_principals AS ftp
+        JOIN dw_schema.dim_role AS dr ON ftp.role_key = dr.role_key
+        JOIN dw_schema.fact_title_ratings AS ftr ON ftp.title_key = ftr.title_key
+        JOIN dw_schema.dim_person AS dp ON ftp.person_key = dp.person_key
+        WHERE dr.category = 'director'
+        GROUP BY dp.person_key, dp.primary_name
+        ORDER BY COUNT(*) DESC, dp.person_key
+        LIMIT 1;
+    """)),
+    "query_6": ("seriesName", text("""
+        SELECT sea.primary_title
+        FROM dw_schema.dim_title AS ep
+        JOIN dw_schema.dim_title AS sea ON ep.parent_title_key = sea.title_key
+        JOIN dw_schema.fact_title_ratings AS ftr ON ep.title_key = ftr.title_key
+        WHERE ep.season_number IS NOT NULL
+        GROUP BY sea.title_key, sea.primary_title
+        ORDER BY COUNT(*) DESC, sea.title_key
+        LIMIT 1;
+    """)),
+}
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+# (table, import column, final column): the renames csv_to_array.sql applies
+# after the import. The ETL reads the final names; ingest_tsv.py loads into
+# whichever the table has, so a fresh source schema still needs them.
+SOURCE_RENAMES = [
+    ("ratings", "averageRating", "average_rating"),
+    ("ratings", "numVotes", "num_votes"),
+]
+
+
+def rename_source_columns(conn):
+    """Applies the SOURCE_RENAMES the source schema has not had yet."""
+    with conn.cursor() as cur:
+        for table, old, new in SOURCE_RENAMES:
+            cur.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name = %s;",
+                (ingest_tsv.SCHEMA, table, old),
+            )
+            if cur.fetchone():
+                cur.execute(f'ALTER TABLE {ingest_tsv.SCHEMA}.{table} RENAME COLUMN "{old}" TO {new};')
+    conn.commit()
+
+
+def generate_and_ingest(sf, directory, seed, workers):
+    """Generates the scale factor's TSVs and loads them into the source
+    schema. Returns benchmark records for both steps.
+    """
+    rows, wall = timed(synthetic.generate, sf, directory, seed)
+    total = sum(rows.values())
+    records = [{"step": "generate", "name": "synthetic", "wall_s": wall, "rows": total}]
+
+    with ingest_tsv.get_connection() as conn:
+        rename_source_columns(conn)
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {', '.join(f'{ingest_tsv.SCHEMA}.{table}' for table, _, _ in ingest_tsv.FILES.values())};")
+    for key in ingest_tsv.FILES:
+        path = ingest_tsv.find_file(directory, key)
+        loaded, wall = timed(ingest_tsv.ingest_file, path, key, workers, 2)
+        records.append({"step": "ingest", "name": key, "wall_s": wall, "rows": loaded})
+    return records
+
+
+def run_etl(metrics_path, workers):
+    """Rebuilds the warehouse with ETL.py and returns its per-stage records."""
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    metrics_path = os.path.abspath(metrics_path)
+    command = [sys.executable, "ETL.py", "--create-tables", "--workers", str(workers), "--metrics", metrics_path]
+    _, wall = timed(subprocess.run, command, check=True, cwd=SCRIPTS_DIR)
+    records = [{"step": "etl", "name": "total", "wall_s": wall, "rows": None}]
+    with open(metrics_path) as f:
+        for line in f:
+            summary = json.loads(line)
+            records.append({"step": "etl", "name": summary["stage"], "wall_s": summary["wall_s"], "rows": summary["rows"]})
+    return records
+
+
+def data_params(engine):
+    """Returns method -> keyword arguments for the methods in DATA_PARAMS,
+    looked up in the loaded warehouse (none when nothing matches).
+    """
+    params = {}
+    with engine.connect() as connection:
+        for method, (name, query) in DATA_PARAMS.items():
+            value = connection.execute(query).scalar()
+            if value is not None:
+                params[method] = {name: value}
+    return params
+
+
+def run_olap(engine, repeats, use_aggregates):
+    """Times every OLAP method (including fetching its rows) repeats times
+    and keeps the median. Empty results are flagged, as their timings only
+    measure the lookup that found nothing.
+    """
+    queries = OLAP(engine, use_aggregates=use_aggregates)
+    params = data_params(engine)
+    records = []
+    for method in OLAP_METHODS:
+        kwargs = params.get(method, {})
+        walls = []
+        for _ in range(repeats):
+            rows, wall = timed(lambda: getattr(queries, method)(**kwargs).fetchall())
+            walls.append(wall)
+        if not rows:
+            print(f"Warning: {method}({', '.join(f'{k}={v!r}' for k, v in kwargs.items())}) returned no rows.")
+        records.append({"step": "olap", "name": method, "params": kwargs, "wall_s": statistics.median(walls),
+                        "rows": len(rows), "nonempty": len(rows) > 0})
+    return records
+
+
+def report(records, scale_factors):
+    """Prints one table per step: wall time per scale factor, then the
+    growth from the smallest to the largest scale factor relative to the
+    data growth (1.0 = linear).
+    """
+    first, last = scale_factors[0], scale_factors[-1]
+    for step in dict.fromkeys(r["step"] for r in records):
+        names = list(dict.fromkeys(r["name"] for r in records if r["step"] == step))
+        walls = {(r["name"], r["sf"]): r for r in records if r["step"] == step}
+        header = f"{step:<22}" + "".join(f"{f'SF{sf:g}':>12}" for sf in scale_factors)
+        if len(scale_factors) > 1:
+            header += f"{'scaling':>10}"
+        print(header)
+        for name in names:
+            line = f"  {name:<20}"
+            for sf in scale_factors:
+                record = walls.get((name, sf))
+                line += f"{record['wall_s']:>11.3f}s" if record else f"{'-':>12}"
+            a, b = walls.get((name, first)), walls.get((name, last))
+            if len(scale_factors) > 1 and a and b and a["wall_s"] > 0:
+                line += f"{(b['wall_s'] / a['wall_s']) / (last / first):>10.2f}"
+            print(line)
+        rates = [r for r in records if r["step"] == step and r["rows"] and r["wall_s"]]
+        if step in ("ingest", "etl") and rates:
+            for sf in scale_factors:
+                rows = sum(r["rows"] for r in rates if r["sf"] == sf and r["name"] != "total")
+                wall = sum(r["wall_s"] for r in rates if r["sf"] == sf and r["name"] != "total")
+                if wall:
+                    print(f"  SF{sf:g}: {rows / wall:,.0f} rows/s over {rows:,} rows")
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingest, every ETL stage and every OLAP method on synthetic data.")
+    parser.add_argument("--sf", type=float, nargs="+", default=[1], help="scale factors to run, e.g. --sf 1 10 100")
+    parser.add_argument("--data-dir", default="synthetic", help="where the generated TSVs are written")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="ingest and ETL workers")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per OLAP method (the median is kept)")
+    parser.add_argument("--no-aggregates", action="store_true", help="time OLAP methods on the base tables only")
+    parser.add_argument("--skip-load", action="store_true", help="only time the OLAP methods on the current warehouse")
+    parser.add_argument("--output", default=BENCHMARK_PATH, help="JSONL file the records are appended to")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="required to run loads: the source schema is truncated and the warehouse rebuilt")
+    args = parser.parse_args(argv)
+
+    if not args.skip_load and not args.overwrite:
+        print("The benchmark truncates the source schema and rebuilds the warehouse; rerun with --overwrite "
+              "against a local database (or --skip-load to only time the OLAP methods).")
+        raise SystemExit(2)
+
+    scale_factors = sorted(args.sf)
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    engine = olap_engine()
+    records = []
+    for sf in scale_factors:
+        print(f"=== SF{sf:g} ===")
+        sf_records = []
+        if not args.skip_load:
+            directory = os.path.join(args.data_dir, f"sf{sf:g}")
+            sf_records += generate_and_ingest(sf, directory, args.seed, args.workers)
+            sf_records += run_etl(os.path.join(args.data_dir, f"etl_metrics_sf{sf:g}.jsonl"), args.workers)
+            engine.dispose()
+        sf_records += run_olap(engine, args.repeats, not args.no_aggregates)
+        for record in sf_records:
+            record.update(run_id=run_id, sf=sf)
+        records += sf_records
+        with open(args.output, "a") as f:
+            for record in sf_records:
+                f.write(json.dumps(record) + "\n")
+
+    report(records, scale_factors)
+
+if __name__ == "__main__":
+    main()
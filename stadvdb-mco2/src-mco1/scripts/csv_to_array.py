@@ -1,62 +1,123 @@
-from psycopg2.extras import execute_values
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor
 from utils.conn import get_connection
-import pandas as pd
+from utils.copy_stream import NULL, copy_text
 
-def load_crew(conn):
-  df = pd.read_sql(
-    'SELECT "tconst", "directors", "writers" FROM stadvdb.crew_import',
-    conn
-  )
+# Rows fetched per round trip from the import tables' server-side cursors and
+# encoded into one COPY block.
+CHUNK_SIZE = 200_000
+
+# A comma-separated value can be wrapped in braces as-is to form a text[]
+# literal unless an element is empty, is NULL, or contains a character that
+# array syntax or COPY text format treats specially.
+NEEDS_QUOTING = re.compile(r'["\\{}\s]|(?:^|,)(?:,|$)|(?:^|,)null(?:,|$)', re.IGNORECASE)
+
+def text_field(value):
+  """Renders a value as a COPY text-format field."""
+  if value is None:
+    return NULL
+  value = str(value)
+  if "\\" in value or "\t" in value or "\n" in value or "\r" in value:
+    value = value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+  return value
 
-  df["directors"] = df["directors"].str.split(",")
-  df["writers"] = df["writers"].str.split(",")
 
-  tuples = [(
-    row.tconst,
-    row.directors,
-    row.writers,
-  ) for row in df.itertuples(index=False)]
+def array_field(value):
+  """Renders a comma-separated string as a COPY text-format text[] field,
+  the same array STRING_TO_ARRAY(value, ',') builds in csv_to_array.sql.
+  """
+  if value is None:
+    return NULL
+  if value == "":
+    return "{}"
+  if not NEEDS_QUOTING.search(value):
+    return "{" + value + "}"
+  elements = ('"' + e.replace("\\", "\\\\").replace('"', '\\"') + '"' for e in value.split(","))
+  return text_field("{" + ",".join(elements) + "}")
+
 
-  insert_query = """
-    INSERT INTO stadvdb.crew (tconst, directors, writers)
-    VALUES %s
+def stream_rows(conn, query, name, chunk_size=CHUNK_SIZE):
+  """Yields the rows of query in lists of at most chunk_size, read through a
+  server-side cursor so the import table is never held in memory.
   """
+  with conn.cursor(name=name) as cur:
+    cur.itersize = chunk_size
+    cur.execute(query)
+    while True:
+      rows = cur.fetchmany(chunk_size)
+      if not rows:
+        break
+      yield rows
 
-  with conn.cursor() as cur:
-    execute_values(cur, insert_query, tuples)
-    conn.commit()
 
-def load_name_basics(conn):
-  df = pd.read_sql(
-    'SELECT "nconst", "primaryName", "birthYear", "deathYear", "primaryProfession", "knownForTitles" FROM name_basics_import',
-    conn
+def convert(source_conn, conn, query, name, table_name, columns, encoders):
+  """COPYs the rows of query into table_name, encoding every column with
+  its encoder. Each chunk becomes one COPY text block, so memory use is
+  bounded by CHUNK_SIZE whatever the size of the import table. The import
+  table is read on source_conn: conn is in COPY IN state while the blocks
+  are pulled, and cannot run the cursor's FETCHes meanwhile.
+  """
+  counter = {"rows": 0}
+
+  def blocks():
+    for rows in stream_rows(source_conn, query, name):
+      counter["rows"] += len(rows)
+      yield "".join(
+        "\t".join([encode(value) for encode, value in zip(encoders, row)]) + "\n"
+        for row in rows
+      )
+
+  copy_text(conn, table_name, columns, blocks())
+  conn.commit()
+  source_conn.commit()
+  print(f"Loaded {counter['rows']} rows into {table_name}.")
+  return counter["rows"]
+
+
+def load_crew(source_conn, conn):
+  return convert(
+    source_conn,
+    conn,
+    'SELECT "tconst", "directors", "writers" FROM stadvdb.crew_import',
+    "crew_import_src",
+    "stadvdb.crew",
+    ["tconst", "directors", "writers"],
+    [text_field, array_field, array_field],
   )
 
-  df["primaryProfession"] = df["primaryProfession"].str.split(",")
-  df["knownForTitles"] = df["knownForTitles"].str.split(",")
-
-  tuples = [(
-    row.nconst,
-    row.primaryName,
-    row.birthYear,
-    row.deathYear,
-    row.primaryProfession,
-    row.knownForTitles
-  ) for row in df.itertuples(index=False)]
-
-  insert_query = """
-    INSERT INTO stadvdb.name_basics (nconst, primary_name, birth_year, death_year, primary_profession, known_for_titles)
-    VALUES %s
+def load_name_basics(source_conn, conn):
+  return convert(
+    source_conn,
+    conn,
+    'SELECT "nconst", "primaryName", "birthYear", "deathYear", "primaryProfession", "knownForTitles" FROM stadvdb.name_basics_import',
+    "name_basics_import_src",
+    "stadvdb.name_basics",
+    ["nconst", "primary_name", "birth_year", "death_year", "primary_profession", "known_for_titles"],
+    [text_field, text_field, text_field, text_field, array_field, array_field],
+  )
+
+LOADERS = [load_crew, load_name_basics]
+
+def run_loader(loader):
+  """Runs one loader on its own pair of connections (worker process entry
+  point): one reads the import table, the other COPYs into the target.
   """
+  with get_connection() as source_conn, get_connection() as conn:
+    return loader(source_conn, conn)
 
-  with conn.cursor() as cur:
-    execute_values(cur, insert_query, tuples)
-    conn.commit()
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Convert the comma-separated import columns into text[] tables.")
+  parser.add_argument("--parallel", action="store_true", help="load crew and name_basics at the same time")
+  args = parser.parse_args(argv)
 
-def main():
-  with get_connection() as conn:
-    load_crew(conn)
-    load_name_basics(conn)
+  if args.parallel:
+    with ProcessPoolExecutor(max_workers=len(LOADERS)) as pool:
+      list(pool.map(run_loader, LOADERS))
+  else:
+    with get_connection() as source_conn, get_connection() as conn:
+      for loader in LOADERS:
+        loader(source_conn, conn)
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,341 @@
+import pandas as pd
+from utils.keymap import KeyMap, RoleEncoder
+from aggregates import AGGREGATES, FULL_PERSON_AGGREGATES, build_aggregates, affected_persons, refresh_person_aggregates
+from ETL import (
+    etl_indexes, resolve_parent_title_keys, stream_query, load_frames_to_postgres, load_principals_chunks,
+    transform_dim_person, transform_dim_title, transform_fact_title_ratings,
+    DIM_PERSON_COLUMNS, DIM_PERSON_QUERY, DIM_TITLE_COLUMNS, DIM_TITLE_QUERY,
+    FACT_TITLE_RATINGS_COLUMNS, FACT_TITLE_RATINGS_QUERY, FACT_TITLE_PRINCIPALS_QUERY,
+)
+
+# Natural keys sent back to the source per query when fetching changed rows.
+KEY_BATCH_SIZE = 50_000
+
+# Change tracking lives in the warehouse: the md5 of every source row (or of
+# every title's principals) as of the last refresh, when each source table
+# was last refreshed, and the titles whose facts changed since the person
+# aggregates were last brought up to date. create_dwh_tables drops them all,
+# so a full rebuild starts a new baseline.
+STATE_DDL = """
+CREATE TABLE IF NOT EXISTS etl_source_hash (
+    source_table VARCHAR(50) NOT NULL,
+    natural_key VARCHAR(15) NOT NULL,
+    row_hash CHAR(32) NOT NULL,
+    PRIMARY KEY (source_table, natural_key)
+);
+
+CREATE TABLE IF NOT EXISTS etl_watermark (
+    source_table VARCHAR(50) PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL,
+    rows_changed INT NOT NULL,
+    rows_deleted INT NOT NULL
+);
+
+-- No key: the two fact refreshes run side by side and would otherwise wait
+-- on each other's uncommitted rows for titles they both changed.
+CREATE TABLE IF NOT EXISTS etl_dirty_titles (
+    title_key INT NOT NULL
+);
+"""
+
+def create_state_tables(dwh_conn):
+    with dwh_conn.cursor() as cur:
+        cur.execute(STATE_DDL)
+    dwh_conn.commit()
+
+
+def row_hash_query(query, key):
+    """Hashes every row of query, keyed by its natural key."""
+    return f"SELECT q.{key} AS natural_key, md5(q::text) AS row_hash FROM ({query}) q"
+
+
+def group_hash_query(query, key, order_by):
+    """Hashes all rows of query sharing a natural key as one unit."""
+    return f"""
+    SELECT q.{key} AS natural_key, md5(string_agg(q::text, '|' ORDER BY q.{order_by})) AS row_hash
+    FROM ({query}) q
+    GROUP BY q.{key}
+    """
+
+
+def batches(keys, size=KEY_BATCH_SIZE):
+    for start in range(0, len(keys), size):
+        yield keys[start:start + size]
+
+
+def diff_source(source_conn, dwh_conn, source_table, hash_query):
+    """Streams the source's current (natural_key, row_hash) pairs into a temp
+    table on the warehouse and compares them with the last recorded hashes.
+
+    Returns (changed, deleted) lists of natural keys, or None when there is no
+    baseline for source_table yet. In that case the current hashes are staged
+    and record_hashes stores them as the baseline.
+    """
+    with dwh_conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE source_hash_stage (natural_key VARCHAR(15), row_hash CHAR(32)) ON COMMIT DROP;")
+    load_frames_to_postgres(
+        stream_query(source_conn, hash_query, f'{source_table}_hash_src', cache=False),
+        'source_hash_stage', ['natural_key', 'row_hash'], dwh_conn, commit=False
+    )
+
+    with dwh_conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM etl_source_hash WHERE source_table = %s);", (source_table,))
+        if not cur.fetchone()[0]:
+            return None
+
+        cur.execute("""
+            SELECT s.natural_key
+            FROM source_hash_stage s
+            LEFT JOIN etl_source_hash h
+                ON h.source_table = %s AND h.natural_key = s.natural_key
+            WHERE h.row_hash IS DISTINCT FROM s.row_hash
+            ORDER BY s.natural_key;
+        """, (source_table,))
+        changed = [row[0] for row in cur.fetchall()]
+
+        cur.execute("""
+            SELECT h.natural_key
+            FROM etl_source_hash h
+            WHERE h.source_table = %s
+                AND NOT EXISTS (SELECT 1 FROM source_hash_stage s WHERE s.natural_key = h.natural_key)
+            ORDER BY h.natural_key;
+        """, (source_table,))
+        deleted = [row[0] for row in cur.fetchall()]
+
+    print(f"{source_table}: {len(changed)} new or changed, {len(deleted)} deleted since the last refresh.")
+    return changed, deleted
+
+
+def record_hashes(dwh_conn, source_table, changed=None, deleted=()):
+    """Stores the staged hashes for the changed keys (all staged keys when
+    changed is None) and forgets deleted keys, then moves the watermark.
+    """
+    with dwh_conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO etl_source_hash (source_table, natural_key, row_hash)
+            SELECT DISTINCT ON (natural_key) %s, natural_key, row_hash
+            FROM source_hash_stage
+            WHERE %s OR natural_key = ANY(%s)
+            ORDER BY natural_key, row_hash
+            ON CONFLICT (source_table, natural_key) DO UPDATE SET row_hash = EXCLUDED.row_hash;
+        """, (source_table, changed is None, list(changed or [])))
+        recorded = cur.rowcount
+        cur.execute("DELETE FROM etl_source_hash WHERE source_table = %s AND natural_key = ANY(%s);",
+                    (source_table, list(deleted)))
+        cur.execute("""
+            INSERT INTO etl_watermark (source_table, refreshed_at, rows_changed, rows_deleted)
+            VALUES (%s, NOW(), %s, %s)
+            ON CONFLICT (source_table) DO UPDATE
+            SET refreshed_at = EXCLUDED.refreshed_at,
+                rows_changed = EXCLUDED.rows_changed,
+                rows_deleted = EXCLUDED.rows_deleted;
+        """, (source_table, recorded, len(deleted)))
+
+
+def fetch_changed(source_conn, query, key, keys, name):
+    """Yields the rows of query whose natural key is in keys, one key batch at a time."""
+    for i, key_batch in enumerate(batches(keys)):
+        yield from stream_query(
+            source_conn, f"SELECT * FROM ({query}) q WHERE q.{key} = ANY(%s)", f'{name}_{i}', params=(key_batch,),
+            cache=False
+        )
+
+
+def upsert_frames(dwh_conn, frames, table_name, columns, conflict_key):
+    """COPYs frames into a staging table and merges them into table_name.
+    Existing rows are updated in place, so their surrogate keys never change.
+    """
+    stage = f"{table_name}_stage"
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {', '.join(columns)} FROM {table_name} WITH NO DATA;")
+    load_frames_to_postgres(frames, stage, columns, dwh_conn, commit=False)
+
+    # DISTINCT ON: one INSERT ... ON CONFLICT may not update the same row twice
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in columns if col != conflict_key)
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {table_name} ({', '.join(columns)})
+            SELECT DISTINCT ON ({conflict_key}) {', '.join(columns)} FROM {stage}
+            ON CONFLICT ({conflict_key}) DO UPDATE SET {updates};
+        """)
+        print(f"Upserted {cur.rowcount} rows into {table_name}.")
+
+
+def refresh_dimension(source_conn, dwh_conn, source_table, query, key, transform, table_name, columns, conflict_key):
+    """Upserts the new and changed rows of a dimension and returns their
+    natural keys.
+    """
+    changed_deleted = diff_source(source_conn, dwh_conn, source_table, row_hash_query(query, key))
+    if changed_deleted is None:
+        record_hashes(dwh_conn, source_table)
+        dwh_conn.commit()
+        print(f"No baseline for {source_table}; recorded the current source as the baseline.")
+        return []
+
+    # Deleted source rows keep their dimension row: older facts may still
+    # reference the surrogate key, and the fact refreshes drop their facts.
+    changed, deleted = changed_deleted
+    if changed:
+        frames = (transform(df) for df in fetch_changed(source_conn, query, key, changed, f'{source_table}_changed'))
+        upsert_frames(dwh_conn, frames, table_name, columns, conflict_key)
+    record_hashes(dwh_conn, source_table, changed, deleted)
+    dwh_conn.commit()
+    return changed
+
+
+def refresh_dim_date(source_conn, dwh_conn):
+    print("Starting incremental refresh for DimDate...")
+    df_years = pd.read_sql('SELECT MIN(start_year) AS min_year, MAX(start_year) AS max_year FROM title_basics;', source_conn)
+
+    years = range(int(df_years['min_year'][0]), int(df_years['max_year'][0]) + 1)
+    dim_date_df = pd.DataFrame(years, columns=['year'])
+    dim_date_df['date_key'] = dim_date_df['year']
+    dim_date_df['decade'] = (dim_date_df['year'] // 10) * 10
+    dim_date_df['century'] = (dim_date_df['year'] // 100) * 100
+    dim_date_df = dim_date_df[['date_key', 'year', 'decade', 'century']]
+
+    upsert_frames(dwh_conn, [dim_date_df], 'dim_date', list(dim_date_df.columns), 'date_key')
+    dwh_conn.commit()
+
+
+def refresh_dim_person(source_conn, dwh_conn):
+    print("Starting incremental refresh for DimPerson...")
+    refresh_dimension(source_conn, dwh_conn, 'name_basics', DIM_PERSON_QUERY, 'nconst',
+                      transform_dim_person, 'dim_person', DIM_PERSON_COLUMNS, 'nconstid')
+
+
+def refresh_dim_title(source_conn, dwh_conn):
+    print("Starting incremental refresh for DimTitle...")
+    changed = refresh_dimension(source_conn, dwh_conn, 'title_basics', DIM_TITLE_QUERY, 'tconst',
+                                transform_dim_title, 'dim_title', DIM_TITLE_COLUMNS, 'tconstid')
+    # A changed title may have a new parent, or be the newly loaded parent of
+    # episodes that did not resolve before.
+    if changed:
+        resolve_parent_title_keys(dwh_conn, changed)
+
+
+def delete_title_facts(dwh_conn, table_name, tconsts):
+    with dwh_conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM {table_name} f
+            USING dim_title t
+            WHERE f.title_key = t.title_key AND t.tconstid = ANY(%s);
+        """, (list(tconsts),))
+        print(f"Removed {cur.rowcount} stale rows from {table_name}.")
+
+
+def mark_dirty_titles(dwh_conn, tconsts):
+    with dwh_conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO etl_dirty_titles (title_key)
+            SELECT title_key FROM dim_title WHERE tconstid = ANY(%s);
+        """, (list(tconsts),))
+
+
+def title_map_for(dwh_conn, tconsts):
+    return KeyMap.from_frame(pd.read_sql(
+        "SELECT title_key, tconstid FROM dim_title WHERE tconstid = ANY(%(keys)s)", dwh_conn, params={'keys': list(tconsts)}
+    ), 'tconstid', 'title_key')
+
+
+def refresh_fact_title_ratings(source_conn, dwh_conn):
+    print("Starting incremental refresh for FactTitleRatings...")
+    # The hashed row includes startyear, so a title moving to another year
+    # also has its date_key replaced.
+    changed_deleted = diff_source(source_conn, dwh_conn, 'ratings', row_hash_query(FACT_TITLE_RATINGS_QUERY, 'tconst'))
+    if changed_deleted is None:
+        record_hashes(dwh_conn, 'ratings')
+        dwh_conn.commit()
+        print("No baseline for ratings; recorded the current source as the baseline.")
+        return
+
+    changed, deleted = changed_deleted
+    date_map = pd.read_sql("SELECT date_key, year FROM dim_date", dwh_conn).set_index('year')
+    for key_batch in batches(changed + deleted):
+        delete_title_facts(dwh_conn, 'fact_title_ratings', key_batch)
+        mark_dirty_titles(dwh_conn, key_batch)
+    for i, key_batch in enumerate(batches(changed)):
+        title_map = title_map_for(dwh_conn, key_batch)
+        frames = (
+            transform_fact_title_ratings(df, title_map, date_map)
+            for df in fetch_changed(source_conn, FACT_TITLE_RATINGS_QUERY, 'tconst', key_batch, f'ratings_changed_{i}')
+        )
+        load_frames_to_postgres(frames, 'fact_title_ratings', FACT_TITLE_RATINGS_COLUMNS, dwh_conn, commit=False)
+    record_hashes(dwh_conn, 'ratings', changed, deleted)
+    dwh_conn.commit()
+
+
+def refresh_fact_title_principals(source_conn, dwh_conn):
+    print("Starting incremental refresh for FactTitlePrincipals...")
+    hash_query = group_hash_query(FACT_TITLE_PRINCIPALS_QUERY, 'tconst', 'ordering')
+    changed_deleted = diff_source(source_conn, dwh_conn, 'principals', hash_query)
+    if changed_deleted is None:
+        record_hashes(dwh_conn, 'principals')
+        dwh_conn.commit()
+        print("No baseline for principals; recorded the current source as the baseline.")
+        return
+
+    # A title's principals are replaced as a unit whenever any of them changed.
+    changed, deleted = changed_deleted
+    role_encoder = RoleEncoder.from_query(dwh_conn)
+    for key_batch in batches(changed + deleted):
+        delete_title_facts(dwh_conn, 'fact_title_principals', key_batch)
+        mark_dirty_titles(dwh_conn, key_batch)
+    roles = facts = 0
+    for i, key_batch in enumerate(batches(changed)):
+        frames = list(fetch_changed(source_conn, FACT_TITLE_PRINCIPALS_QUERY, 'tconst', key_batch, f'principals_changed_{i}'))
+        if not frames:
+            continue
+        df = pd.concat(frames, ignore_index=True)
+
+        title_map = title_map_for(dwh_conn, key_batch)
+        person_map = KeyMap.from_frame(pd.read_sql(
+            "SELECT person_key, nconstid FROM dim_person WHERE nconstid = ANY(%(keys)s)", dwh_conn,
+            params={'keys': df['nconst'].dropna().unique().tolist()}
+        ), 'nconstid', 'person_key')
+        batch_roles, batch_facts = load_principals_chunks([df], dwh_conn, title_map, person_map, role_encoder)
+        roles += batch_roles
+        facts += batch_facts
+    print(f"Added {roles} new roles to dim_role and {facts} rows to fact_title_principals.")
+    record_hashes(dwh_conn, 'principals', changed, deleted)
+    dwh_conn.commit()
+
+
+def refresh_aggregates(source_conn, dwh_conn):
+    print("Refreshing aggregate tables...")
+    build_aggregates(dwh_conn, AGGREGATES)
+    with dwh_conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('agg_person_role') IS NOT NULL AND to_regclass('agg_person_title_bridge') IS NOT NULL;")
+        built = cur.fetchone()[0]
+    if not built:
+        build_aggregates(dwh_conn, FULL_PERSON_AGGREGATES)
+        with dwh_conn.cursor() as cur:
+            cur.execute("TRUNCATE etl_dirty_titles;")
+        dwh_conn.commit()
+        return
+
+    # The dirty titles are cleared in the same transaction as their people's
+    # aggregates are rewritten, so a failed refresh is retried in full.
+    dirty = pd.read_sql("SELECT DISTINCT title_key FROM etl_dirty_titles", dwh_conn)['title_key'].tolist()
+    persons = affected_persons(dwh_conn, dirty) if dirty else []
+    for person_batch in batches(persons):
+        refresh_person_aggregates(dwh_conn, person_batch)
+    with dwh_conn.cursor() as cur:
+        cur.execute("DELETE FROM etl_dirty_titles WHERE title_key = ANY(%s);", (dirty,))
+    dwh_conn.commit()
+    print(f"Recomputed the person aggregates of {len(persons)} people credited on {len(dirty)} changed titles.")
+
+
+# Same stage names as ETL.STAGES so --only/--from work in both modes. As in
+# the full build, new roles are added by the principals refresh. The small
+# aggregate tables are rebuilt from the refreshed facts; the person
+# aggregates are only recomputed for the people on changed titles.
+REFRESH_STAGES = {
+    'dim_date': (refresh_dim_date, []),
+    'dim_person': (refresh_dim_person, []),
+    'dim_title': (refresh_dim_title, []),
+    'fact_title_ratings': (refresh_fact_title_ratings, ['dim_title', 'dim_date']),
+    'fact_title_principals': (refresh_fact_title_principals, ['dim_title', 'dim_person']),
+    'indexes': (etl_indexes, ['fact_title_ratings', 'fact_title_principals']),
+    'aggregates': (refresh_aggregates, ['fact_title_ratings', 'fact_title_principals']),
+}
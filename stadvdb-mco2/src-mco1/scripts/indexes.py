@@ -0,0 +1,133 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Sessions used to build indexes and validate constraints side by side.
+INDEX_WORKERS = int(os.getenv("ETL_INDEX_WORKERS", 4))
+
+# Foreign keys of the fact tables. They are not created with the tables, so
+# COPY does not check every row against the dimensions; build_indexes adds
+# them once the facts are loaded.
+CONSTRAINTS = [
+    ('fact_title_ratings', 'fact_title_ratings_title_key_fkey', 'FOREIGN KEY (title_key) REFERENCES dim_title(title_key)'),
+    ('fact_title_ratings', 'fact_title_ratings_date_key_fkey', 'FOREIGN KEY (date_key) REFERENCES dim_date(date_key)'),
+    ('fact_title_principals', 'fact_title_principals_title_key_fkey', 'FOREIGN KEY (title_key) REFERENCES dim_title(title_key)'),
+    ('fact_title_principals', 'fact_title_principals_person_key_fkey', 'FOREIGN KEY (person_key) REFERENCES dim_person(person_key)'),
+    ('fact_title_principals', 'fact_title_principals_role_key_fkey', 'FOREIGN KEY (role_key) REFERENCES dim_role(role_key)'),
+]
+
+# Secondary indexes serving the OLAP workload (notebooks/olap_queries.py).
+# Facts are loaded in tconst order, which dim_title's keys follow, so
+# title_key is physically sorted in the fact tables and a BRIN index covers
+# it for a fraction of a B-tree's size.
+INDEXES = [
+    ('fact_title_ratings', 'ratings_title_key_idx', 'btree (title_key)'),
+    ('fact_title_ratings', 'ratings_votes_idx', 'btree (num_votes)'),
+    ('fact_title_principals', 'principals_title_key_brin', 'brin (title_key)'),
+    ('fact_title_principals', 'principals_person_key_idx', 'btree (person_key)'),
+    ('fact_title_principals', 'principals_role_key_idx', 'btree (role_key)'),
+    ('dim_title', 'title_type_year_idx', 'btree (title_type, start_year)'),
+    ('dim_title', 'title_start_year_idx', 'btree (start_year)'),
+    ('dim_title', 'title_parent_tconst_idx', 'btree (parent_tconst)'),
+    ('dim_title', 'title_parent_title_key_idx', 'btree (parent_title_key)'),
+    ('dim_title', 'title_primary_title_idx', 'btree (primary_title)'),
+    ('dim_person', 'person_primary_name_idx', 'btree (primary_name)'),
+    ('dim_role', 'role_category_idx', 'btree (category)'),
+]
+
+WAREHOUSE_TABLES = ['dim_date', 'dim_title', 'dim_person', 'dim_role', 'fact_title_ratings', 'fact_title_principals']
+
+
+def drop_load_constraints(dwh_conn, tables=None):
+    """Drops the declared foreign keys and secondary indexes on tables (all
+    warehouse tables by default) ahead of a bulk load.
+    """
+    with dwh_conn.cursor() as cur:
+        for table, name, _ in CONSTRAINTS:
+            if tables is None or table in tables:
+                cur.execute(f"ALTER TABLE IF EXISTS {table} DROP CONSTRAINT IF EXISTS {name};")
+        for table, name, _ in INDEXES:
+            if tables is None or table in tables:
+                cur.execute(f"DROP INDEX IF EXISTS {name};")
+    dwh_conn.commit()
+    print("Dropped warehouse constraints and secondary indexes for the load.")
+
+
+def _run_ddl(connect, statements):
+    """Runs statements in order on a session of their own. connect returns a
+    context manager yielding a warehouse connection, whose session profile
+    sets maintenance_work_mem for the index builds.
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+                conn.commit()
+    return statements
+
+
+def _run_parallel(connect, jobs, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for statements in pool.map(lambda job: _run_ddl(connect, job), jobs):
+            for statement in statements:
+                print(f"  done: {statement}")
+
+
+def set_logged(dwh_conn, connect, workers=INDEX_WORKERS):
+    """Turns the warehouse's UNLOGGED tables (a shadow build) into regular
+    tables. Dimensions go first: a logged table may not reference an
+    unlogged one.
+    """
+    with dwh_conn.cursor() as cur:
+        cur.execute("""
+            SELECT relname FROM pg_class
+            WHERE relname = ANY(%s) AND relkind = 'r' AND relpersistence = 'u'
+                AND relnamespace = current_schema()::regnamespace;
+        """, (WAREHOUSE_TABLES,))
+        unlogged = {row[0] for row in cur.fetchall()}
+    dwh_conn.commit()
+    for prefix in ('dim_', 'fact_'):
+        _run_parallel(connect, [
+            [f"ALTER TABLE {table} SET LOGGED;"]
+            for table in WAREHOUSE_TABLES if table in unlogged and table.startswith(prefix)
+        ], workers)
+
+
+def build_indexes(dwh_conn, connect, workers=INDEX_WORKERS):
+    """Creates whatever declared index or constraint is missing, then
+    ANALYZEs the warehouse. Safe to run after every load; tables loaded
+    UNLOGGED are made durable first.
+
+    Indexes are built in parallel sessions; they only take SHARE locks, so
+    several can build on one table at once. Foreign keys are added NOT VALID
+    (a catalog change) and validated afterwards, one session per table,
+    since validation conflicts with itself on the same table.
+    """
+    set_logged(dwh_conn, connect, workers)
+    print("Building warehouse indexes and constraints...")
+    _run_parallel(connect, [
+        [f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING {definition};"]
+        for table, name, definition in INDEXES
+    ], workers)
+
+    with dwh_conn.cursor() as cur:
+        cur.execute("""
+            SELECT conname FROM pg_constraint
+            WHERE conname = ANY(%s) AND connamespace = current_schema()::regnamespace;
+        """, ([name for _, name, _ in CONSTRAINTS],))
+        existing = {row[0] for row in cur.fetchall()}
+        missing = [c for c in CONSTRAINTS if c[1] not in existing]
+        for table, name, definition in missing:
+            cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID;")
+    dwh_conn.commit()
+
+    by_table = {}
+    for table, name, _ in missing:
+        by_table.setdefault(table, []).append(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name};")
+    _run_parallel(connect, list(by_table.values()), workers)
+
+    analyze(connect, workers)
+
+
+def analyze(connect, workers=INDEX_WORKERS):
+    _run_parallel(connect, [[f"ANALYZE {table};"] for table in WAREHOUSE_TABLES], workers)
+    print("Warehouse statistics updated.")
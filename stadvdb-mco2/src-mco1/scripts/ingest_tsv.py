@@ -0,0 +1,254 @@
+import argparse
+import gzip
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dotenv import load_dotenv
+from utils.conn import get_connection
+from utils.copy_stream import READ_SIZE, copy_text
+from utils.scheduler import run_partitions
+import csv_to_array
+
+load_dotenv()
+
+SCHEMA = os.getenv("DB_SCHEMA", "stadvdb")
+IMPORT_DIR = os.getenv("IMPORT_DIR", ".")
+
+# Bytes of TSV each worker parses and COPYs in one transaction.
+CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", 64 << 20))
+LINES_PER_BLOCK = 50_000
+
+# IMDb file -> (final table, its columns in file order, indexes of the
+# comma-separated columns stored as text[]). The TSVs are already COPY text
+# format (\N for NULL, 0/1 booleans, plain integers), so files without list
+# columns are sent to COPY byte for byte and only list columns are rewritten
+# into array literals. Column names are matched to the table's actual ones
+# ignoring case and underscores (see target_columns).
+FILES = {
+  "title.akas": ("akas", ["title_id", "ordering", "title", "region", "language", "types", "attributes", "is_original_title"], ()),
+  "title.basics": ("title_basics", ["tconst", "title_type", "primary_title", "original_title", "is_adult", "start_year", "end_year", "runtime_minutes", "genres"], (8,)),
+  "title.crew": ("crew", ["tconst", "directors", "writers"], (1, 2)),
+  "title.episode": ("episode", ["tconst", "parent_tconst", "season_number", "episode_number"], ()),
+  "title.ratings": ("ratings", ["tconst", 'average_rating', 'num_votes'], ()),
+  "name.basics": ("name_basics", ["nconst", "primary_name", "birth_year", "death_year", "primary_profession", "known_for_titles"], (4, 5)),
+  "title.principals": ("principals", ["tconst", "ordering", "nconst", "category", "job", "characters"], ()),
+}
+
+NULL = b"\\N"
+NEEDS_QUOTING = re.compile(csv_to_array.NEEDS_QUOTING.pattern.encode(), re.IGNORECASE)
+ESCAPE = re.compile(rb"\\(.)")
+UNESCAPES = {b"t": b"\t", b"n": b"\n", b"r": b"\r"}
+
+def array_field(field):
+  """Rewrites a raw (COPY-escaped) comma-separated TSV field as a text[]
+  literal, like STRING_TO_ARRAY(field, ',').
+  """
+  if field == NULL:
+    return field
+  if not NEEDS_QUOTING.search(field) and field:
+    return b"{" + field + b"}"
+  text = ESCAPE.sub(lambda m: UNESCAPES.get(m.group(1), m.group(1)), field)
+  return csv_to_array.array_field(text.decode("utf-8")).encode("utf-8")
+
+
+def convert_blocks(data, array_columns):
+  """Yields COPY blocks for a chunk of whole TSV lines, rewriting the list
+  columns of every line.
+  """
+  lines = data.split(b"\n")
+  if lines and not lines[-1]:
+    lines.pop()
+  for start in range(0, len(lines), LINES_PER_BLOCK):
+    out = []
+    for line in lines[start:start + LINES_PER_BLOCK]:
+      fields = line.split(b"\t")
+      for i in array_columns:
+        fields[i] = array_field(fields[i])
+      out.append(b"\t".join(fields))
+    yield b"\n".join(out) + b"\n"
+
+
+def raw_blocks(data):
+  for start in range(0, len(data), READ_SIZE):
+    yield data[start:start + READ_SIZE]
+
+
+_conn = None
+
+def worker_connection():
+  """One connection per worker process, reused across its chunks."""
+  global _conn
+  if _conn is None or _conn.closed:
+    _conn = get_connection()
+    with _conn.cursor() as cur:
+      cur.execute("SET synchronous_commit = off;")
+    _conn.commit()
+  return _conn
+
+
+def comparable(name):
+  return name.strip('"').replace("_", "").lower()
+
+
+def target_columns(conn, key):
+  """Returns the quoted names of the target table's columns for FILES[key],
+  in file order. csv_to_array.sql creates ratings with "averageRating" and
+  "numVotes" and later renames them to average_rating and num_votes, so
+  names are matched ignoring case and underscores.
+  """
+  table, columns, _ = FILES[key]
+  with conn.cursor() as cur:
+    cur.execute(
+      "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s;",
+      (SCHEMA, table),
+    )
+    actual = {comparable(name): name for (name,) in cur.fetchall()}
+  missing = [column for column in columns if comparable(column) not in actual]
+  if missing:
+    raise ValueError(f"{SCHEMA}.{table} has no column matching {', '.join(missing)}")
+  return ['"' + actual[comparable(column)].replace('"', '""') + '"' for column in columns]
+
+
+def copy_chunk(key, columns, data):
+  """COPYs one chunk of whole TSV lines into its final table in its own
+  transaction, so a failed chunk leaves nothing behind and can be retried.
+  Returns the number of rows loaded.
+  """
+  table, _, array_columns = FILES[key]
+  blocks = convert_blocks(data, array_columns) if array_columns else raw_blocks(data)
+  conn = worker_connection()
+  try:
+    copy_text(conn, f"{SCHEMA}.{table}", columns, blocks)
+    conn.commit()
+  except BaseException:
+    conn.rollback()
+    raise
+  return data.count(b"\n")
+
+
+def line_ranges(path, chunk_bytes=CHUNK_BYTES):
+  """Splits a plain TSV into (start, end) byte ranges of about chunk_bytes
+  that begin and end on line boundaries, skipping the header line.
+  """
+  with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    size = len(mm)
+    start = mm.find(b"\n") + 1 if size else 0
+    ranges = []
+    while 0 < start < size:
+      end = mm.find(b"\n", min(start + chunk_bytes, size) - 1)
+      end = size if end < 0 else end + 1
+      ranges.append((start, end))
+      start = end
+    return ranges
+
+
+def ingest_range(index, path, key, columns, start, end):
+  """Worker for plain files: maps the file and COPYs bytes [start, end)."""
+  with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    return copy_chunk(key, columns, mm[start:end])
+
+
+def gzip_chunks(path, chunk_bytes=CHUNK_BYTES):
+  """Decompresses a gzipped TSV as a stream, yielding chunks of whole lines
+  without the header.
+  """
+  with gzip.open(path, "rb") as f:
+    f.readline()
+    rest = b""
+    while True:
+      data = f.read(chunk_bytes)
+      if not data:
+        break
+      data = rest + data
+      cut = data.rfind(b"\n") + 1
+      if cut == 0:
+        rest = data
+        continue
+      rest = data[cut:]
+      yield data[:cut]
+    if rest:
+      yield rest if rest.endswith(b"\n") else rest + b"\n"
+
+
+def ingest_gzip(path, key, columns, workers, retries):
+  """Feeds a gzipped file's chunks to a process pool as they are
+  decompressed, keeping at most two chunks per worker in flight.
+  """
+  rows = 0
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    running = {}
+    chunks = gzip_chunks(path)
+    exhausted = False
+    while running or not exhausted:
+      while not exhausted and len(running) < 2 * workers:
+        data = next(chunks, None)
+        if data is None:
+          exhausted = True
+        else:
+          running[pool.submit(copy_chunk, key, columns, data)] = (data, 0)
+      if not running:
+        break
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        data, attempts = running.pop(future)
+        try:
+          rows += future.result()
+        except BaseException as e:
+          if attempts >= retries:
+            raise RuntimeError(f"{key}: chunk failed after {retries} retries: {e!r}")
+          print(f"[{key}] chunk failed ({e!r}), retry {attempts + 1}/{retries}")
+          running[pool.submit(copy_chunk, key, columns, data)] = (data, attempts + 1)
+  return rows
+
+
+def find_file(directory, key):
+  for name in (f"{key}.tsv", f"{key}.tsv.gz"):
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+      return path
+  return None
+
+
+def ingest_file(path, key, workers, retries):
+  print(f"Ingesting {path} into {SCHEMA}.{FILES[key][0]}...")
+  conn = get_connection()
+  try:
+    columns = target_columns(conn, key)
+  finally:
+    conn.close()
+  if path.endswith(".gz"):
+    rows = ingest_gzip(path, key, columns, workers, retries)
+  else:
+    ranges = [(path, key, columns, start, end) for start, end in line_ranges(path)]
+    rows = sum(run_partitions(ingest_range, ranges, key, max_workers=workers, retries=retries).values())
+  print(f"Loaded {rows} rows into {SCHEMA}.{FILES[key][0]}.")
+  return rows
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Load the IMDb TSV files straight into the final source tables.")
+  parser.add_argument("--dir", default=IMPORT_DIR, help="directory holding the .tsv or .tsv.gz files")
+  parser.add_argument("--only", nargs="+", choices=list(FILES), metavar="FILE",
+                      help=f"files to ingest ({', '.join(FILES)})")
+  parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="parser/COPY processes per file")
+  parser.add_argument("--retries", type=int, default=2, help="retries of a failed chunk")
+  parser.add_argument("--truncate", action="store_true", help="empty the target tables first")
+  args = parser.parse_args(argv)
+
+  keys = args.only or list(FILES)
+  paths = {key: find_file(args.dir, key) for key in keys}
+  missing = [key for key, path in paths.items() if path is None]
+  if missing:
+    print(f"Missing files in {args.dir}: {', '.join(f'{key}.tsv[.gz]' for key in missing)}")
+    raise SystemExit(2)
+
+  if args.truncate:
+    with get_connection() as conn, conn.cursor() as cur:
+      cur.execute(f"TRUNCATE {', '.join(f'{SCHEMA}.{FILES[key][0]}' for key in keys)};")
+
+  for key in keys:
+    ingest_file(paths[key], key, args.workers, args.retries)
+
+if __name__ == "__main__":
+  main()
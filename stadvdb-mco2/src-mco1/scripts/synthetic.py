@@ -0,0 +1,237 @@
+import argparse
+import gzip
+import os
+import numpy as np
+
+# Rows per scale factor, in the proportions of the IMDb dumps (~8 principals
+# and ~4.5 akas per title, ~1.2 people per title): SF1 is about 1M principals.
+TITLES_PER_SF = 125_000
+PEOPLE_PER_SF = 155_000
+CHUNK_TITLES = 50_000
+CURRENT_YEAR = 2025
+
+TITLE_TYPES = ["tvEpisode", "short", "movie", "video", "tvSeries", "tvMovie", "tvMiniSeries", "tvSpecial", "videoGame", "tvShort", "tvPilot"]
+TITLE_TYPE_P = [0.770, 0.090, 0.068, 0.030, 0.019, 0.012, 0.005, 0.003, 0.002, 0.0009, 0.0001]
+SERIES_TYPES = {"tvSeries", "tvMiniSeries"}
+
+# Principals per title (Poisson mean, capped at 10 like IMDb) and runtime
+# (mean minutes) by title type
+PRINCIPALS_MEAN = {"movie": 9.5, "tvSeries": 9.5, "tvMiniSeries": 9.5, "tvMovie": 9.0, "short": 6.0, "tvEpisode": 8.0}
+RUNTIME_MEAN = {"movie": 95, "tvMovie": 85, "tvEpisode": 35, "tvSeries": 40, "tvMiniSeries": 50, "short": 12, "video": 60, "tvSpecial": 70}
+
+GENRES = ["Drama", "Comedy", "Documentary", "Talk-Show", "Romance", "Family", "News", "Animation", "Reality-TV", "Action",
+          "Crime", "Music", "Adventure", "Game-Show", "Short", "Thriller", "Horror", "Mystery", "Fantasy", "Sport",
+          "Biography", "History", "Sci-Fi", "Adult", "Musical", "Western", "War", "Film-Noir"]
+PROFESSIONS = ["actor", "actress", "miscellaneous", "producer", "writer", "director", "camera_department", "cinematographer",
+               "composer", "editor", "art_department", "sound_department", "music_department", "casting_director", "stunts"]
+CATEGORIES = ["actor", "actress", "self", "director", "writer", "producer", "composer", "cinematographer", "editor",
+              "production_designer", "archive_footage", "casting_director"]
+CATEGORY_P = [0.27, 0.19, 0.14, 0.09, 0.10, 0.07, 0.04, 0.04, 0.03, 0.01, 0.01, 0.01]
+REGIONS = ["US", "GB", "DE", "FR", "JP", "IN", "ES", "IT", "CA", "BR", "RU", "MX", "AU", "KR", "SE"]
+
+# Header and file name of every file, as in the IMDb dumps
+HEADERS = {
+  "title.basics": ["tconst", "titleType", "primaryTitle", "originalTitle", "isAdult", "startYear", "endYear", "runtimeMinutes", "genres"],
+  "title.akas": ["titleId", "ordering", "title", "region", "language", "types", "attributes", "isOriginalTitle"],
+  "title.crew": ["tconst", "directors", "writers"],
+  "title.episode": ["tconst", "parentTconst", "seasonNumber", "episodeNumber"],
+  "title.ratings": ["tconst", "averageRating", "numVotes"],
+  "name.basics": ["nconst", "primaryName", "birthYear", "deathYear", "primaryProfession", "knownForTitles"],
+  "title.principals": ["tconst", "ordering", "nconst", "category", "job", "characters"],
+}
+
+NULL = "\\N"
+
+def tconst(i):
+  return f"tt{i:07d}"
+
+def nconst(i):
+  return f"nm{i:07d}"
+
+def zipf_index(rng, a, n, size):
+  """Indexes in [0, n) with Zipf(a) popularity, the popular ones scattered
+  over the range instead of being the smallest ids.
+  """
+  ranks = (rng.zipf(a, size) - 1) % n
+  return (ranks * 2654435761 + 97) % n
+
+def nullable(values, null_rate, rng):
+  """Formats values as strings with a share of them replaced by \\N."""
+  out = values.astype(str).astype(object)
+  out[rng.random(len(values)) < null_rate] = NULL
+  return out
+
+def genre_lists(rng, size, items, weights, max_items, null_rate):
+  """Comma-separated lists of 1 to max_items distinct items, alphabetical
+  like IMDb's genre lists; popular items come up more often.
+  """
+  picks = rng.choice(len(items), size=(size, max_items), p=weights)
+  counts = rng.integers(1, max_items + 1, size)
+  nulls = rng.random(size) < null_rate
+  return [
+    NULL if null else ",".join(sorted({items[j] for j in row[:k]}))
+    for row, k, null in zip(picks, counts, nulls)
+  ]
+
+def zipf_weights(n, a=1.1):
+  weights = 1.0 / np.arange(1, n + 1) ** a
+  return weights / weights.sum()
+
+
+def title_chunk(rng, first, n, n_people):
+  """Generates the titles [first, first + n) and everything hanging off
+  them. Returns {file: lines}.
+  """
+  ids = np.arange(first, first + n)
+  types = np.array(TITLE_TYPES, dtype=object)[rng.choice(len(TITLE_TYPES), size=n, p=TITLE_TYPE_P)]
+  series = np.flatnonzero(np.isin(types, list(SERIES_TYPES)))
+  episodes = np.flatnonzero(types == "tvEpisode")
+  if len(series) == 0:
+    types[episodes] = "tvSeries"
+    series, episodes = episodes, episodes[:0]
+
+  start = CURRENT_YEAR - np.minimum(rng.exponential(22, n), CURRENT_YEAR - 1874).astype(int)
+  start_null = rng.random(n) < 0.11
+  # Episodes belong to series of the same chunk, a few long-running series
+  # holding most of them, and start when or after their series did
+  parents = series[zipf_index(rng, 1.5, len(series), len(episodes))]
+  start[episodes] = np.minimum(start[parents] + rng.integers(0, 12, len(episodes)), CURRENT_YEAR)
+  start_null[episodes] = start_null[parents] | (rng.random(len(episodes)) < 0.05)
+  start_years = np.where(start_null, NULL, start.astype(str)).astype(object)
+
+  ended = np.isin(types, list(SERIES_TYPES)) & ~start_null & (rng.random(n) < 0.45)
+  end = np.minimum(start + rng.geometric(0.25, n) - 1, CURRENT_YEAR)
+  end_years = np.where(ended, end.astype(str), NULL).astype(object)
+
+  runtime_mean = np.array([RUNTIME_MEAN.get(t, 30) for t in types])
+  runtimes = nullable(np.maximum(1, rng.normal(runtime_mean, runtime_mean * 0.25)).astype(int), 0.65, rng)
+  adult = (rng.random(n) < 0.015).astype(int)
+  genres = genre_lists(rng, n, GENRES, zipf_weights(len(GENRES)), 3, 0.06)
+
+  lines = {key: [] for key in HEADERS if key != "name.basics"}
+  basics = lines["title.basics"]
+  for i in range(n):
+    name = f"Title {ids[i]}"
+    basics.append(f"{tconst(ids[i])}\t{types[i]}\t{name}\t{name}\t{adult[i]}\t{start_years[i]}\t{end_years[i]}\t{runtimes[i]}\t{genres[i]}\n")
+
+  seasons = nullable(rng.geometric(0.3, len(episodes)), 0.2, rng)
+  numbers = nullable(rng.integers(1, 25, len(episodes)), 0.2, rng)
+  lines["title.episode"] = [
+    f"{tconst(ids[e])}\t{tconst(ids[p])}\t{s}\t{k}\n" for e, p, s, k in zip(episodes, parents, seasons, numbers)
+  ]
+
+  rated = np.flatnonzero(rng.random(n) < np.where(types == "tvEpisode", 0.08, 0.35))
+  ratings = np.clip(np.round(rng.normal(6.4, 1.4, len(rated)), 1), 1.0, 10.0)
+  votes = np.minimum(5 + rng.lognormal(3.0, 1.9, len(rated)).astype(np.int64), 3_000_000)
+  lines["title.ratings"] = [f"{tconst(ids[i])}\t{r:.1f}\t{v}\n" for i, r, v in zip(rated, ratings, votes)]
+
+  akas = lines["title.akas"]
+  aka_counts = np.minimum(rng.poisson(4.46, n), 40)
+  regions = rng.choice(REGIONS, size=int(aka_counts.sum()))
+  r = 0
+  for i, count in zip(ids, aka_counts):
+    for ordering in range(1, count + 1):
+      if ordering == 1:
+        akas.append(f"{tconst(i)}\t1\tTitle {i}\t{NULL}\t{NULL}\toriginal\t{NULL}\t1\n")
+      else:
+        akas.append(f"{tconst(i)}\t{ordering}\tTitle {i} ({regions[r]})\t{regions[r]}\t{NULL}\t{NULL}\t{NULL}\t0\n")
+      r += 1
+
+  principal_counts = np.clip(rng.poisson([PRINCIPALS_MEAN.get(t, 7.0) for t in types]), 1, 10)
+  total = int(principal_counts.sum())
+  people = zipf_index(rng, 1.25, n_people, total) + 1
+  categories = np.array(CATEGORIES, dtype=object)[rng.choice(len(CATEGORIES), size=total, p=CATEGORY_P)]
+  principals, crew = lines["title.principals"], lines["title.crew"]
+  p = 0
+  for i, count in zip(ids, principal_counts):
+    directors, writers = [], []
+    for ordering in range(1, count + 1):
+      person, category = people[p], categories[p]
+      if category in ("actor", "actress", "self"):
+        job, characters = NULL, f'["Character {p % 997}"]' if category != "self" else '["Self"]'
+      else:
+        job, characters = (category.replace("_", " ") if rng.random() < 0.3 else NULL), NULL
+        if category == "director":
+          directors.append(nconst(person))
+        elif category == "writer":
+          writers.append(nconst(person))
+      principals.append(f"{tconst(i)}\t{ordering}\t{nconst(person)}\t{category}\t{job}\t{characters}\n")
+      p += 1
+    crew.append(f"{tconst(i)}\t{','.join(directors) or NULL}\t{','.join(writers) or NULL}\n")
+  return lines
+
+
+def people_chunk(rng, first, n, n_titles):
+  ids = np.arange(first, first + n)
+  births = nullable(rng.integers(1880, 2010, n), 0.88, rng)
+  deaths = nullable(rng.integers(1950, CURRENT_YEAR + 1, n), 0.96, rng)
+  professions = genre_lists(rng, n, PROFESSIONS, zipf_weights(len(PROFESSIONS), 1.3), 3, 0.2)
+  known_counts = rng.integers(1, 5, n)
+  known = zipf_index(rng, 1.3, n_titles, int(known_counts.sum())) + 1
+  known_null = rng.random(n) < 0.15
+  lines = []
+  k = 0
+  for i, count, null in zip(ids, known_counts, known_null):
+    titles = NULL if null else ",".join(tconst(t) for t in known[k:k + count])
+    k += count
+    lines.append(f"{nconst(i)}\tPerson {i}\t{births[i - first]}\t{deaths[i - first]}\t{professions[i - first]}\t{titles}\n")
+  return lines
+
+
+def open_outputs(directory, compress):
+  files = {}
+  for key, header in HEADERS.items():
+    path = os.path.join(directory, f"{key}.tsv" + (".gz" if compress else ""))
+    f = gzip.open(path, "wt", compresslevel=1, encoding="utf-8") if compress else open(path, "w", encoding="utf-8")
+    f.write("\t".join(header) + "\n")
+    files[key] = f
+  return files
+
+
+def generate(sf, directory, seed=42, compress=False):
+  """Writes IMDb-shaped TSVs for scale factor sf into directory. The output
+  only depends on sf and seed: every chunk has its own seeded generator.
+  Returns the number of rows written per file.
+  """
+  os.makedirs(directory, exist_ok=True)
+  n_titles = max(1, int(TITLES_PER_SF * sf))
+  n_people = max(1, int(PEOPLE_PER_SF * sf))
+  rows = {key: 0 for key in HEADERS}
+  files = open_outputs(directory, compress)
+  try:
+    for index, first in enumerate(range(1, n_titles + 1, CHUNK_TITLES)):
+      rng = np.random.default_rng([seed, 0, index])
+      chunk = title_chunk(rng, first, min(CHUNK_TITLES, n_titles + 1 - first), n_people)
+      for key, lines in chunk.items():
+        files[key].writelines(lines)
+        rows[key] += len(lines)
+    for index, first in enumerate(range(1, n_people + 1, CHUNK_TITLES)):
+      rng = np.random.default_rng([seed, 1, index])
+      lines = people_chunk(rng, first, min(CHUNK_TITLES, n_people + 1 - first), n_titles)
+      files["name.basics"].writelines(lines)
+      rows["name.basics"] += len(lines)
+  finally:
+    for f in files.values():
+      f.close()
+  return rows
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Generate deterministic IMDb-shaped TSV files.")
+  parser.add_argument("--sf", type=float, default=1, help="scale factor; SF1 is about 1M principals")
+  parser.add_argument("--out", default=None, help="output directory (default: synthetic/sf<SF>)")
+  parser.add_argument("--seed", type=int, default=42)
+  parser.add_argument("--gzip", action="store_true", help="write .tsv.gz files")
+  parser.add_argument("--load", action="store_true", help="then load them into the source schema with ingest_tsv.py (truncating it)")
+  args = parser.parse_args(argv)
+
+  directory = args.out or os.path.join("synthetic", f"sf{args.sf:g}")
+  rows = generate(args.sf, directory, args.seed, args.gzip)
+  for key, count in rows.items():
+    print(f"{key}: {count} rows")
+  if args.load:
+    import ingest_tsv
+    ingest_tsv.main(["--dir", directory, "--truncate"])
+
+if __name__ == "__main__":
+  main()
@@ -1,5 +1,9 @@
 import psycopg2
 import os
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2 import extensions, pool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,3 +21,260 @@ def get_connection(config=None):
 
   conn = psycopg2.connect(**conn_params)
   return conn
+
+
+def db_config(prefix):
+  """Connection settings for the database described by the <prefix>_HOST,
+  _PORT, _DB, _USER, _PASS and _SCHEMA environment variables.
+  """
+  return {
+    "host": os.getenv(f"{prefix}_HOST"),
+    "port": os.getenv(f"{prefix}_PORT"),
+    "database": os.getenv(f"{prefix}_DB"),
+    "user": os.getenv(f"{prefix}_USER"),
+    "password": os.getenv(f"{prefix}_PASS"),
+    "schema": os.getenv(f"{prefix}_SCHEMA"),
+  }
+
+
+POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", 8))
+# Connections older than this are closed instead of being handed out again,
+# and connections idle for longer than the health check interval are pinged
+# before use.
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))
+POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", 30))
+
+# Pool name -> (environment prefix, session settings). Settings are applied
+# once per physical connection, right after it is opened. The warehouse is
+# rebuilt from the source, so its bulk-load sessions skip waiting for WAL
+# flushes on commit.
+PROFILES = {
+  "source": ("SOURCE", {
+    "work_mem": os.getenv("ETL_WORK_MEM", "256MB"),
+  }),
+  "warehouse": ("DW", {
+    "work_mem": os.getenv("ETL_WORK_MEM", "256MB"),
+    "maintenance_work_mem": os.getenv("ETL_MAINTENANCE_WORK_MEM", "1GB"),
+    "synchronous_commit": os.getenv("ETL_SYNCHRONOUS_COMMIT", "off"),
+  }),
+  "olap": ("DW", {
+    "work_mem": os.getenv("OLAP_WORK_MEM", "128MB"),
+  }),
+}
+
+
+def session_settings(name):
+  prefix, settings = PROFILES[name]
+  schema = db_config(prefix)["schema"]
+  if name == "warehouse":
+    # Set by ETL.py while it rebuilds the warehouse in a shadow schema
+    schema = os.getenv("DW_BUILD_SCHEMA") or schema
+  return {"search_path": schema, **settings} if schema else dict(settings)
+
+
+def apply_settings(conn, settings):
+  """Applies session settings on a connection and commits."""
+  with conn.cursor() as cur:
+    for setting, value in settings.items():
+      cur.execute("SELECT set_config(%s, %s, false);", (setting, str(value)))
+  conn.commit()
+
+
+class PooledConnection(extensions.connection):
+  """psycopg2 connection that remembers its pool and when it was opened."""
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.pool_name = None
+    self.opened_at = time.monotonic()
+    self.released_at = self.opened_at
+
+
+class ConnectionPool(object):
+  """Thread-safe pool of session-tuned connections for one database.
+
+  Wraps psycopg2's ThreadedConnectionPool with what it lacks: new physical
+  connections get the pool's session profile, connections past
+  POOL_MAX_LIFETIME are recycled, connections idle for a while are pinged
+  before being handed out, and getconn blocks when every connection is
+  checked out instead of raising.
+  """
+
+  def __init__(self, name, minconn=POOL_MIN, maxconn=POOL_MAX):
+    prefix, _ = PROFILES[name]
+    config = db_config(prefix)
+    self.name = name
+    self.settings = session_settings(name)
+    self._slots = threading.BoundedSemaphore(maxconn)
+    self._pool = pool.ThreadedConnectionPool(
+      minconn, maxconn,
+      host=config["host"],
+      port=config["port"],
+      database=config["database"],
+      user=config["user"],
+      password=config["password"],
+      connection_factory=PooledConnection,
+    )
+
+  def _healthy(self, conn):
+    if conn.closed:
+      return False
+    now = time.monotonic()
+    if now - conn.opened_at > POOL_MAX_LIFETIME:
+      return False
+    if now - conn.released_at > POOL_HEALTH_CHECK_IDLE:
+      try:
+        with conn.cursor() as cur:
+          cur.execute("SELECT 1;")
+        conn.rollback()
+      except psycopg2.Error:
+        return False
+    return True
+
+  def getconn(self):
+    self._slots.acquire()
+    try:
+      while True:
+        conn = self._pool.getconn()
+        if conn.pool_name is None:
+          apply_settings(conn, self.settings)
+          conn.pool_name = self.name
+          return conn
+        if self._healthy(conn):
+          return conn
+        self._pool.putconn(conn, close=True)
+    except BaseException:
+      self._slots.release()
+      raise
+
+  def putconn(self, conn):
+    """Returns a connection, rolling back whatever it left open."""
+    discard = conn.closed != 0
+    if not discard:
+      try:
+        if conn.autocommit:
+          conn.autocommit = False
+        elif conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+          conn.rollback()
+        conn.released_at = time.monotonic()
+      except psycopg2.Error:
+        discard = True
+    self._pool.putconn(conn, close=discard)
+    self._slots.release()
+
+  @contextmanager
+  def connection(self):
+    conn = self.getconn()
+    try:
+      yield conn
+    finally:
+      self.putconn(conn)
+
+  def closeall(self):
+    self._pool.closeall()
+
+
+_pools = {}
+_pools_pid = os.getpid()
+# Pools inherited from a parent process. Their sockets belong to the parent,
+# so they are kept referenced and never closed here.
+_inherited = []
+_pools_lock = threading.Lock()
+
+def get_pool(name):
+  """The named pool of the current process, created on first use. Pools are
+  per process: a forked worker starts with fresh pools of its own.
+  """
+  global _pools_pid
+  with _pools_lock:
+    if os.getpid() != _pools_pid:
+      _inherited.extend(_pools.values())
+      _pools.clear()
+      _pools_pid = os.getpid()
+    if name not in _pools:
+      _pools[name] = ConnectionPool(name)
+    return _pools[name]
+
+
+def checkout(name):
+  """Checks a connection out of the named pool; return it with release."""
+  return get_pool(name).getconn()
+
+
+def release(conn):
+  get_pool(conn.pool_name).putconn(conn)
+
+
+def pooled(name):
+  """Context manager checking a connection out of the named pool."""
+  return get_pool(name).connection()
+
+
+def close_pools():
+  """Closes every pool of this process, e.g. before forking workers."""
+  with _pools_lock:
+    if os.getpid() == _pools_pid:
+      for p in _pools.values():
+        p.closeall()
+    _pools.clear()
+
+
+def olap_engine(**kwargs):
+  """SQLAlchemy engine for the OLAP notebooks with the 'olap' profile: the
+  engine's own pool pings connections before use, recycles them after
+  POOL_MAX_LIFETIME and applies the olap session settings to each new one.
+  """
+  from sqlalchemy import create_engine, event
+  from sqlalchemy.engine import URL
+
+  config = db_config(PROFILES["olap"][0])
+  url = URL.create(
+    "postgresql+psycopg2",
+    username=config["user"],
+    password=config["password"],
+    host=config["host"],
+    port=config["port"],
+    database=config["database"],
+  )
+  options = {"pool_pre_ping": True, "pool_recycle": POOL_MAX_LIFETIME, "pool_size": POOL_MAX}
+  options.update(kwargs)
+  engine = create_engine(url, **options)
+  settings = session_settings("olap")
+
+  @event.listens_for(engine, "connect")
+  def apply_olap_settings(dbapi_conn, _):
+    with dbapi_conn.cursor() as cur:
+      for setting, value in settings.items():
+        cur.execute("SELECT set_config(%s, %s, false);", (setting, str(value)))
+    dbapi_conn.commit()
+
+  return engine
+
+
+def olap_async_engine(**kwargs):
+  """AsyncEngine (asyncpg) counterpart of olap_engine for AsyncOLAP. The
+  olap session settings are sent as server settings when each connection
+  starts.
+  """
+  from sqlalchemy.engine import URL
+  from sqlalchemy.ext.asyncio import create_async_engine
+
+  config = db_config(PROFILES["olap"][0])
+  url = URL.create(
+    "postgresql+asyncpg",
+    username=config["user"],
+    password=config["password"],
+    host=config["host"],
+    port=config["port"],
+    database=config["database"],
+  )
+  settings = {setting: str(value) for setting, value in session_settings("olap").items()}
+  options = {
+    "pool_pre_ping": True,
+    "pool_recycle": POOL_MAX_LIFETIME,
+    "pool_size": POOL_MAX,
+    "connect_args": {"server_settings": settings},
+  }
+  options.update(kwargs)
+  return create_async_engine(url, **options)
@@ -0,0 +1,127 @@
+import pandas as pd
+from utils import metrics
+
+# COPY ... FROM STDIN (FORMAT text) markers and escapes
+NULL = "\\N"
+ESCAPES = (("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r"))
+
+BATCH_SIZE = 100_000
+READ_SIZE = 1 << 20
+
+def encode_column(s):
+  """Renders a Series as COPY text-format fields: NULL for missing values,
+  t/f for booleans, plain digits for integers (including nullable Int64 and
+  integral floats produced by NaN-holding int columns) and escaped text.
+  """
+  null = s.isna()
+
+  if s.dtype.kind == "b" or str(s.dtype) == "boolean":
+    return s.map({True: "t", False: "f"}).where(~null, NULL)
+
+  if s.dtype.kind == "f":
+    values = s[~null]
+    if (values == values.round()).all():
+      s = s.astype("Int64")
+
+  if s.dtype == object or pd.api.types.is_string_dtype(s.dtype):
+    text = s.where(~null, "").astype(str)
+    for raw, escaped in ESCAPES:
+      text = text.str.replace(raw, escaped, regex=False)
+  else:
+    text = s.astype(str)
+
+  return text.where(~null, NULL)
+
+
+def encode_frame(df):
+  """Encodes a DataFrame batch as one COPY text-format block."""
+  if df.empty:
+    return ""
+  columns = [encode_column(df[col]) for col in df.columns]
+  lines = columns[0].str.cat(columns[1:], sep="\t") if len(columns) > 1 else columns[0]
+  return "\n".join(lines) + "\n"
+
+
+def iter_batches(frames, batch_size=BATCH_SIZE):
+  """Splits every frame into slices of at most batch_size rows."""
+  for df in frames:
+    for start in range(0, len(df), batch_size):
+      yield df.iloc[start:start + batch_size]
+
+
+class IterReader(object):
+  """Read-only file-like adapter over an iterator of str/bytes chunks.
+  Only the chunk currently being consumed is kept in memory, which lets a
+  generator of encoded batches feed cursor.copy_expert lazily.
+  """
+
+  def __init__(self, chunks):
+    self._chunks = iter(chunks)
+    self._buffer = b""
+    self._pos = 0
+    self.bytes_read = 0
+
+  def _fill(self, size):
+    while size < 0 or len(self._buffer) - self._pos < size:
+      chunk = next(self._chunks, None)
+      if chunk is None:
+        return
+      if isinstance(chunk, str):
+        chunk = chunk.encode("utf-8")
+      self._buffer = self._buffer[self._pos:] + chunk
+      self._pos = 0
+
+  def read(self, size=-1):
+    self._fill(size)
+    end = len(self._buffer) if size < 0 else self._pos + size
+    data = self._buffer[self._pos:end]
+    self._pos += len(data)
+    self.bytes_read += len(data)
+    return data
+
+  def readline(self, size=-1):
+    while True:
+      newline = self._buffer.find(b"\n", self._pos)
+      if newline >= 0:
+        return self.read(newline + 1 - self._pos)
+      before = len(self._buffer) - self._pos
+      self._fill(before + 1)
+      if len(self._buffer) - self._pos == before:
+        return self.read()
+
+
+def copy_text(conn, table_name, columns, blocks):
+  """COPYs an iterable of COPY text-format blocks (str or bytes, each made of
+  whole lines) into table_name in a single statement, pulling one block at a
+  time. Returns the number of bytes sent.
+  """
+  reader = IterReader(blocks)
+  with metrics.current().phase("load"), conn.cursor() as cur:
+    cur.copy_expert(
+      f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)",
+      reader,
+      size=READ_SIZE,
+    )
+  return reader.bytes_read
+
+
+def copy_frames(conn, table_name, columns, frames, batch_size=BATCH_SIZE):
+  """COPYs an iterable of DataFrames into table_name in a single statement.
+  Frames are encoded one batch at a time as COPY reads from the stream, so
+  frames may be a generator that extracts and transforms lazily. Column
+  order in each frame must match columns. Returns the number of rows sent.
+
+  Rows and bytes sent are added to the running stage's metrics; time spent
+  pulling frames from a lazy generator is charged to that generator's own
+  phases, the rest (encoding and the COPY itself) to load.
+  """
+  counter = {"rows": 0}
+
+  def blocks():
+    for batch in iter_batches(frames, batch_size):
+      counter["rows"] += len(batch)
+      yield encode_frame(batch)
+
+  nbytes = copy_text(conn, table_name, columns, blocks())
+  metrics.current().add_copy(counter["rows"], nbytes)
+  return counter["rows"]
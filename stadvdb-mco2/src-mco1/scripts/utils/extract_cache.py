@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import shutil
+import pyarrow as pa
+from utils import metrics
+
+FINGERPRINT_QUERY = """
+  SELECT relname, n_tup_ins, n_tup_upd, n_tup_del, pg_relation_size(relid)
+  FROM pg_stat_user_tables
+  WHERE schemaname = current_schema()
+  ORDER BY relname;
+"""
+
+MANIFEST = "_manifest.json"
+
+def cache_dir():
+  """The cache root, or None when caching is off. Read on every call so
+  worker processes pick up a directory set by ETL.py --extract-cache.
+  """
+  return os.getenv("ETL_EXTRACT_CACHE") or None
+
+
+def source_fingerprint(conn):
+  """Insert/update/delete counters and on-disk size of every table in the
+  connection's schema. Any write to the source the statistics system has
+  seen changes the fingerprint, so cached extracts go stale with it.
+  """
+  with conn.cursor() as cur:
+    cur.execute(FINGERPRINT_QUERY)
+    return [list(row) for row in cur.fetchall()]
+
+
+def cache_key(query, params, fingerprint):
+  payload = json.dumps([query, list(params) if params else None, fingerprint], default=str)
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def write_part(path, df):
+  table = pa.Table.from_pandas(df, preserve_index=False)
+  with pa.OSFile(path, "wb") as sink:
+    with pa.ipc.new_file(sink, table.schema) as writer:
+      writer.write_table(table)
+
+
+def read_part(path, columns=None):
+  """Reads one cached chunk through a memory map: Arrow buffers reference the
+  page cache instead of being read into the heap, and only the requested
+  columns are materialized.
+  """
+  with pa.memory_map(path, "r") as source:
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+      table = table.select(columns)
+    return table.to_pandas()
+
+
+def read_cached(directory, columns=None):
+  with open(os.path.join(directory, MANIFEST)) as f:
+    manifest = json.load(f)
+  for part in manifest["parts"]:
+    with metrics.current().phase("extract"):
+      df = read_part(os.path.join(directory, part), columns)
+    yield df
+
+
+def write_through(directory, query, frames):
+  """Yields frames while writing each one to an Arrow IPC file. The parts go
+  to a temporary directory renamed into place once the result is complete,
+  so an interrupted or partially consumed extract is never cached.
+  """
+  tmp_dir = f"{directory}.{os.getpid()}.tmp"
+  shutil.rmtree(tmp_dir, ignore_errors=True)
+  os.makedirs(tmp_dir)
+  parts, rows = [], 0
+  try:
+    for df in frames:
+      part = f"part-{len(parts):05d}.arrow"
+      with metrics.current().phase("extract"):
+        write_part(os.path.join(tmp_dir, part), df)
+      parts.append(part)
+      rows += len(df)
+      yield df
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+      json.dump({"query": query, "rows": rows, "parts": parts}, f)
+    try:
+      os.rename(tmp_dir, directory)
+    except OSError:
+      pass # Another process cached the same extract first
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def cached_query(conn, query, params, fetch):
+  """Serves query from the extract cache, or runs fetch() (a generator of
+  DataFrames) and caches its chunks on the way through. The cache key is the
+  query, its parameters and the source fingerprint.
+  """
+  root = cache_dir()
+  if root is None:
+    yield from fetch()
+    return
+
+  with metrics.current().phase("extract"):
+    key = cache_key(query, params, source_fingerprint(conn))
+  directory = os.path.join(root, key)
+  stage_metrics = metrics.current()
+  if os.path.exists(os.path.join(directory, MANIFEST)):
+    stage_metrics.extra["extract_cache_hits"] = stage_metrics.extra.get("extract_cache_hits", 0) + 1
+    yield from read_cached(directory)
+  else:
+    stage_metrics.extra["extract_cache_misses"] = stage_metrics.extra.get("extract_cache_misses", 0) + 1
+    os.makedirs(root, exist_ok=True)
+    yield from write_through(directory, query, fetch())
@@ -0,0 +1,167 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+KEYMAP_DIR = os.getenv("ETL_KEYMAP_DIR", os.path.join(tempfile.gettempdir(), "stadvdb_keymaps"))
+
+def parse_const_ids(values):
+  """Parses IMDb identifiers ('tt0000001', 'nm0000001') into int64 by
+  dropping their two-letter prefix. Missing or malformed ids become -1.
+  """
+  ids = pd.to_numeric(pd.Series(values, dtype=object).str.slice(2), errors="coerce")
+  return ids.fillna(-1).to_numpy(dtype=np.int64)
+
+
+class KeyMap(object):
+  """Read-only map from an IMDb identifier to a warehouse surrogate key.
+
+  The map is two parallel int64 arrays sorted by parsed identifier, so it
+  takes 16 bytes per entry instead of a string-keyed pandas index, lookups
+  are a vectorized searchsorted, and saved maps can be memory-mapped so every
+  worker process shares the same read-only pages.
+  """
+
+  def __init__(self, ids, keys, presorted=False):
+    ids = np.asarray(ids, dtype=np.int64)
+    keys = np.asarray(keys, dtype=np.int64)
+    if not presorted:
+      order = np.argsort(ids, kind="stable")
+      ids, keys = ids[order], keys[order]
+    self.ids = ids
+    self.keys = keys
+
+  def __len__(self):
+    return len(self.ids)
+
+  @classmethod
+  def from_frame(cls, df, const_col, key_col):
+    return cls(parse_const_ids(df[const_col]), df[key_col].to_numpy(dtype=np.int64))
+
+  @classmethod
+  def from_query(cls, conn, query, name="keymap_src", chunk_size=1_000_000):
+    """Builds a map from a query returning (identifier, surrogate key) rows,
+    read through a server-side cursor so only one chunk of strings is held
+    at a time.
+    """
+    ids, keys = [], []
+    with conn.cursor(name=name) as cur:
+      cur.itersize = chunk_size
+      cur.execute(query)
+      while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+          break
+        consts, values = zip(*rows)
+        ids.append(parse_const_ids(consts))
+        keys.append(np.fromiter(values, dtype=np.int64, count=len(values)))
+    if not ids:
+      return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), presorted=True)
+    return cls(np.concatenate(ids), np.concatenate(keys))
+
+  def lookup(self, values):
+    """Resolves identifiers to surrogate keys as a nullable Int64 array;
+    identifiers that are not in the map come back as <NA>.
+    """
+    ids = parse_const_ids(values)
+    if len(self.ids) == 0:
+      return pd.array([pd.NA] * len(ids), dtype="Int64")
+    pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+    found = self.ids[pos] == ids
+    return pd.arrays.IntegerArray(np.where(found, self.keys[pos], 0), ~found)
+
+  @staticmethod
+  def _paths(name, directory):
+    return os.path.join(directory, f"{name}.ids.npy"), os.path.join(directory, f"{name}.keys.npy")
+
+  def save(self, name, directory=KEYMAP_DIR):
+    """Writes the map as two .npy files, atomically replacing older ones."""
+    os.makedirs(directory, exist_ok=True)
+    for path, array in zip(self._paths(name, directory), (self.ids, self.keys)):
+      tmp_path = f"{path}.{os.getpid()}.tmp"
+      with open(tmp_path, "wb") as f:
+        np.save(f, array)
+      os.replace(tmp_path, path)
+
+  @classmethod
+  def open(cls, name, directory=KEYMAP_DIR):
+    """Memory-maps a saved map read-only."""
+    ids_path, keys_path = cls._paths(name, directory)
+    return cls(np.load(ids_path, mmap_mode="r"), np.load(keys_path, mmap_mode="r"), presorted=True)
+
+
+ROLE_COLUMNS = ["category", "job", "characters"]
+
+def role_hashes(df):
+  """64-bit hash of each (category, job, characters) triple, stable across
+  processes and runs. Missing values hash alike whatever their dtype.
+  """
+  hashes = pd.util.hash_pandas_object(df[ROLE_COLUMNS].astype(object), index=False)
+  return hashes.to_numpy().view(np.int64)
+
+
+class RoleEncoder(object):
+  """Factorizes role triples into dense role keys in a single pass.
+
+  Known roles are kept as sorted (role_hash, role_key) arrays, as in KeyMap.
+  Each chunk is hashed, deduplicated with np.unique and matched with
+  searchsorted; unseen hashes get the next keys and are returned as new
+  dim_role rows together with the role key of every input row.
+  """
+
+  def __init__(self, hashes=None, keys=None):
+    known = KeyMap(hashes if hashes is not None else [], keys if keys is not None else [])
+    self.hashes = known.ids
+    self.keys = known.keys
+    self.next_key = int(self.keys.max()) + 1 if len(self.keys) else 1
+
+  @classmethod
+  def from_query(cls, conn, query="SELECT role_hash, role_key FROM dim_role"):
+    with conn.cursor() as cur:
+      cur.execute(query)
+      rows = cur.fetchall()
+    if not rows:
+      return cls()
+    hashes, keys = zip(*rows)
+    return cls(np.fromiter(hashes, dtype=np.int64), np.fromiter(keys, dtype=np.int64))
+
+  def encode(self, df, assign_keys=None):
+    """Returns (role_keys, new_roles): an int64 array aligned by position
+    with df, and a DataFrame of (role_key, role_hash, category, job,
+    character_name) rows for the roles seen for the first time.
+
+    New roles are numbered locally unless assign_keys is given; it receives
+    the new roles (without role_key, sorted by role_hash) and returns their
+    keys, e.g. after registering them in the database.
+    """
+    hashes = role_hashes(df)
+    unique, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+
+    pos = np.searchsorted(self.hashes, unique)
+    found = np.zeros(len(unique), dtype=bool)
+    in_range = pos < len(self.hashes)
+    found[in_range] = self.hashes[pos[in_range]] == unique[in_range]
+
+    new_hashes = unique[~found]
+    new_roles = df.iloc[first[~found]][ROLE_COLUMNS].rename(columns={"characters": "character_name"})
+    new_roles.insert(0, "role_hash", new_hashes)
+    new_roles.reset_index(drop=True, inplace=True)
+    if assign_keys is None:
+      new_keys = np.arange(self.next_key, self.next_key + len(new_hashes), dtype=np.int64)
+    else:
+      new_keys = np.asarray(assign_keys(new_roles), dtype=np.int64)
+    if len(new_keys):
+      self.next_key = max(self.next_key, int(new_keys.max()) + 1)
+
+    unique_keys = np.empty(len(unique), dtype=np.int64)
+    unique_keys[found] = self.keys[pos[found]]
+    unique_keys[~found] = new_keys
+
+    # Both inputs are sorted, so inserting at the searchsorted positions
+    # keeps the known-role arrays sorted without re-sorting them.
+    insert_at = pos[~found]
+    self.hashes = np.insert(self.hashes, insert_at, new_hashes)
+    self.keys = np.insert(self.keys, insert_at, new_keys)
+
+    new_roles.insert(0, "role_key", new_keys)
+    return unique_keys[inverse.ravel()], new_roles
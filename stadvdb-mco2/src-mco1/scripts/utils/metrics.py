@@ -0,0 +1,183 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_PATH = os.getenv("ETL_METRICS_PATH", "etl_metrics.jsonl")
+PROFILE_DIR = os.getenv("ETL_PROFILE_DIR", "etl_profiles")
+
+PHASES = ("extract", "transform", "load")
+
+def peak_rss_mb():
+  """Peak resident set size of this process and of its reaped children."""
+  own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return max(own, children) / 1024 # ru_maxrss is in KiB on Linux
+
+
+def reset_peak_rss():
+  """Resets the kernel's RSS high-water mark so a pool worker reused for a
+  later stage does not report an earlier stage's peak. Linux only.
+  """
+  try:
+    with open("/proc/self/clear_refs", "w") as f:
+      f.write("5")
+  except OSError:
+    pass
+
+
+class StageMetrics(object):
+  """Timings and counters for one ETL stage (or one partition of it).
+
+  Phase timings are exclusive: entering a nested phase pauses the enclosing
+  one, so the extract and transform work that COPY pulls through a lazy
+  generator is not also counted as load time.
+  """
+
+  def __init__(self, stage):
+    self.stage = stage
+    self.timings = dict.fromkeys(PHASES, 0.0)
+    self.rows = 0
+    self.bytes_copied = 0
+    self.peak_rss_mb = 0.0
+    self.extra = {}
+    self.started_at = datetime.now(timezone.utc).isoformat()
+    self._started = time.perf_counter()
+    self._stack = []
+
+  @contextmanager
+  def phase(self, name):
+    now = time.perf_counter()
+    if self._stack:
+      parent, since = self._stack[-1]
+      self.timings[parent] += now - since
+    self._stack.append((name, now))
+    try:
+      yield self
+    finally:
+      name, since = self._stack.pop()
+      now = time.perf_counter()
+      self.timings[name] = self.timings.get(name, 0.0) + now - since
+      if self._stack:
+        self._stack[-1] = (self._stack[-1][0], now)
+
+  def add_copy(self, rows, nbytes):
+    self.rows += rows
+    self.bytes_copied += nbytes
+
+  def merge(self, summary):
+    """Folds a partition's summary into this stage's totals."""
+    for name in PHASES:
+      self.timings[name] += summary.get(f"{name}_s", 0.0)
+    self.rows += summary.get("rows", 0)
+    self.bytes_copied += summary.get("bytes_copied", 0)
+    self.peak_rss_mb = max(self.peak_rss_mb, summary.get("peak_rss_mb", 0.0))
+
+  def summary(self):
+    wall = time.perf_counter() - self._started
+    result = {
+      "stage": self.stage,
+      "started_at": self.started_at,
+      "wall_s": round(wall, 3),
+    }
+    for name in PHASES:
+      result[f"{name}_s"] = round(self.timings[name], 3)
+    result.update({
+      "rows": self.rows,
+      "rows_per_sec": round(self.rows / wall, 1) if wall > 0 else 0.0,
+      "peak_rss_mb": round(max(self.peak_rss_mb, peak_rss_mb()), 1),
+      "bytes_copied": self.bytes_copied,
+    })
+    result.update(self.extra)
+    return result
+
+
+_current = None
+
+def current():
+  """The metrics of the stage running in this process. Outside of a stage
+  (e.g. an etl_* function called directly) a throwaway instance is returned,
+  so instrumented code never has to check.
+  """
+  return _current if _current is not None else StageMetrics(None)
+
+
+@contextmanager
+def stage(name, profile=None):
+  """Collects metrics for the code run inside the block. profile may be
+  'cprofile' (stats dumped to ETL_PROFILE_DIR/<stage>.prof) or 'tracemalloc'
+  (peak traced Python memory added to the summary).
+  """
+  global _current
+  reset_peak_rss()
+  metrics = _current = StageMetrics(name)
+  profiler = None
+  if profile == "cprofile":
+    profiler = cProfile.Profile()
+    profiler.enable()
+  elif profile == "tracemalloc":
+    tracemalloc.start()
+  try:
+    yield metrics
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      os.makedirs(PROFILE_DIR, exist_ok=True)
+      profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+    elif profile == "tracemalloc":
+      metrics.extra["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+      tracemalloc.stop()
+    _current = None
+
+
+def timed(phase_name):
+  """Decorator charging a function's run time to phase_name."""
+  def decorator(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      with current().phase(phase_name):
+        return fn(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def write_jsonl(summaries, run_id, path=METRICS_PATH):
+  with open(path, "a") as f:
+    for summary in summaries:
+      f.write(json.dumps({"run_id": run_id, **summary}) + "\n")
+
+
+TABLE_COLUMNS = [
+  # (summary field, header, width, format for numbers)
+  ("stage", "stage", 24, None),
+  ("status", "status", 8, None),
+  ("wall_s", "wall s", 9, "{:.1f}"),
+  ("extract_s", "extract s", 10, "{:.1f}"),
+  ("transform_s", "transform s", 12, "{:.1f}"),
+  ("load_s", "load s", 9, "{:.1f}"),
+  ("rows", "rows", 12, "{:,}"),
+  ("rows_per_sec", "rows/s", 11, "{:,.0f}"),
+  ("peak_rss_mb", "peak MiB", 9, "{:,.0f}"),
+  ("bytes_copied", "COPY MiB", 9, None),
+]
+
+def format_table(summaries):
+  """Renders stage summaries as a fixed-width table for the end of a run."""
+  lines = ["  ".join(f"{header:<{width}}" if field == "stage" else f"{header:>{width}}"
+                     for field, header, width, _ in TABLE_COLUMNS)]
+  for summary in summaries:
+    cells = []
+    for field, _, width, fmt in TABLE_COLUMNS:
+      value = summary.get(field, "")
+      if field == "bytes_copied" and value != "":
+        value = f"{value / 2**20:,.1f}"
+      elif fmt is not None and value != "":
+        value = fmt.format(value)
+      cells.append(f"{value:<{width}}" if field == "stage" else f"{value:>{width}}")
+    lines.append("  ".join(cells))
+  return "\n".join(lines)
@@ -0,0 +1,125 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+def expand(names, graph, groups):
+  """Resolves stage and group names into stage names, in graph order."""
+  selected = set()
+  for name in names:
+    if name in groups:
+      selected.update(groups[name])
+    elif name in graph:
+      selected.add(name)
+    else:
+      raise ValueError(f"Unknown stage or group: {name}")
+  return [stage for stage in graph if stage in selected]
+
+
+def downstream(graph, start):
+  """Returns start plus every stage that transitively depends on it."""
+  reached = {start}
+  changed = True
+  while changed:
+    changed = False
+    for stage, deps in graph.items():
+      if stage not in reached and reached.intersection(deps):
+        reached.add(stage)
+        changed = True
+  return [stage for stage in graph if stage in reached]
+
+
+def select_stages(graph, groups, only=None, start=None):
+  """Selects the stages to run: everything by default, narrowed by --only
+  (stages or groups) and/or --from (a stage and its whole subgraph).
+  """
+  selected = list(graph)
+  if only:
+    selected = expand(only, graph, groups)
+  if start:
+    subgraph = set(downstream(graph, expand([start], graph, groups)[0]))
+    selected = [stage for stage in selected if stage in subgraph]
+  return selected
+
+
+def run_dag(graph, stages, worker, max_workers=None):
+  """Runs the selected stages in a process pool, starting each stage as soon
+  as all of its selected dependencies have finished. Dependencies outside the
+  selection are assumed to be loaded already. A failed stage skips
+  everything downstream of it but lets independent stages finish.
+
+  Returns a tuple of ({stage: worker result}, {stage: error}).
+  """
+  selected = set(stages)
+  deps = {stage: [dep for dep in graph[stage] if dep in selected] for stage in stages}
+  results, failed = {}, {}
+  running = {}
+  started = {}
+
+  with ProcessPoolExecutor(max_workers=max_workers) as pool:
+    while True:
+      for stage in stages:
+        if stage in results or stage in failed or stage in running.values():
+          continue
+        if any(dep in failed for dep in deps[stage]):
+          failed[stage] = "skipped: a dependency failed"
+          print(f"[{stage}] skipped because a dependency failed")
+        elif all(dep in results for dep in deps[stage]):
+          print(f"[{stage}] started")
+          started[stage] = time.perf_counter()
+          running[pool.submit(worker, stage)] = stage
+
+      if not running:
+        break
+
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        stage = running.pop(future)
+        elapsed = time.perf_counter() - started[stage]
+        try:
+          results[stage] = future.result()
+          print(f"[{stage}] finished in {elapsed:.1f}s")
+        except BaseException as e:
+          failed[stage] = e
+          print(f"[{stage}] failed after {elapsed:.1f}s: {e!r}")
+
+  return results, failed
+
+
+def run_partitions(worker, partitions, label, max_workers=None, retries=0, describe="{} rows".format):
+  """Runs worker(index, *partition) for every partition in a process pool,
+  printing progress as partitions finish. A failed partition is resubmitted
+  up to retries times without touching the others, so workers must leave
+  nothing behind when they fail (e.g. one transaction per partition).
+  describe renders a worker result for the progress line.
+
+  Returns {index: worker result}; raises RuntimeError if any partition still
+  fails after its retries.
+  """
+  results, failed = {}, {}
+  attempts = {index: 0 for index in range(len(partitions))}
+  started = time.perf_counter()
+
+  with ProcessPoolExecutor(max_workers=max_workers) as pool:
+    running = {
+      pool.submit(worker, index, *partition): index
+      for index, partition in enumerate(partitions)
+    }
+    while running:
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        index = running.pop(future)
+        try:
+          results[index] = future.result()
+          print(f"[{label}] partition {index + 1}/{len(partitions)} done: {describe(results[index])} "
+                f"({len(results)}/{len(partitions)} complete, {time.perf_counter() - started:.1f}s)")
+        except BaseException as e:
+          attempts[index] += 1
+          if attempts[index] <= retries:
+            print(f"[{label}] partition {index + 1}/{len(partitions)} failed ({e!r}), retry {attempts[index]}/{retries}")
+            running[pool.submit(worker, index, *partitions[index])] = index
+          else:
+            failed[index] = e
+            print(f"[{label}] partition {index + 1}/{len(partitions)} failed after {retries} retries: {e!r}")
+
+  if failed:
+    raise RuntimeError(f"{label}: {len(failed)} of {len(partitions)} partitions failed")
+  return results
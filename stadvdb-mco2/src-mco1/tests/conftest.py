@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The ETL scripts import each other from scripts/ (e.g. "from utils.conn
+# import ..."), and the OLAP modules from notebooks/, as when run from there.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("scripts", "notebooks"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
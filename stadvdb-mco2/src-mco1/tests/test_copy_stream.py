@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+from utils.copy_stream import NULL, encode_column, encode_frame
+
+
+def test_encode_frame_nulls_and_escapes():
+    df = pd.DataFrame({
+        "title": ["plain", "tab\there", "line\nbreak", "back\\slash", None],
+        "rating": [7.5, np.nan, 6.0, 1.25, 3.0],
+    })
+    assert encode_frame(df) == (
+        "plain\t7.5\n"
+        "tab\\there\t\\N\n"
+        "line\\nbreak\t6.0\n"
+        "back\\\\slash\t1.25\n"
+        "\\N\t3.0\n"
+    )
+
+
+def test_encode_column_integers():
+    assert encode_column(pd.Series([1, None, 3], dtype="Int64")).tolist() == ["1", NULL, "3"]
+    # NaN turns int columns into floats; integral values are written as digits
+    assert encode_column(pd.Series([1.0, np.nan, 1990.0])).tolist() == ["1", NULL, "1990"]
+    assert encode_column(pd.Series([5, 6], dtype="int64")).tolist() == ["5", "6"]
+
+
+def test_encode_column_booleans():
+    assert encode_column(pd.Series([True, False])).tolist() == ["t", "f"]
+    assert encode_column(pd.Series([True, None, False], dtype="boolean")).tolist() == ["t", NULL, "f"]
+
+
+def test_encode_frame_single_column_and_empty():
+    assert encode_frame(pd.DataFrame({"tconst": ["tt1", "tt2"]})) == "tt1\ntt2\n"
+    assert encode_frame(pd.DataFrame({"tconst": []})) == ""
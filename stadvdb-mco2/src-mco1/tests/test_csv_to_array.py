@@ -0,0 +1,98 @@
+import pytest
+import csv_to_array
+from csv_to_array import NULL, array_field, text_field
+
+
+def test_array_field_plain_lists():
+    assert array_field("Action,Comedy,Drama") == "{Action,Comedy,Drama}"
+    assert array_field("nm0000001") == "{nm0000001}"
+
+
+def test_array_field_null_and_empty():
+    assert array_field(None) == NULL
+    assert array_field("") == "{}"
+
+
+def test_array_field_quotes_elements_that_need_it():
+    # Spaces, quotes and backslashes are quoted and escaped inside the array
+    # literal; the literal's own backslashes are then escaped for COPY.
+    assert array_field("a b,c") == '{"a b","c"}'
+    assert array_field('say "hi"') == '{"say \\\\"hi\\\\""}'
+    # Empty elements and a bare NULL stay strings, as STRING_TO_ARRAY keeps them
+    assert array_field("a,,b") == '{"a","","b"}'
+    assert array_field("null") == '{"null"}'
+
+
+def test_text_field_escapes():
+    assert text_field(None) == NULL
+    assert text_field("tab\there") == "tab\\there"
+    assert text_field(5) == "5"
+
+
+class FakeConnection:
+    """Just enough of a psycopg2 connection for convert(): like the real
+    one, it refuses any command while a COPY FROM STDIN is in progress.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.copying = False
+        self.copied = None
+        self.commits = 0
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def check(self):
+        if self.conn.copying:
+            raise RuntimeError("another command is already in progress")
+
+    def execute(self, query):
+        self.check()
+        self.pending = list(self.conn.rows)
+
+    def fetchmany(self, size):
+        self.check()
+        rows, self.pending = self.pending[:size], self.pending[size:]
+        return rows
+
+    def copy_expert(self, sql, reader, size):
+        self.check()
+        self.conn.copying = True
+        try:
+            self.conn.copied = (sql, b"".join(iter(lambda: reader.read(size), b"")))
+        finally:
+            self.conn.copying = False
+
+
+def test_convert_reads_and_copies_on_separate_connections(monkeypatch):
+    monkeypatch.setattr(csv_to_array, "CHUNK_SIZE", 1)
+    source = FakeConnection([("tt1", "nm1,nm2", None), ("tt2", "", "nm3")])
+    target = FakeConnection()
+    assert csv_to_array.load_crew(source, target) == 2
+    sql, data = target.copied
+    assert sql.startswith("COPY stadvdb.crew (tconst, directors, writers) FROM STDIN")
+    assert data.decode() == "tt1\t{nm1,nm2}\t\\N\ntt2\t{}\t{nm3}\n"
+    assert target.commits == 1
+
+
+def test_convert_on_one_connection_fails():
+    # The regression: FETCHing from the COPY's own connection mid-COPY
+    conn = FakeConnection([("tt1", "nm1", "nm2")])
+    with pytest.raises(RuntimeError):
+        csv_to_array.load_crew(conn, conn)
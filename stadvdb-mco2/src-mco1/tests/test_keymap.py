@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+from utils.keymap import KeyMap, parse_const_ids
+
+
+def test_parse_const_ids():
+    assert parse_const_ids(["tt0000001", "nm1234567", None, "bogus"]).tolist() == [1, 1234567, -1, -1]
+
+
+def test_lookup_resolves_known_ids_and_nulls_the_rest():
+    key_map = KeyMap.from_frame(
+        pd.DataFrame({"tconstid": ["tt0000009", "tt0000002", "tt0000005"], "title_key": [30, 10, 20]}),
+        "tconstid", "title_key",
+    )
+    keys = key_map.lookup(["tt0000002", "tt0000005", "tt0000009", "tt0000003", "tt9999999", None])
+    assert keys.dtype == "Int64"
+    assert keys.tolist() == [10, 20, 30, pd.NA, pd.NA, pd.NA]
+
+
+def test_lookup_on_an_empty_map():
+    key_map = KeyMap(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    assert key_map.lookup(["tt0000001"]).tolist() == [pd.NA]
+
+
+def test_save_and_open_round_trip(tmp_path):
+    KeyMap([3, 1, 2], [300, 100, 200]).save("titles", directory=str(tmp_path))
+    key_map = KeyMap.open("titles", directory=str(tmp_path))
+    assert len(key_map) == 3
+    assert key_map.lookup(["tt0000002", "tt0000003", "tt0000001"]).tolist() == [200, 300, 100]
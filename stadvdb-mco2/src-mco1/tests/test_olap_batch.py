@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from olap_batch import Moments, scan_query_3
+
+
+def test_moments_merge_matches_one_pass():
+    rng = np.random.default_rng(7)
+    values = rng.normal(1e6, 3.0, 1000)
+    merged = Moments()
+    for part in np.array_split(values, [1, 10, 400, 999]):
+        merged.add(part)
+    assert merged.n == 1000
+    assert np.isclose(merged.mean, values.mean(), rtol=0, atol=1e-6)
+    assert np.isclose(merged.variance, values.var(ddof=1), rtol=1e-9)
+
+
+def test_moments_small_groups():
+    m = Moments()
+    m.add(np.array([]))
+    m.add(np.array([4.0]))
+    assert (m.n, m.mean) == (1, 4.0)
+    assert np.isnan(m.variance)
+    m.add(np.array([6.0, 8.0]))
+    assert (m.n, m.mean, m.variance) == (3, 6.0, 4.0)
+
+
+def test_query_3_rounds_half_up():
+    consumer = scan_query_3(minVotes=0)
+    consumer.consume(pd.DataFrame({
+        "title_type": ["movie", "tvSeries", "movie", "movie", "movie", "videoGame"],
+        "num_votes": [10, 10, 10, 10, 10, 10],
+        "average_rating": [6.1, 8.0, 6.2, 6.2, 6.2, 1.0],
+    }))
+    result = consumer.result()
+    # 6.175 is a tie: ROUND(numeric) gives 6.18 where round() gives 6.17
+    assert result.values.tolist() == [["Television", 1, 8.0], ["Film", 4, 6.18]]
@@ -0,0 +1,16 @@
+import pandas as pd
+from sqlalchemy import create_engine
+from olap_cache import CachedOLAP
+
+
+class Backend:
+    def query_3(self, minVotes):
+        return pd.DataFrame({"source": ["local"], "min_votes": [minVotes]})
+
+
+def test_cached_olap_forwards_olap_settings():
+    queries = CachedOLAP(create_engine("sqlite://"), max_bytes=1 << 20, use_aggregates=False, backend=Backend())
+    assert queries.use_aggregates is False
+    assert queries.max_bytes == 1 << 20
+    # The backend answers the methods it implements, defaults filled in
+    assert queries.query_3().one() == ("local", 5000)
@@ -0,0 +1,109 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+from sqlalchemy import create_engine
+from olap_numpy import SNAPSHOT_TABLES, ColumnStore, NumPyBackend, encode, write_column
+from olap_queries import OLAP
+
+# Rows of the snapshot tables, as the SNAPSHOT_TABLES queries would return them
+RATINGS = pd.DataFrame([
+    # rating_tenths, num_votes, title_type, genre_1, is_adult, has_parent, start_year, date_decade, start_century, primary_title
+    (85, 9000, "movie", "Action", False, False, 1999, 1990, 1900, "Matrix"),
+    (None, 7000, "movie", "Drama", False, False, 1999, 1990, 1900, "Unrated"),
+    (72, 6000, "movie", "Comedy", True, True, 1999, 1990, 1900, "Sequel"),
+    (61, 100, "movie", "Action", False, False, 1999, 1990, 1900, "Obscure"),
+    (90, 8000, "tvSeries", "Drama", False, False, 2008, 2000, 2000, "Breaking"),
+    (64, 5500, "movie", None, True, False, 1895, 1890, 1800, "Arrival"),
+    (77, 12000, "short", "Comedy", False, True, 2010, 2010, 2000, "Piper"),
+], columns=list(SNAPSHOT_TABLES["ratings"][1]))
+TITLES = pd.DataFrame([
+    ("movie", 1999, None, 1990),
+    ("tvSeries", 1995, 2001, 1990),
+    ("tvSeries", 1998, 2000, 1990),
+    ("tvSeries", 2011, 2019, 2010),
+    ("tvSeries", 2012, 2013, 2010),
+    (None, None, None, None),
+], columns=list(SNAPSHOT_TABLES["titles"][1]))
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """A store written the way snapshot() writes one, from the frames above."""
+    manifest = {"generation": 1, "tables": {}}
+    for table, frame in (("ratings", RATINGS), ("titles", TITLES)):
+        columns = SNAPSHOT_TABLES[table][1]
+        vocabularies = {}
+        for column, kind in columns.items():
+            vocabulary = write_column(str(tmp_path), table, column, kind, [encode(frame[column].astype(object), kind)])
+            if vocabulary is not None:
+                vocabularies[column] = vocabulary
+        manifest["tables"][table] = {"rows": len(frame), "columns": columns, "vocabularies": vocabularies}
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    return NumPyBackend(ColumnStore(str(tmp_path)))
+
+
+def test_query_1_sorts_null_ratings_first(backend):
+    result = backend.query_1(minVotes=5000, startYear=1999, titleType="movie")
+    assert result["primary_title"].tolist() == ["Unrated", "Matrix", "Sequel"]
+    assert np.isnan(result["average_rating"][0])
+    assert result["average_rating"][1:].tolist() == [8.5, 7.2]
+    assert result["num_votes"].tolist() == [7000, 9000, 6000]
+
+
+def test_query_2_rollup(backend):
+    result = backend.query_2()
+    assert result.astype(object).where(result.notna(), None).values.tolist() == [
+        ["Film", "movie", 1], ["Film", None, 1],
+        ["Other", None, 1], ["Other", None, 1],
+        ["Television", "tvSeries", 4], ["Television", None, 4],
+        [None, None, 6],
+    ]
+
+
+def test_query_3_and_query_5(backend):
+    assert backend.query_3(minVotes=5000).values.tolist() == [["Television", 1, 9.0], ["Film", 5, 7.45]]
+    result = backend.query_5(minVotes=1000, minRating=6.0, maxRating=10.0)
+    assert result.values.tolist() == [[1890, 1], [1990, 2]]
+
+
+def test_query_7_orders_by_genre(backend):
+    result = backend.query_7(minVotes=50)
+    assert result["genre"].tolist() == ["Action", "Action", "Comedy", "Drama"]
+    assert result["rating"][:3].tolist() == [8.5, 6.1, 7.2]
+    assert np.isnan(result["rating"][3])
+    assert result["votes"].tolist() == [9000, 100, 6000, 7000]
+
+
+def test_t_tests_match_scipy(backend):
+    [row] = backend.t_test_5().values.tolist()
+    franchise, standalone = [6000, 12000], [9000, 7000, 100, 8000, 5500]
+    assert row[0] == pytest.approx(stats.ttest_ind(franchise, standalone, equal_var=False).statistic)
+    assert row[1:] == [2, 5]
+
+    [row] = backend.t_test_4().values.tolist()
+    assert row[0] == pytest.approx(stats.ttest_ind([6, 2], [8, 1], equal_var=False).statistic)
+    assert row[1:] == [2, 2]
+
+
+def test_olap_with_backend_returns_sql_results(backend):
+    # The engine is never used: NumPyBackend answers these methods
+    queries = OLAP(create_engine("sqlite://"), backend=backend)
+    assert queries.query_1(minVotes=5000, startYear=1999, titleType="movie").fetchall() == [
+        ("Unrated", None, 7000), ("Matrix", 8.5, 9000), ("Sequel", 7.2, 6000),
+    ]
+    assert queries.query_3(minVotes=5000).mappings().all()[0] == {
+        "broad_type": "Television", "number_of_titles": 1, "overall_average_rating": 9.0,
+    }
+    row = queries.t_test_5().one()
+    assert (row.n_franchise, row.n_standalone) == (2, 5)
+
+
+def test_streaming_olap_with_backend_returns_streamed_results(backend):
+    streamed = OLAP(create_engine("sqlite://"), backend=backend).streaming(batch_size=2).query_7(minVotes=50)
+    assert [len(frame) for frame in streamed.batches()] == [2, 2]
+    assert streamed.to_frame()["votes"].tolist() == [9000, 100, 6000, 7000]
+    assert list(streamed)[3] == ("Drama", None, 7000)
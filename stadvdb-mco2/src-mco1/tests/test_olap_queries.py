@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy import stats
+from sqlalchemy import create_engine, text
+from olap_queries import moments_t_test
+
+# rating values per agg_moments segment (title_type, genre_1)
+SEGMENTS = {
+    ("movie", "Action"): [6.1, 7.4, 5.0],
+    ("movie", "Drama"): [8.2, 7.9],
+    ("short", "Action"): [4.4, 6.0, 5.5, 7.1],
+    ("short", "Drama"): [9.0],
+}
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE agg_moments (
+                title_type TEXT, genre_1 TEXT, rating_n INTEGER, rating_sum REAL, rating_sq_sum REAL
+            )
+        """))
+        for (title_type, genre), values in SEGMENTS.items():
+            values = np.array(values)
+            connection.execute(text("INSERT INTO agg_moments VALUES (:t, :g, :n, :s, :q)"), {
+                "t": title_type, "g": genre, "n": len(values), "s": values.sum(), "q": (values ** 2).sum(),
+            })
+    return engine
+
+
+def run(engine, query, params):
+    # Same statement as on Postgres, without the schema and the casts
+    # SQLite does not parse
+    sql = str(query).replace("dw_schema.", "").replace("::bigint", "")
+    with engine.connect() as connection:
+        return connection.execute(text(sql), params).mappings().all()
+
+
+def test_welch_t_and_dof_match_scipy(engine):
+    query, params = moments_t_test({"genre_1": "Action"}, {"genre_1": "Drama"}, "rating")
+    assert params == {"a_genre_1": "Action", "b_genre_1": "Drama"}
+    [row] = run(engine, query, params)
+
+    a = np.array(SEGMENTS[("movie", "Action")] + SEGMENTS[("short", "Action")])
+    b = np.array(SEGMENTS[("movie", "Drama")] + SEGMENTS[("short", "Drama")])
+    va, vb = a.var(ddof=1) / len(a), b.var(ddof=1) / len(b)
+    assert row["t_statistic"] == pytest.approx(stats.ttest_ind(a, b, equal_var=False).statistic)
+    assert row["dof"] == pytest.approx((va + vb) ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1)))
+    assert (row["n_a"], row["n_b"]) == (7, 3)
+
+
+def test_empty_group_returns_no_row(engine):
+    query, params = moments_t_test({"title_type": "movie"}, {"title_type": "tvSeries"}, "rating")
+    assert run(engine, query, params) == []
+
+
+def test_group_conditions():
+    query, params = moments_t_test({"genre_1": ["Action", "Drama"], "title_type": None}, {}, "votes", dof=False)
+    assert params == {"a_genre_1": ["Action", "Drama"], "a_title_type": None}
+    sql = str(query)
+    assert "genre_1 = ANY(:a_genre_1) AND title_type IS NOT DISTINCT FROM :a_title_type" in sql
+    assert "FILTER (WHERE TRUE)" in sql
+    assert "SUM(votes_n)" in sql and "dof" not in sql
+
+
+def test_rejects_unknown_columns_and_metrics():
+    with pytest.raises(ValueError, match="metric"):
+        moments_t_test({}, {}, "runtime")
+    with pytest.raises(ValueError, match="cannot filter on 'region'"):
+        moments_t_test({"region": "US"}, {}, "rating")
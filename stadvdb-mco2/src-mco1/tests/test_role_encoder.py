@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from utils.keymap import RoleEncoder
+
+
+def principals(*roles):
+    return pd.DataFrame(roles, columns=["category", "job", "characters"])
+
+
+def test_encode_numbers_new_roles_once():
+    encoder = RoleEncoder()
+    keys, new_roles = encoder.encode(principals(
+        ("actor", None, '["Kirk"]'),
+        ("director", None, None),
+        ("actor", None, '["Kirk"]'),
+    ))
+    assert keys[0] == keys[2] != keys[1]
+    assert sorted(keys.tolist()) == [1, 1, 2]
+    assert list(new_roles.columns) == ["role_key", "role_hash", "category", "job", "character_name"]
+    assert sorted(new_roles["role_key"]) == [1, 2]
+    by_key = new_roles.set_index("role_key")
+    assert by_key.loc[keys[1], "category"] == "director"
+    assert by_key.loc[keys[0], "character_name"] == '["Kirk"]'
+
+
+def test_encode_reuses_keys_across_chunks():
+    encoder = RoleEncoder()
+    first, _ = encoder.encode(principals(("writer", "novel", None)))
+    keys, new_roles = encoder.encode(principals(("composer", None, None), ("writer", "novel", None)))
+    assert keys[1] == first[0]
+    assert keys[0] == 2
+    assert new_roles["category"].tolist() == ["composer"]
+
+
+def test_encode_with_known_roles_and_assigned_keys():
+    known = RoleEncoder()
+    _, roles = known.encode(principals(("self", None, '["Self"]')))
+    encoder = RoleEncoder(roles["role_hash"].to_numpy(), np.array([40]))
+    assigned = []
+
+    def assign_keys(new_roles):
+        assigned.append(new_roles["category"].tolist())
+        return [100] * len(new_roles)
+
+    keys, new_roles = encoder.encode(principals(("self", None, '["Self"]'), ("editor", None, None)), assign_keys)
+    assert keys.tolist() == [40, 100]
+    assert assigned == [["editor"]]
+    assert new_roles["role_key"].tolist() == [100]
+    assert encoder.next_key == 101
@@ -0,0 +1,59 @@
+import pytest
+from utils.scheduler import run_dag, select_stages
+
+GRAPH = {
+    "dim_a": [],
+    "dim_b": [],
+    "fact": ["dim_a", "dim_b"],
+    "index": ["fact"],
+    "other": ["dim_b"],
+}
+GROUPS = {"dims": ["dim_a", "dim_b"], "finalize": ["index"]}
+
+
+def test_select_stages_defaults_to_everything():
+    assert select_stages(GRAPH, GROUPS) == list(GRAPH)
+
+
+def test_select_stages_only_expands_groups_in_graph_order():
+    assert select_stages(GRAPH, GROUPS, only=["index", "dims"]) == ["dim_a", "dim_b", "index"]
+
+
+def test_select_stages_from_takes_the_whole_subgraph():
+    assert select_stages(GRAPH, GROUPS, start="dim_b") == ["dim_b", "fact", "index", "other"]
+    assert select_stages(GRAPH, GROUPS, only=["dims", "other"], start="dim_b") == ["dim_b", "other"]
+
+
+def test_select_stages_rejects_unknown_names():
+    with pytest.raises(ValueError, match="Unknown stage or group: nope"):
+        select_stages(GRAPH, GROUPS, only=["nope"])
+
+
+# Workers run in a process pool, so they are module-level functions
+def stage_name(stage):
+    return stage.upper()
+
+
+def fail_dim_b(stage):
+    if stage == "dim_b":
+        raise RuntimeError("boom")
+    return stage
+
+
+def test_run_dag_runs_every_stage():
+    results, failed = run_dag(GRAPH, list(GRAPH), stage_name, max_workers=2)
+    assert results == {stage: stage.upper() for stage in GRAPH}
+    assert failed == {}
+
+
+def test_run_dag_skips_everything_downstream_of_a_failure():
+    results, failed = run_dag(GRAPH, list(GRAPH), fail_dim_b, max_workers=2)
+    assert set(results) == {"dim_a"}
+    assert isinstance(failed["dim_b"], RuntimeError)
+    assert failed["fact"] == failed["index"] == failed["other"] == "skipped: a dependency failed"
+
+
+def test_run_dag_treats_unselected_dependencies_as_loaded():
+    results, failed = run_dag(GRAPH, ["fact", "index"], fail_dim_b, max_workers=2)
+    assert results == {"fact": "fact", "index": "index"}
+    assert failed == {}